@@ -0,0 +1,91 @@
+"""
+Fixtures for the benchmarks: Synthetic mailboxes (by default of 1000
+messages; set `BENCHMARK_MESSAGES=1000,100000,1000000` for larger ones), served
+by the local Gmail stand-in, and the data each pipeline stage takes as input.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+import pyarrow as pa
+import pytest
+
+# Add data pipeline's root directory to path (see tests/conftest.py)
+sys.path.append(str(Path(__file__).parent.parent.resolve()))
+
+from domain_models.email_thread import EmailThread
+from fake_gmail_server import FakeGmailServer, FakeMailbox, generate_threads
+from parquet_sink import ParquetRowSink, read_dataset
+from thread_api import _parse_thread_response
+
+MAILBOX_SIZES = [
+    int(size) for size in os.environ.get('BENCHMARK_MESSAGES', '1000').split(',')
+]
+ROUNDS = int(os.environ.get('BENCHMARK_ROUNDS', 3))
+
+
+@pytest.fixture(scope='session', params=MAILBOX_SIZES, ids=lambda n: f'{n}msgs')
+def responses(request) -> list[dict]:
+    """threads.get responses with (at least) the requested number of messages."""
+    responses = []
+    n_messages = 0
+    for thread in generate_threads(request.param):
+        if n_messages >= request.param:
+            break
+        responses.append(thread)
+        n_messages += len(thread['messages'])
+    return responses
+
+
+@pytest.fixture(scope='session')
+def server(responses):
+    server = FakeGmailServer(FakeMailbox(responses))
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def threads(responses) -> list[EmailThread]:
+    return [
+        _parse_thread_response(response['id'], response)[0]
+        for response in responses
+    ]
+
+
+@pytest.fixture(scope='session')
+def messages(threads, tmp_path_factory) -> pa.Table:
+    path = str(tmp_path_factory.mktemp('dataset') / 'dataset')
+    with ParquetRowSink(path) as sink:
+        for thread in threads:
+            sink.add_thread(thread)
+    return read_dataset(path)
+
+
+@pytest.fixture
+def measure(benchmark) -> Callable[..., Any]:
+    """
+    Runs `fn(*args)` once to measure its peak memory (tracing allocations
+    slows down code, so this isn't timed), then times it in `ROUNDS` rounds.
+    Memory is stored in the results' `extra_info`: the peak of the Python heap,
+    and the memory Arrow still holds afterwards (e.g., for returned tables).
+    """
+    def run(fn: Callable, *args: Any) -> Any:
+        arrow_bytes = pa.total_allocated_bytes()
+        tracemalloc.start()
+        try:
+            result = fn(*args)
+            _, peak_python_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_python_bytes'] = peak_python_bytes
+        benchmark.extra_info['arrow_bytes'] = \
+            pa.total_allocated_bytes() - arrow_bytes
+        del result
+
+        return benchmark.pedantic(fn, args=args, rounds=ROUNDS, iterations=1)
+    return run
@@ -0,0 +1,102 @@
+"""
+Benchmarks of each stage of the data pipeline (requires pytest-benchmark):
+
+    make benchmark          # Saves results to benchmarks/results/
+    make benchmark-compare  # Fails if a stage got slower than the last save
+
+The file name doesn't match pytest's test file patterns, so the benchmarks
+only run when requested explicitly.
+"""
+import itertools
+
+import pyarrow as pa
+
+from body_extraction import get_backend, get_body_as_text
+from email_utils.gmail_client import GmailSession
+from parquet_sink import ParquetRowSink
+from preprocessing.blazing_text import (
+    prepare_features, write_augmented_manifest, write_plaintext
+)
+from thread_api import (
+    get_threads_with_details,
+    get_threads_with_details_batched,
+    list_all_threads,
+)
+
+
+def test_list_threads(measure, server, responses):
+    gmail = GmailSession(api_endpoint=server.url).get_client()
+
+    thread_ids = measure(list_all_threads, None, gmail)
+
+    assert len(thread_ids) == len(responses)
+
+
+def test_fetch_details_batched(measure, server, responses):
+    gmail = GmailSession(api_endpoint=server.url).get_client()
+    thread_ids = [response['id'] for response in responses]
+
+    def fetch():
+        return list(get_threads_with_details_batched(thread_ids, gmail=gmail))
+
+    assert len(measure(fetch)) == len(thread_ids)
+
+
+def test_fetch_details_concurrently(measure, server, responses):
+    session = GmailSession(api_endpoint=server.url)
+    thread_ids = [response['id'] for response in responses]
+
+    def fetch():
+        return list(get_threads_with_details(
+            thread_ids,
+            max_requests_per_second=None,
+            client_factory=session.get_client,
+        ))
+
+    assert len(measure(fetch)) == len(thread_ids)
+
+
+def test_extract_bodies(measure, responses):
+    html_to_text = get_backend()
+    msgs = [msg for response in responses for msg in response['messages']]
+
+    def extract():
+        return [get_body_as_text(msg, html_to_text) for msg in msgs]
+
+    assert all(measure(extract))
+
+
+def test_transform_threads(measure, threads):
+    def transform():
+        return [thread.get_transformed_data() for thread in threads]
+
+    assert len(measure(transform)) == len(threads)
+
+
+def test_write_dataset(measure, threads, tmp_path):
+    round_ = itertools.count()
+
+    def write() -> int:
+        with ParquetRowSink(str(tmp_path / f'dataset-{next(round_)}')) as sink:
+            for thread in threads:
+                sink.add_thread(thread)
+        return sink.n_rows
+
+    assert measure(write) > 0
+
+
+def test_prepare_features(measure, messages):
+    # Splitting on whitespace rather than NLTK, which is an optional dependency
+    features: pa.Table = measure(prepare_features, messages, None, str.split)
+
+    assert features.num_rows > 0
+
+
+def test_export(measure, messages, tmp_path):
+    features = prepare_features(messages, tokenizer=str.split)
+
+    def export() -> list[str]:
+        return write_plaintext(features, str(tmp_path / 'input.txt')) \
+            + write_augmented_manifest(features, str(tmp_path / 'input.jsonl'))
+
+    assert len(measure(export)) == 2
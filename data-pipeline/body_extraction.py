@@ -0,0 +1,128 @@
+"""
+Extract an email's body as plain text from a Gmail message payload.
+
+Messages are often nested multipart trees (e.g., `multipart/mixed` containing
+`multipart/alternative` with a `text/plain` and a `text/html` part), so we walk
+the whole tree and prefer the `text/plain` part, which needs no HTML parsing.
+Only HTML-only messages are converted, using a pluggable backend. Parsing HTML
+is the CPU hot spot of the pipeline, so besides BeautifulSoup (the default, for
+backwards compatibility), faster C-based backends can be chosen via the
+`HTML_TO_TEXT_BACKEND` environment variable. (Being an environment variable,
+the setting also reaches worker processes.)
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import codecs
+import os
+import re
+from base64 import urlsafe_b64decode
+from typing import Callable, Iterator
+
+HtmlToText = Callable[[bytes], str]
+
+DEFAULT_BACKEND = 'beautifulsoup'
+_CHARSET_PATTERN = re.compile(r'charset="?([\w-]+)"?', re.IGNORECASE)
+
+
+def _beautifulsoup_to_text(html: bytes) -> str:
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, features='html.parser').get_text()
+
+
+def _lxml_to_text(html: bytes) -> str:
+    # Optional dependency: `pip install lxml`
+    import lxml.html
+    return lxml.html.fromstring(html).text_content()
+
+
+def _selectolax_to_text(html: bytes) -> str:
+    # Optional dependency: `pip install selectolax`
+    from selectolax.parser import HTMLParser
+    return HTMLParser(html).text(separator='')
+
+
+BACKENDS: dict[str, HtmlToText] = {
+    'beautifulsoup': _beautifulsoup_to_text,
+    'lxml': _lxml_to_text,
+    'selectolax': _selectolax_to_text,
+}
+
+
+def get_backend(name: str | None = None) -> HtmlToText:
+    """
+    Returns backend by name. If no name is given, uses the
+    `HTML_TO_TEXT_BACKEND` environment variable.
+    """
+    if name is None:
+        name = os.environ.get('HTML_TO_TEXT_BACKEND', DEFAULT_BACKEND)
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f'Unknown HTML to text backend {name!r}. Choose one of '
+            f'{list(BACKENDS)}.'
+        ) from None
+
+
+def get_body_as_text(
+    msg: dict,
+    html_to_text: HtmlToText | None = None,
+) -> str:
+    """Returns empty string if message has no body."""
+    part = find_body_part(msg['payload'])
+    if part is None:
+        return ''
+
+    body = urlsafe_b64decode(part['body']['data'])
+    if part.get('mimeType') == 'text/plain':
+        return body.decode(_get_charset(part), errors='replace')
+
+    # HTML (or parts without mime type, which we treat as HTML, like we always
+    # have)
+    if html_to_text is None:
+        html_to_text = get_backend()
+    return html_to_text(body)
+
+
+def find_body_part(payload: dict) -> dict | None:
+    """
+    Returns the first `text/plain` part holding data, or else the first
+    `text/html` part, or else the first part holding data that isn't an
+    attachment.
+    """
+    html = None
+    fallback = None
+    for part in _walk(payload):
+        if not part.get('body', {}).get('data') or part.get('filename'):
+            continue
+
+        mime_type = part.get('mimeType')
+        if mime_type == 'text/plain':
+            return part
+        elif mime_type == 'text/html':
+            html = html or part
+        elif not (mime_type or '').startswith(('image/', 'audio/', 'video/')):
+            fallback = fallback or part
+
+    return html or fallback
+
+
+def _walk(part: dict) -> Iterator[dict]:
+    """Depth-first traversal, in the order parts appear in the message."""
+    yield part
+    for child in part.get('parts', []):
+        yield from _walk(child)
+
+
+def _get_charset(part: dict) -> str:
+    for header in part.get('headers', []):
+        if header['name'].lower() == 'content-type':
+            match = _CHARSET_PATTERN.search(header['value'])
+            if match:
+                charset = match.group(1)
+                try:
+                    codecs.lookup(charset)
+                    return charset
+                except LookupError:
+                    break
+    return 'utf-8'
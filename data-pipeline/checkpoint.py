@@ -0,0 +1,186 @@
+"""
+Checkpoints for the full download, so a crash (or expired token) doesn't lose
+all progress. Transformed rows are committed in chunks to Parquet files. Next
+to each part file, a small JSON file records which threads it holds (their
+fingerprints) and their dead letters; it's written last, so it marks the part
+as committed. Commits only write their own chunk, and the progress file (with
+the history id the download started at) is only written once. A restarted
+download skips the threads of committed parts.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import os
+import shutil
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+from data_models import DeadLetter, SyncState, ThreadFingerprint, ThreadId
+from dead_letter_queue import to_dead_letters
+from domain_models.email_thread import EmailThread
+from instrumentation import METRICS
+from parquet_sink import ROW_SCHEMA, empty_columns
+
+DEFAULT_CHECKPOINT_DIR = 'checkpoint'
+DEFAULT_CHUNK_SIZE = 1000  # Threads per commit
+
+
+class ExtractionProgress(BaseModel):
+    # Fingerprints double as the record of which threads were processed
+    sync_state: SyncState
+    # Files holding the rows of processed threads, in order
+    parts: list[str] = []
+    dead_letters: list[DeadLetter] = []
+
+
+class CommittedPart(BaseModel):
+    """Written next to each part file, once the part is durable."""
+    threads: dict[ThreadId, ThreadFingerprint]
+    dead_letters: list[DeadLetter] = []
+
+
+class ExtractionCheckpoint:
+    def __init__(
+        self,
+        directory: str = DEFAULT_CHECKPOINT_DIR,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.progress: ExtractionProgress | None = None
+        self._columns: dict[str, list] = empty_columns()
+        self._fingerprints: dict[ThreadId, ThreadFingerprint] = {}
+        self._dead_letters: list[DeadLetter] = []
+
+    @property
+    def _progress_path(self) -> str:
+        return os.path.join(self.directory, 'progress.json')
+
+    def _part_path(self, index: int, extension: str) -> str:
+        return os.path.join(self.directory, f'part-{index:05d}{extension}')
+
+    def load_or_start(self, history_id: str) -> ExtractionProgress:
+        """
+        Resume from the last commit if there is one. Otherwise start from
+        scratch with `history_id` (which is only used when starting, because
+        resumed downloads need to keep the history id of the first attempt).
+        """
+        if not os.path.exists(self._progress_path):
+            os.makedirs(self.directory, exist_ok=True)
+            # Only holds the history id; parts record the threads
+            _write_durably(
+                self._progress_path,
+                lambda path: _write_text(
+                    path, SyncState(history_id=history_id).model_dump_json()
+                ),
+            )
+
+        with open(self._progress_path, 'r') as f:
+            self.progress = ExtractionProgress(
+                sync_state=SyncState.model_validate_json(f.read())
+            )
+        # Parts are committed in order, so stop at the first uncommitted one
+        # (whose part file, if any, is overwritten by the next commit).
+        index = 0
+        while os.path.exists(self._part_path(index, '.json')):
+            with open(self._part_path(index, '.json'), 'r') as f:
+                part = CommittedPart.model_validate_json(f.read())
+            self.progress.sync_state.threads.update(part.threads)
+            self.progress.dead_letters.extend(part.dead_letters)
+            self.progress.parts.append(
+                os.path.basename(self._part_path(index, '.parquet'))
+            )
+            index += 1
+        return self.progress
+
+    def is_processed(self, thread_id: ThreadId) -> bool:
+        assert self.progress is not None, 'Call load_or_start() first.'
+        return (
+            thread_id in self.progress.sync_state.threads
+            or thread_id in self._fingerprints
+        )
+
+    def add(self, thread: EmailThread, dlq: list[dict] | None = None) -> None:
+        """
+        Buffer thread's rows (and its dead letters, as returned by
+        thread_api), and commit once a chunk is complete.
+        """
+        with METRICS.timer('assemble_rows'):
+            for name, values in thread.get_columns().items():
+                self._columns[name].extend(values)
+        self._fingerprints[thread.thread_id] = ThreadFingerprint(
+            history_id=thread.history_id,
+            msg_ids=thread.msg_ids,
+        )
+        if dlq:
+            self._dead_letters.extend(to_dead_letters(thread, dlq))
+
+        if len(self._fingerprints) >= self.chunk_size:
+            self.commit()
+
+    def commit(self) -> None:
+        """
+        Durably write buffered rows first, then record them (and their dead
+        letters) as processed.
+        """
+        assert self.progress is not None, 'Call load_or_start() first.'
+        if not self._fingerprints:
+            return
+
+        index = len(self.progress.parts)
+        part = CommittedPart(
+            threads=self._fingerprints, dead_letters=self._dead_letters
+        )
+        with METRICS.timer('commit_checkpoint'):
+            _write_durably(
+                self._part_path(index, '.parquet'),
+                lambda path: pq.write_table(
+                    pa.Table.from_pydict(self._columns, schema=ROW_SCHEMA),
+                    path,
+                ),
+            )
+            _write_durably(
+                self._part_path(index, '.json'),
+                lambda path: _write_text(path, part.model_dump_json()),
+            )
+
+        self.progress.parts.append(
+            os.path.basename(self._part_path(index, '.parquet'))
+        )
+        self.progress.sync_state.threads.update(self._fingerprints)
+        self.progress.dead_letters.extend(self._dead_letters)
+
+        self._columns = empty_columns()
+        self._fingerprints = {}
+        self._dead_letters = []
+
+    def iter_batches(self) -> Iterator[pa.RecordBatch]:
+        """Stream all committed rows, one record batch at a time."""
+        assert self.progress is not None, 'Call load_or_start() first.'
+        for part in self.progress.parts:
+            path = os.path.join(self.directory, part)
+            yield from pq.ParquetFile(path).iter_batches()
+
+    def clear(self) -> None:
+        """Delete checkpoint, once its data has been persisted elsewhere."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.progress = None
+
+
+def _write_durably(path: str, write) -> None:
+    """
+    Write to a temporary file, flush it to disk, then atomically move it in
+    place, so a crash never leaves a partially written file behind.
+    """
+    tmp_path = f'{path}.tmp'
+    write(tmp_path)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, 'w') as f:
+        f.write(text)
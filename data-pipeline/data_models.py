@@ -14,3 +14,29 @@ class Message(BaseModel):
     sender: str
     body: str
     timestamp: int
+
+
+class ThreadFingerprint(BaseModel):
+    """What we need to know about a downloaded thread to update it later."""
+    history_id: str | None
+    msg_ids: list[MessageId]
+
+
+class SyncState(BaseModel):
+    """Persisted between runs to only download threads that changed."""
+    history_id: str
+    threads: dict[ThreadId, ThreadFingerprint] = {}
+
+
+class DeadLetter(BaseModel):
+    """
+    Persisted record of a message (or whole thread, if `msg_id` is `None`)
+    that failed validation. Rather than the raw message, it stores a pointer
+    to the raw thread payload in the cache: thread id plus history id.
+    """
+    thread_id: ThreadId
+    msg_id: MessageId | None
+    history_id: str | None
+    error_class: str
+    error_message: str
+    failed_at: int  # Unix epoch (ms)
@@ -0,0 +1,191 @@
+"""
+Fast loading of data for interactive use (scripts and notebooks). Instead of
+pickling DataFrames, which deserializes the whole object graph into Python
+objects on every load, data is stored as uncompressed Arrow IPC (Feather v2)
+files. These are memory-mapped when opened, so loading takes milliseconds
+and pages are only read from disk when used. Columns are converted to pandas
+lazily, one at a time, via `LazyFrame`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import hashlib
+import os
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from parquet_sink import read_dataset
+
+# Schema metadata of cached copies: version of the dataset they were built from
+_DATASET_VERSION_KEY = b'dataset_version'
+
+
+def write_frame(data: pd.DataFrame | pa.Table, path: str) -> None:
+    """
+    Write DataFrame (including its index) or Arrow table to `path`. Files
+    are uncompressed, since compressed buffers can't be memory-mapped.
+    """
+    tmp_path = f'{path}.tmp'
+    feather.write_feather(data, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def open_frame(path: str, arrow_backed: bool = False) -> LazyFrame:
+    """Memory-map file written by `write_frame()`, without reading it."""
+    return LazyFrame(
+        feather.read_table(path, memory_map=True), arrow_backed=arrow_backed
+    )
+
+
+def read_frame(path: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """Drop-in replacement for `pd.read_pickle()`."""
+    return open_frame(path).to_pandas(columns)
+
+
+def open_dataset_cached(
+    dataset_path: str,
+    cache_path: str,
+    columns: list[str] | None = None,
+    arrow_backed: bool = False,
+) -> LazyFrame:
+    """
+    Open the Parquet dataset written by `prepare_data.py` via an Arrow IPC
+    copy, which is (re)built whenever the dataset's files changed (see
+    `dataset_version()`), or it lacks some of `columns`.
+    """
+    version = dataset_version(dataset_path)
+    if os.path.exists(cache_path):
+        frame = open_frame(cache_path, arrow_backed=arrow_backed)
+        metadata = frame.table.schema.metadata or {}
+        if (
+            metadata.get(_DATASET_VERSION_KEY) == version.encode()
+            and not set(columns or []) - set(frame.columns)
+        ):
+            return frame
+
+    table = read_dataset(dataset_path, columns=columns)
+    write_frame(
+        table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            _DATASET_VERSION_KEY: version,
+        }),
+        cache_path,
+    )
+    return open_frame(cache_path, arrow_backed=arrow_backed)
+
+
+def dataset_version(dataset_path: str) -> str:
+    """
+    Fingerprint of the paths, sizes, and modification times of the dataset's
+    files. Unlike the mtime of the dataset's directory, it changes whenever
+    any partition file is added, removed, or rewritten.
+    """
+    if os.path.isfile(dataset_path):
+        paths = [dataset_path]
+    else:
+        paths = sorted(
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(dataset_path)
+            for name in names
+        )
+
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(
+            f'{os.path.relpath(path, dataset_path)}\0{stat.st_size}\0'
+            f'{stat.st_mtime_ns}\n'.encode()
+        )
+    return digest.hexdigest()
+
+
+class LazyFrame:
+    """
+    Read-only, DataFrame-like view of a (memory-mapped) Arrow table. Each
+    column is converted to a pandas Series on first access, and then kept.
+
+    With `arrow_backed`, Series use pyarrow dtypes, so even string columns
+    point into the memory-mapped file rather than being copied into Python
+    objects.
+    """
+    def __init__(self, table: pa.Table, arrow_backed: bool = False):
+        self.table = table
+        self.arrow_backed = arrow_backed
+        self._series: dict[str, pd.Series] = {}
+        self._index: pd.Index | None = None
+
+        pandas_metadata = table.schema.pandas_metadata or {}
+        self._index_columns: list = pandas_metadata.get('index_columns', [])
+        stored_index_columns = {
+            column for column in self._index_columns
+            if isinstance(column, str)
+        }
+        self.columns = [
+            name for name in table.column_names
+            if name not in stored_index_columns
+        ]
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def __getitem__(self, name: str) -> pd.Series:
+        if name not in self._series:
+            if name not in self.columns:
+                raise KeyError(name)
+            series = self._to_pandas(self.table.column(name))
+            series.index = self.index
+            series.name = name
+            self._series[name] = series
+        return self._series[name]
+
+    def __getattr__(self, name: str) -> pd.Series:
+        # Allow `frame.body`, like for DataFrames
+        if name.startswith('_') or name not in self.__dict__.get('columns', []):
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def index(self) -> pd.Index:
+        if self._index is None:
+            self._index = self._create_index()
+        return self._index
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self), len(self.columns)
+
+    def to_pandas(self, columns: list[str] | None = None) -> pd.DataFrame:
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame(
+            {name: self[name].array for name in columns}, index=self.index
+        )
+
+    def _create_index(self) -> pd.Index:
+        if not self._index_columns:
+            return pd.RangeIndex(len(self))
+
+        levels = []
+        for column in self._index_columns:
+            if isinstance(column, dict):  # RangeIndex is stored as metadata
+                levels.append(pd.RangeIndex(
+                    column['start'], column['stop'], column['step'],
+                    name=column['name'],
+                ))
+            else:
+                levels.append(pd.Index(
+                    self._to_pandas(self.table.column(column)).array,
+                    name=None if column.startswith('__index_level_') else column,
+                ))
+        if len(levels) == 1:
+            return levels[0]
+        return pd.MultiIndex.from_arrays(levels)
+
+    def _to_pandas(self, column: pa.ChunkedArray) -> pd.Series:
+        if self.arrow_backed:
+            return column.to_pandas(types_mapper=pd.ArrowDtype)
+        return column.to_pandas()
@@ -0,0 +1,118 @@
+"""
+Persisted dead letter queue. Messages that fail validation used to be kept in
+memory (together with the full raw message) and then thrown away. Now they are
+streamed to a JSON Lines file, one compact `DeadLetter` per line, which can be
+queried with pyarrow/pandas, and replayed by `reprocess_dlq.py` once the
+extractor is fixed.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import os
+import time
+from typing import Iterable
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_models import DeadLetter, ThreadId
+from domain_models.email_thread import EmailThread
+from instrumentation import METRICS
+
+DEFAULT_DLQ_PATH = 'dlq.jsonl'
+# Long error messages (e.g., pydantic's) don't tell us much more
+MAX_ERROR_MESSAGE_LENGTH = 1000
+DEAD_LETTER_SCHEMA = pa.schema([
+    ('thread_id', pa.string()),
+    ('msg_id', pa.string()),
+    ('history_id', pa.string()),
+    ('error_class', pa.dictionary(pa.int32(), pa.string())),
+    ('error_message', pa.string()),
+    ('failed_at', pa.int64()),
+])
+
+
+class DeadLetterQueue:
+    def __init__(self, path: str = DEFAULT_DLQ_PATH):
+        self.path = path
+        self.n_added = 0
+
+    def add(self, thread: EmailThread, dlq: list[dict]) -> None:
+        """Append a thread's dead letters, as returned by thread_api."""
+        if dlq:
+            self.append(to_dead_letters(thread, dlq))
+
+    def append(self, dead_letters: Iterable[DeadLetter]) -> None:
+        lines = [letter.model_dump_json() + '\n' for letter in dead_letters]
+        # Append per thread, so a crash loses at most the current thread
+        with open(self.path, 'a') as f:
+            f.writelines(lines)
+        self.n_added += len(lines)
+        METRICS.increment('dlq_entries', len(lines))
+
+    def read(self) -> list[DeadLetter]:
+        """
+        Returns all dead letters. If a message was dead-lettered more than
+        once (e.g., when a download is resumed), only the latest is kept.
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        latest: dict[tuple[ThreadId, str | None], DeadLetter] = {}
+        with open(self.path, 'r') as f:
+            for line in f:
+                letter = DeadLetter.model_validate_json(line)
+                latest[(letter.thread_id, letter.msg_id)] = letter
+        return list(latest.values())
+
+    def to_table(self) -> pa.Table:
+        """Dead letters as Arrow table, e.g. for `.to_pandas()` analysis."""
+        return pa.Table.from_pylist(
+            [letter.model_dump() for letter in self.read()],
+            schema=DEAD_LETTER_SCHEMA,
+        )
+
+    def export_parquet(self, path: str) -> None:
+        pq.write_table(self.to_table(), path)
+
+    def rewrite(self, dead_letters: Iterable[DeadLetter]) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(
+                letter.model_dump_json() + '\n' for letter in dead_letters
+            )
+        os.replace(tmp_path, self.path)
+
+    def drop_threads(self, thread_ids: Iterable[ThreadId]) -> None:
+        """Remove dead letters of threads that will be processed again."""
+        thread_ids = set(thread_ids)
+        if not thread_ids or not os.path.exists(self.path):
+            return
+        self.rewrite(
+            letter for letter in self.read()
+            if letter.thread_id not in thread_ids
+        )
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def to_dead_letters(thread: EmailThread, dlq: list[dict]) -> list[DeadLetter]:
+    """
+    Convert thread_api's in-memory dead letters (which hold the exception
+    and either the raw message or, if the whole thread failed, its id).
+    """
+    failed_at = int(time.time() * 1000)
+    dead_letters = []
+    for entry in dlq:
+        exception = entry['exception']
+        msg = entry.get('message') or {}
+        dead_letters.append(DeadLetter(
+            thread_id=thread.thread_id,
+            msg_id=msg.get('id'),
+            history_id=thread.history_id,
+            error_class=type(exception).__name__,
+            error_message=str(exception)[:MAX_ERROR_MESSAGE_LENGTH],
+            failed_at=failed_at,
+        ))
+    return dead_letters
@@ -1,37 +1,102 @@
-# Enable current type hints for older Python version (<3.10) 
+# Enable current type hints for older Python version (<3.10)
 from __future__ import annotations
-import datetime
+from array import array
 from data_models import MessageId, Message, ThreadId
+from sender_index import parse_sender
 
 MY_EMAIL_ADDRESS = 'thomas.loeber73@gmail.com'  # Todo: Make env variable
 
 class EmailThread:
-    def __init__(self, thread_id: ThreadId, messages: list[Message]):
+    # Threads are created for every thread in the mailbox, so avoid a per
+    # instance __dict__.
+    __slots__ = (
+        'thread_id',
+        'history_id',
+        'msg_ids',
+        'senders',
+        'msg_body',
+        'timestamps',
+        'n_msgs',
+        'index_of_first_msg_replied_to',
+        '_msgs_to_discard',
+    )
+
+    def __init__(
+        self,
+        thread_id: ThreadId,
+        messages: list[Message],
+        history_id: str | None = None,
+    ):
+        self._init_columns(
+            thread_id=thread_id,
+            msg_ids=[msg.msg_id for msg in messages],
+            senders=[msg.sender for msg in messages],
+            msg_body=[msg.body for msg in messages],
+            timestamps=array('q', [msg.timestamp for msg in messages]),
+            history_id=history_id,
+        )
+
+    @classmethod
+    def from_columns(
+        cls,
+        thread_id: ThreadId,
+        msg_ids: list[MessageId],
+        senders: list[str],
+        msg_body: list[str],
+        timestamps: list[int],
+        history_id: str | None = None,
+    ) -> EmailThread:
+        """Create thread from (already validated) columns of its messages."""
+        thread = cls.__new__(cls)
+        thread._init_columns(
+            thread_id=thread_id,
+            msg_ids=msg_ids,
+            senders=senders,
+            msg_body=msg_body,
+            timestamps=array('q', timestamps),
+            history_id=history_id,
+        )
+        return thread
+
+    def _init_columns(
+        self,
+        thread_id: ThreadId,
+        msg_ids: list[MessageId],
+        senders: list[str],
+        msg_body: list[str],
+        timestamps: array,
+        history_id: str | None,
+    ) -> None:
         self.thread_id = thread_id
-        
-        # Store msg ids and senders as list for easier processing later
-        self.msg_ids = [msg.msg_id for msg in messages]
-        self.senders = [msg.sender for msg in messages]
-        self.msg_body = [msg.body for msg in messages]
-        self.timestamps = [msg.timestamp for msg in messages]
-        self.n_msgs = len(messages)
-
-        # Already compute this crucial field we always need twice
+        # Changes whenever the thread changes (used for incremental syncs)
+        self.history_id = history_id
+
+        # Store messages column-wise, which is the format we output them in
+        self.msg_ids = msg_ids
+        self.senders = senders
+        self.msg_body = msg_body
+        self.timestamps = timestamps
+        self.n_msgs = len(msg_ids)
+
+        # Already compute these crucial fields we always need
         self.index_of_first_msg_replied_to = \
             self._find_index_of_first_msg_replied_to()
+        # Set, so checking each message against it is O(1)
+        self._msgs_to_discard = set(self._compute_messages_to_discard())
 
     def _find_index_of_first_msg_replied_to(self) -> int | None:
         """If no msg elicited reply, returns `None`."""
-        
-        # Note: The reason for having this separate method returning index is 
-        # the result of an earlier architecture that used list.index(), before 
-        # realizing the need for full-text search. 
-        # ToDo: Refactor to return msgs replied to and msgs to ignore directly. 
+
+        # Note: The reason for having this separate method returning index is
+        # the result of an earlier architecture that used list.index(), before
+        # realizing the need for full-text search.
+        # ToDo: Refactor to return msgs replied to and msgs to ignore directly.
 
         for i in range(len(self.senders)):
-            # Need to do full text search because field can be of the form
-            # `John Doe <john.doe@email.com>`
-            if MY_EMAIL_ADDRESS in self.senders[i]:
+            # Field can be of the form `John Doe <john.doe@email.com>`, so
+            # compare parsed addresses (each distinct header is only parsed
+            # once, see sender_index.py).
+            if parse_sender(self.senders[i]).address == MY_EMAIL_ADDRESS:
                 # If my msg started the thread, we can ignore whole thread
                 if i == 0:
                     return None
@@ -40,16 +105,15 @@ class EmailThread:
                     return i - 1
 
         # If my email is not found in thread, there is no msg eliciting reply
-        self.index_of_first_msg_replied_to = None 
         return None
-            
+
 
     def find_msg_replied_to(self) -> MessageId | None:
         """
-        Returns id of message eliciting reply, if there is one. Otherwise 
-        returns `None`. 
+        Returns id of message eliciting reply, if there is one. Otherwise
+        returns `None`.
         """
-        # If no msg elicited reply, return None. Handle this when calling 
+        # If no msg elicited reply, return None. Handle this when calling
         # this method. NOTE: `is None` is not redundant! Without it, the index
         # value 0 is cast to boolean and evaluates to False, so returns None!
         if self.index_of_first_msg_replied_to is None:
@@ -57,61 +121,72 @@ class EmailThread:
 
         else:
             return self.msg_ids[self.index_of_first_msg_replied_to]
-        
+
 
     def find_messages_to_discard(self) -> list[MessageId] | None:
         """
         Enables discarding:
         - any messages after the one eliciting reply, so they don't distort our
-         data. 
+         data.
         - sent messages .
         Returns None if no msgs need to be dropped.
         """
+        return self._compute_messages_to_discard()
+
+    def _compute_messages_to_discard(self) -> list[MessageId]:
         # If no msg elicited reply, only need to drop sent messages (`outbox`).
-        # NOTE: `is None` is not redundant! Without it, the index value 0 is 
+        # NOTE: `is None` is not redundant! Without it, the index value 0 is
         # cast to boolean and evaluates to False, so function returns None!
         if self.index_of_first_msg_replied_to is None:
             sent_messages = [
                 msg for msg in self.msg_ids if MY_EMAIL_ADDRESS in msg
             ]
             return sent_messages
-        
+
         else:
             # No need to worry about out-of-range index because there is always
-            # at least the reply.        
+            # at least the reply.
             first_msg_to_discard = self.index_of_first_msg_replied_to + 1
             return self.msg_ids[first_msg_to_discard: ]
-        
-    
+
+
+    def get_columns(self) -> dict[str, list]:
+        """
+        Returns the same data as `get_transformed_data()`, but column-wise (one
+        list per field, including `msg_id`), which can be turned into an Arrow
+        record batch without any per-message dicts.
+        """
+        msg_replied_to = self.find_msg_replied_to()
+        kept = [
+            i for i in range(self.n_msgs)
+            if self.msg_ids[i] not in self._msgs_to_discard
+        ]
+        msg_ids = [self.msg_ids[i] for i in kept]
+
+        return {
+            'msg_id': msg_ids,
+            # Handles case where no message received reply, too
+            'replied_to': [msg_id == msg_replied_to for msg_id in msg_ids],
+            'sender': [self.senders[i] for i in kept],
+            'body': [self.msg_body[i] for i in kept],
+            'timestamp': [self.timestamps[i] for i in kept],
+        }
+
     def get_transformed_data(self) -> dict | None:
         """
         Returns the thread's data in format needed for further analysis:
-        - Msg id serves as a key for each row, consisting of whether a message 
+        - Msg id serves as a key for each row, consisting of whether a message
         elicited a reply, the sender, and the email body (text).
         - All messages in a thread after the initial reply are discarded.
         - ToDo: All messages by myself are discarded.
         """
+        columns = self.get_columns()
         result = {}
-        msg_replied_to = self.find_msg_replied_to()
-        msgs_to_discard = self.find_messages_to_discard()
-
-        for i in range(self.n_msgs):
-            msg_id = self.msg_ids[i]
-
-            # Skip messages to discard
-            if (msgs_to_discard is not None) and (msg_id in msgs_to_discard):
-                continue
-            
-            if msg_replied_to is not None:
-                replied_to = (msg_id == msg_replied_to)
-            # Handle case where no message received reply
-            else:
-                replied_to = False
-                
+        for i, msg_id in enumerate(columns['msg_id']):
             result[msg_id] = {
-                'replied_to': replied_to,
-                'sender': self.senders[i],
-                'body': self.msg_body[i],
-                'timestamp': self.timestamps[i],
+                'replied_to': columns['replied_to'][i],
+                'sender': columns['sender'][i],
+                'body': columns['body'][i],
+                'timestamp': columns['timestamp'][i],
             }
-        return result
\ No newline at end of file
+        return result
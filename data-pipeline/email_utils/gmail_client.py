@@ -1,42 +1,158 @@
-# Enable current type hints for older Python version (<3.10) 
-from __future__ import annotations 
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import json
 import os
+import threading
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from instrumentation import METRICS
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+DISCOVERY_URI = 'https://gmail.googleapis.com/$discovery/rest?version=v1'
+# Point clients at another server implementing the Gmail API, e.g.
+# `http://localhost:8080` for the stand-in in fake_gmail_server.py. No OAuth
+# is done in that case.
+API_ENDPOINT_ENV_VAR = 'GMAIL_API_ENDPOINT'
 
 
-def create_client():
-    creds = _authenticate()
+class GmailSession:
+    """
+    Long-lived session that authenticates and loads the discovery document only
+    once, and reuses them for every client it hands out.
+
+    Clients are cached per thread, because the `httplib2.Http` object underneath
+    them is not thread-safe. Each of these keeps its connection to Gmail alive,
+    so a pool of workers ends up with one persistent connection each. Tokens
+    are only refreshed once they expire.
+
+    If an `api_endpoint` is given (by default, from the `GMAIL_API_ENDPOINT`
+    environment variable), clients send their requests there, without
+    authenticating.
+    """
+    def __init__(
+        self,
+        token_path: str = 'token.json',
+        credentials_path: str = 'credentials.json',
+        api_endpoint: str | None = None,
+    ):
+        self.token_path = token_path
+        self.credentials_path = credentials_path
+        self.api_endpoint = api_endpoint or os.environ.get(API_ENDPOINT_ENV_VAR)
+        self._creds: Credentials | None = None
+        self._discovery_doc: str | None = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_client(self):
+        with self._lock:
+            if self.api_endpoint:
+                # Stand-in servers don't check credentials
+                pass
+            elif self._creds is None:
+                self._creds = _authenticate(
+                    self.token_path, self.credentials_path
+                )
+            elif not self._creds.valid:
+                _refresh(self._creds, self.token_path)
+
+            if self._discovery_doc is None:
+                self._discovery_doc = _load_discovery_doc()
+                if self.api_endpoint:
+                    self._discovery_doc = _with_root_url(
+                        self._discovery_doc, self.api_endpoint
+                    )
 
-    # create gmail api client
-    client = build('gmail', 'v1', credentials=creds)
-    return client
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            http = _MeteredHttp()
+            client = build_from_document(
+                self._discovery_doc,
+                http=http if self.api_endpoint else AuthorizedHttp(
+                    self._creds, http=http
+                ),
+            )
+            self._local.client = client
+        return client
 
 
-def _authenticate():
+class _MeteredHttp(httplib2.Http):
+    """Counts bytes downloaded (response bodies, including batches)."""
+    def request(self, *args, **kwargs):
+        response, content = super().request(*args, **kwargs)
+        METRICS.increment('bytes_downloaded', len(content or b''))
+        return response, content
+
+
+_default_session = GmailSession()
+
+
+def create_client():
+    """Returns this thread's client from the shared default session."""
+    return _default_session.get_client()
+
+
+def _authenticate(
+    token_path: str = 'token.json',
+    credentials_path: str = 'credentials.json',
+):
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            _refresh(creds, token_path)
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
+                credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+            _save(creds, token_path)
 
     return creds
+
+
+def _refresh(creds: Credentials, token_path: str) -> None:
+    creds.refresh(Request())
+    # Save the credentials for the next run
+    _save(creds, token_path)
+
+
+def _save(creds: Credentials, token_path: str) -> None:
+    with open(token_path, 'w') as token:
+        token.write(creds.to_json())
+
+
+def _load_discovery_doc() -> str:
+    """
+    Prefer the discovery document shipped with the client library, and only
+    download it if it's missing.
+    """
+    doc = get_static_doc('gmail', 'v1')
+    if doc is not None:
+        return doc
+
+    _, content = httplib2.Http().request(DISCOVERY_URI)
+    return content.decode()
+
+
+def _with_root_url(discovery_doc: str, root_url: str) -> str:
+    """
+    Replace the root URL in the discovery document rather than passing
+    `client_options`, since the latter doesn't apply to batch requests.
+    """
+    doc = json.loads(discovery_doc)
+    doc['rootUrl'] = root_url.rstrip('/') + '/'
+    doc.pop('mtlsRootUrl', None)
+    return json.dumps(doc)
@@ -0,0 +1,102 @@
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import logging
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+from googleapiclient.errors import HttpError
+
+from instrumentation import METRICS
+
+# Gmail signals throttling with 429 (and sometimes 403 rateLimitExceeded, which
+# we don't retry because it is usually a daily quota). 5xx are transient.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+T = TypeVar('T')
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out calls so that at most
+    `max_calls_per_second` requests are started across all worker threads.
+    """
+    def __init__(
+        self,
+        max_calls_per_second: float | None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.min_interval = (
+            1 / max_calls_per_second if max_calls_per_second else 0.0
+        )
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        if not self.min_interval:
+            return
+
+        # Reserve the next free slot while holding the lock, but sleep outside
+        # of it, so other workers can reserve their slots in the meantime.
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+
+        delay = slot - now
+        if delay > 0:
+            self._sleep(delay)
+
+
+def is_retryable(exc: Exception) -> bool:
+    return (
+        isinstance(exc, HttpError)
+        and int(exc.resp.status) in RETRYABLE_STATUS_CODES
+    )
+
+
+def backoff_delay(
+    attempt: int,
+    initial_backoff: float = 1.0,
+    max_backoff: float = 32.0,
+) -> float:
+    """Exponential backoff with jitter, so retrying workers don't sync up."""
+    backoff = min(max_backoff, initial_backoff * 2 ** attempt)
+    return backoff + random.uniform(0, backoff / 2)
+
+
+def execute_with_retry(
+    request_fn: Callable[[], T],
+    max_retries: int = 5,
+    initial_backoff: float = 1.0,
+    max_backoff: float = 32.0,
+    rate_limiter: RateLimiter | None = None,
+) -> T:
+    """
+    Call `request_fn`, retrying with exponential backoff (plus jitter) if Gmail
+    throttles us or has a transient server error. Any other error is raised
+    right away.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            return request_fn()
+
+        except Exception as e:
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+
+            METRICS.increment('retries')
+            backoff = backoff_delay(attempt, initial_backoff, max_backoff)
+            logging.warning(
+                f'Retrying after error ({e}). Attempt {attempt + 1} of '
+                f'{max_retries}, waiting {backoff:.1f}s.'
+            )
+            time.sleep(backoff)
+            attempt += 1
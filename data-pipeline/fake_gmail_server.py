@@ -0,0 +1,686 @@
+"""
+Local stand-in for the Gmail API, so the pipeline's throughput can be measured
+(and regression-tested) without OAuth or a real mailbox. Start it, then point
+the pipeline at it:
+
+    python fake_gmail_server.py --threads 100000 --port 8080
+    GMAIL_API_ENDPOINT=http://localhost:8080 python prepare_data.py
+
+It implements the REST endpoints the pipeline uses: users.getProfile,
+users.threads.list (with pagination and a subset of the search syntax),
+users.threads.get, users.labels.list, users.history.list, and batch requests.
+The mailbox is either synthetic, or loaded from recorded threads.get responses
+(a JSONL file with one thread per line, as written by
+`ludwig/bug_reports/create_fake_data.py`, or the raw cache).
+
+To mimic the real service, responses can be delayed, and requests can be
+rejected with 429 (at random, or once a requests-per-second limit is
+exceeded). Counts of requests are served at `/fake/stats`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import argparse
+import base64
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable, Iterator
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from domain_models.email_thread import MY_EMAIL_ADDRESS
+from raw_cache import RawThreadCache
+
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+# Labels every mailbox has
+SYSTEM_LABELS = [
+    'INBOX', 'SENT', 'DRAFT', 'SPAM', 'TRASH', 'UNREAD', 'STARRED',
+    'IMPORTANT', 'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_UPDATES',
+    'CATEGORY_PROMOTIONS', 'CATEGORY_FORUMS',
+]
+_API_PREFIX = '/gmail/v1/users/'
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+    def to_json(self) -> dict:
+        return {'error': {'code': self.status, 'message': self.message}}
+
+
+class FakeMailbox:
+    """
+    Threads (in the shape of threads.get responses), plus the mailbox's
+    history of changes for history.list. Safe to share between threads.
+    """
+    def __init__(
+        self,
+        threads: Iterable[dict],
+        email_address: str = MY_EMAIL_ADDRESS,
+    ):
+        self.email_address = email_address
+        self._lock = threading.Lock()
+        self._threads: dict[str, dict] = {}
+        for thread in threads:
+            self._threads[thread['id']] = thread
+
+        self.history_id = max(
+            (int(thread.get('historyId', 1)) for thread in self._threads.values()),
+            default=1,
+        )
+        self._oldest_history_id = self.history_id
+        self._history: list[dict] = []
+        self._sorted_ids: list[str] | None = None
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> FakeMailbox:
+        """One thread per line (gzipped if path ends with `.gz`)."""
+        open_ = gzip.open if path.endswith('.gz') else open
+        with open_(path, 'rt') as f:
+            return cls((json.loads(line) for line in f if line.strip()), **kwargs)
+
+    @classmethod
+    def from_raw_cache(cls, path: str, **kwargs) -> FakeMailbox:
+        cache = RawThreadCache(path)
+        try:
+            return cls(cache.iter_payloads(), **kwargs)
+        finally:
+            cache.close()
+
+    @classmethod
+    def synthetic(
+        cls,
+        n_threads: int,
+        seed: int = 0,
+        email_address: str = MY_EMAIL_ADDRESS,
+    ) -> FakeMailbox:
+        return cls(
+            generate_threads(n_threads, seed, email_address),
+            email_address=email_address,
+        )
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    def __iter__(self) -> Iterator[str]:
+        """Ids of all threads."""
+        with self._lock:
+            return iter(list(self._threads))
+
+    def get_thread(self, thread_id: str) -> dict:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            raise ApiError(404, 'Requested entity was not found.')
+        return thread
+
+    def list_threads(
+        self,
+        query: str | None = None,
+        page_token: str | None = None,
+        max_results: int = DEFAULT_PAGE_SIZE,
+    ) -> dict:
+        """Newest threads first, like Gmail."""
+        max_results = min(max_results, MAX_PAGE_SIZE)
+        start = int(page_token) if page_token else 0
+        matches = _compile_query(query)
+
+        threads = []
+        position = start
+        thread_ids = self._get_sorted_ids()
+        while position < len(thread_ids) and len(threads) < max_results:
+            thread = self._threads.get(thread_ids[position])
+            position += 1
+            if thread is not None and any(map(matches, thread['messages'])):
+                threads.append({
+                    'id': thread['id'],
+                    'snippet': thread['messages'][0].get('snippet', ''),
+                    'historyId': thread['historyId'],
+                })
+
+        response: dict[str, Any] = {
+            'threads': threads,
+            'resultSizeEstimate': len(threads),
+        }
+        if position < len(thread_ids):
+            response['nextPageToken'] = str(position)
+        return response
+
+    def list_labels(self) -> dict:
+        label_ids = set(SYSTEM_LABELS)
+        for thread in self._threads.values():
+            for msg in thread['messages']:
+                label_ids.update(msg.get('labelIds', []))
+        return {
+            'labels': [
+                {
+                    'id': label_id,
+                    'name': label_id,
+                    'type': 'system' if label_id in SYSTEM_LABELS else 'user',
+                }
+                for label_id in sorted(label_ids)
+            ]
+        }
+
+    def list_history(
+        self,
+        start_history_id: str,
+        history_types: list[str] | None = None,
+        page_token: str | None = None,
+        max_results: int = DEFAULT_PAGE_SIZE,
+    ) -> dict:
+        if int(start_history_id) < self._oldest_history_id:
+            raise ApiError(404, 'Requested entity was not found.')
+
+        with self._lock:
+            records = [
+                record for record in self._history
+                if int(record['id']) > int(start_history_id)
+                and (
+                    not history_types
+                    or any(change in record for change in (
+                        _history_key(history_type)
+                        for history_type in history_types
+                    ))
+                )
+            ]
+        start = int(page_token) if page_token else 0
+        end = start + min(max_results, MAX_PAGE_SIZE)
+        response: dict[str, Any] = {
+            'history': records[start:end],
+            'historyId': str(self.history_id),
+        }
+        if end < len(records):
+            response['nextPageToken'] = str(end)
+        return response
+
+    def get_profile(self) -> dict:
+        return {
+            'emailAddress': self.email_address,
+            'messagesTotal': sum(
+                len(thread['messages']) for thread in self._threads.values()
+            ),
+            'threadsTotal': len(self._threads),
+            'historyId': str(self.history_id),
+        }
+
+    def add_message(self, thread_id: str, msg: dict) -> None:
+        """Add message (to new or existing thread), recording it in history."""
+        with self._lock:
+            self.history_id += 1
+            msg = {**msg, 'threadId': thread_id}
+            thread = self._threads.get(thread_id) \
+                or {'id': thread_id, 'messages': []}
+            # Thread moves to the top of the list
+            self._sorted_ids = None
+            thread = {
+                **thread,
+                'historyId': str(self.history_id),
+                'messages': thread['messages'] + [msg],
+            }
+            self._threads[thread_id] = thread
+            self._record_change(thread_id, msg['id'], 'messagesAdded')
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            thread = self._threads.pop(thread_id)
+            self.history_id += 1
+            for msg in thread['messages']:
+                self._record_change(thread_id, msg['id'], 'messagesDeleted')
+
+    def expire_history(self) -> None:
+        """Make earlier history ids invalid, like Gmail does after a week."""
+        with self._lock:
+            self._history = []
+            self._oldest_history_id = self.history_id
+
+    def _record_change(self, thread_id: str, msg_id: str, change: str) -> None:
+        msg = {'id': msg_id, 'threadId': thread_id}
+        self._history.append({
+            'id': str(self.history_id),
+            'messages': [msg],
+            change: [{'message': msg}],
+        })
+
+    def _get_sorted_ids(self) -> list[str]:
+        with self._lock:
+            if self._sorted_ids is None:
+                self._sorted_ids = sorted(
+                    self._threads,
+                    key=lambda thread_id: _latest_date(self._threads[thread_id]),
+                    reverse=True,
+                )
+            return self._sorted_ids
+
+
+class FakeGmailServer(ThreadingHTTPServer):
+    """
+    Serves `mailbox` over HTTP. Every request (and every call within a batch
+    request) is delayed by `latency` seconds (plus up to `jitter`), and
+    rejected with 429 with probability `error_rate`, or whenever more than
+    `max_requests_per_second` calls were made within the last second.
+
+    List endpoints return at most `max_page_size` items per page (Gmail's
+    limit is 500), regardless of `maxResults`.
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        mailbox: FakeMailbox,
+        address: tuple[str, int] = ('localhost', 0),
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        max_requests_per_second: float | None = None,
+        max_page_size: int = MAX_PAGE_SIZE,
+        seed: int = 0,
+    ):
+        super().__init__(address, _RequestHandler)
+        self.mailbox = mailbox
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.max_page_size = max_page_size
+        self.stats: Counter[str] = Counter()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent_calls: deque[float] = deque()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread (e.g., in tests and benchmarks)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def handle_call(
+        self,
+        method: str,
+        url: str,
+        body: bytes = b'',
+    ) -> tuple[int, dict]:
+        """Returns status and JSON response of a single API call."""
+        path, query = _split_url(url)
+        endpoint = _endpoint_name(method, path)
+        with self._lock:
+            self.stats[endpoint] += 1
+            throttled = self._is_throttled()
+            if throttled:
+                self.stats['throttled'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            return 429, ApiError(
+                429, 'Too many concurrent requests for user.'
+            ).to_json()
+
+        try:
+            return 200, self._route(endpoint, path, query)
+        except ApiError as e:
+            return e.status, e.to_json()
+
+    def _is_throttled(self) -> bool:
+        if self.error_rate and self._random.random() < self.error_rate:
+            return True
+        if not self.max_requests_per_second:
+            return False
+
+        now = time.monotonic()
+        while self._recent_calls and self._recent_calls[0] <= now - 1:
+            self._recent_calls.popleft()
+        if len(self._recent_calls) >= self.max_requests_per_second:
+            return True
+        self._recent_calls.append(now)
+        return False
+
+    def _route(self, endpoint: str, path: str, query: dict) -> dict:
+        mailbox = self.mailbox
+        page_size = min(
+            int(_first(query, 'maxResults') or DEFAULT_PAGE_SIZE),
+            self.max_page_size,
+        )
+        if endpoint == 'threads.get':
+            return mailbox.get_thread(unquote(path.rsplit('/', 1)[1]))
+        if endpoint == 'threads.list':
+            return mailbox.list_threads(
+                query=_first(query, 'q'),
+                page_token=_first(query, 'pageToken'),
+                max_results=page_size,
+            )
+        if endpoint == 'history.list':
+            start_history_id = _first(query, 'startHistoryId')
+            if start_history_id is None:
+                raise ApiError(400, 'startHistoryId is required.')
+            return mailbox.list_history(
+                start_history_id,
+                history_types=query.get('historyTypes'),
+                page_token=_first(query, 'pageToken'),
+                max_results=page_size,
+            )
+        if endpoint == 'labels.list':
+            return mailbox.list_labels()
+        if endpoint == 'getProfile':
+            return mailbox.get_profile()
+        if endpoint == 'stats':
+            return dict(self.stats)
+        raise ApiError(404, f'Not found: {path}')
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: FakeGmailServer
+    protocol_version = 'HTTP/1.1'  # Keep connections alive, like Gmail
+
+    def do_GET(self) -> None:
+        status, response = self.server.handle_call('GET', self.path)
+        self._send(status, json.dumps(response).encode(), 'application/json')
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path, _ = _split_url(self.path)
+        if not path.startswith('/batch'):
+            status, response = self.server.handle_call('POST', self.path, body)
+            self._send(status, json.dumps(response).encode(), 'application/json')
+            return
+
+        with self.server._lock:
+            self.server.stats['batch'] += 1
+        boundary = f'batch_{random.getrandbits(64):016x}'
+        parts = [
+            _batch_response_part(content_id, *self.server.handle_call(*call))
+            for content_id, call in _parse_batch(
+                self.headers['Content-Type'], body
+            )
+        ]
+        self._send(
+            200,
+            b''.join(
+                f'--{boundary}\r\n'.encode() + part for part in parts
+            ) + f'--{boundary}--\r\n'.encode(),
+            f'multipart/mixed; boundary={boundary}',
+        )
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Logging every request would slow down load tests
+        pass
+
+
+def generate_threads(
+    n_threads: int,
+    seed: int = 0,
+    email_address: str = MY_EMAIL_ADDRESS,
+    max_messages_per_thread: int = 6,
+    p_my_message: float = 0.2,
+    start: datetime = datetime(2017, 1, 1, tzinfo=timezone.utc),
+    end: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+) -> Iterator[dict]:
+    """
+    Synthetic threads, with random senders and word salad as bodies. (For
+    more realistic texts, generate a JSONL file with
+    `ludwig/bug_reports/create_fake_data.py` instead.)
+    """
+    rng = random.Random(seed)
+    words = [
+        'meeting', 'report', 'thanks', 'please', 'review', 'attached',
+        'tomorrow', 'update', 'question', 'project', 'call', 'invoice',
+        'schedule', 'draft', 'feedback', 'deadline', 'lunch', 'today',
+    ]
+    senders = [f'sender{i}@example.org' for i in range(1000)]
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = int(end.timestamp() * 1000)
+
+    for i in range(n_threads):
+        thread_id = f'{i:016x}'
+        timestamp = rng.randrange(start_ms, end_ms)
+        messages = []
+        for j in range(rng.randint(1, max_messages_per_thread)):
+            sender = (
+                email_address if rng.random() < p_my_message
+                else rng.choice(senders)
+            )
+            text = ' '.join(rng.choices(words, k=rng.randint(5, 60)))
+            messages.append(make_message(
+                f'{thread_id}{j:02x}', sender, text, timestamp, thread_id
+            ))
+            timestamp += rng.randrange(60_000, 86_400_000)
+        yield {'id': thread_id, 'historyId': '1', 'messages': messages}
+
+
+def make_message(
+    msg_id: str,
+    sender: str,
+    body: str = 'Hello',
+    timestamp: int = 0,
+    thread_id: str | None = None,
+    mime_type: str = 'text/plain',
+) -> dict:
+    """
+    Message in the shape of Gmail's threads.get responses. (`FakeMailbox`
+    sets `threadId` when the message is added to a thread.)
+    """
+    msg = {
+        'id': msg_id,
+        'labelIds': ['INBOX'],
+        'snippet': body[:100],
+        'internalDate': str(timestamp),
+        'payload': {
+            'mimeType': mime_type,
+            'headers': [{'name': 'From', 'value': sender}],
+            'body': {
+                'size': len(body),
+                'data': base64.urlsafe_b64encode(body.encode()).decode(),
+            },
+        },
+    }
+    if thread_id is not None:
+        msg['threadId'] = thread_id
+    return msg
+
+
+def _endpoint_name(method: str, path: str) -> str:
+    if path == '/fake/stats':
+        return 'stats'
+    if not path.startswith(_API_PREFIX):
+        return 'unknown'
+    # E.g., `me/threads/123` -> ['threads', '123']
+    resource = path[len(_API_PREFIX):].split('/')[1:]
+    if resource == ['profile']:
+        return 'getProfile'
+    if resource[:1] in (['threads'], ['labels'], ['history']):
+        return f'{resource[0]}.{"get" if len(resource) > 1 else "list"}'
+    return 'unknown'
+
+
+def _split_url(url: str) -> tuple[str, dict[str, list[str]]]:
+    parts = urlsplit(url)
+    return parts.path, parse_qs(parts.query)
+
+
+def _first(query: dict[str, list[str]], name: str) -> str | None:
+    values = query.get(name)
+    return values[0] if values else None
+
+
+def _history_key(history_type: str) -> str:
+    # The filter is singular, the field in each record is plural
+    return {
+        'messageAdded': 'messagesAdded',
+        'messageDeleted': 'messagesDeleted',
+        'labelAdded': 'labelsAdded',
+        'labelRemoved': 'labelsRemoved',
+    }.get(history_type, history_type)
+
+
+def _latest_date(thread: dict) -> int:
+    return max(
+        (int(msg['internalDate']) for msg in thread['messages']), default=0
+    )
+
+
+def _compile_query(query: str | None):
+    """
+    Returns predicate on messages, for the subset of Gmail's search syntax
+    we use: `after:`/`before:` (dates as YYYY/MM/DD or epoch seconds),
+    `from:`, and words (matched against the snippet). Terms can be negated
+    with `-`, and operators are case-insensitive, like in Gmail.
+    """
+    predicates = []
+    for term in (query or '').split():
+        negated = term.startswith('-')
+        term = term.lstrip('-')
+        operator, _, value = term.rpartition(':')
+        operator = operator.lower()
+
+        if operator in ('after', 'before'):
+            bound_ms = _parse_date(value) * 1000
+            if operator == 'after':
+                predicate = lambda msg, b=bound_ms: int(msg['internalDate']) >= b
+            else:
+                predicate = lambda msg, b=bound_ms: int(msg['internalDate']) < b
+        elif operator == 'from':
+            predicate = lambda msg, v=value.lower(): v in (
+                _get_header(msg, 'From') or ''
+            ).lower()
+        else:
+            predicate = lambda msg, v=term.lower(): v in msg.get(
+                'snippet', ''
+            ).lower()
+
+        if negated:
+            predicate = lambda msg, p=predicate: not p(msg)
+        predicates.append(predicate)
+
+    return lambda msg: all(predicate(msg) for predicate in predicates)
+
+
+def _parse_date(value: str) -> int:
+    """Epoch seconds (of midnight UTC, for dates)."""
+    if re.fullmatch(r'\d+', value):
+        return int(value)
+    date = datetime.strptime(value.replace('-', '/'), '%Y/%m/%d')
+    return int(date.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _get_header(msg: dict, name: str) -> str | None:
+    for header in msg['payload']['headers']:
+        if header['name'] == name:
+            return header['value']
+    return None
+
+
+def _parse_batch(
+    content_type: str,
+    body: bytes,
+) -> list[tuple[str, tuple[str, str, bytes]]]:
+    """
+    Split multipart batch request into its calls. Returns the content id and
+    (method, url, body) of each call.
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+    )
+    calls = []
+    for part in message.iter_parts():
+        # Each part is a serialized HTTP request
+        request = part.get_payload(decode=True)
+        request_line, _, rest = request.partition(b'\r\n')
+        if not rest:
+            request_line, _, rest = request.partition(b'\n')
+        method, url, _ = request_line.decode().split(' ', 2)
+        _, _, call_body = rest.partition(b'\r\n\r\n')
+        calls.append((part['Content-ID'], (method, url, call_body)))
+    return calls
+
+
+def _batch_response_part(content_id: str, status: int, response: dict) -> bytes:
+    # Content ids of responses are those of requests, prefixed by `response-`
+    response_id = f'<response-{content_id.strip("<>")}>'
+    body = json.dumps(response)
+    return (
+        f'Content-Type: application/http\r\n'
+        f'Content-ID: {response_id}\r\n\r\n'
+        f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+        f'Content-Type: application/json; charset=UTF-8\r\n'
+        f'Content-Length: {len(body.encode())}\r\n\r\n'
+        f'{body}\r\n'
+    ).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the Gmail API.'
+    )
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--mailbox',
+        help='Recorded threads: JSONL file (optionally gzipped), or raw cache '
+             '(.sqlite). If omitted, a synthetic mailbox is generated.',
+    )
+    parser.add_argument('--threads', type=int, default=10_000,
+                        help='Number of threads in synthetic mailbox.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Delay of every call, in seconds.')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Maximum additional random delay, in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Probability of rejecting a call with 429.')
+    parser.add_argument('--max-requests-per-second', type=float,
+                        help='Reject calls with 429 beyond this rate.')
+    args = parser.parse_args()
+
+    if args.mailbox is None:
+        mailbox = FakeMailbox.synthetic(args.threads, seed=args.seed)
+    elif args.mailbox.endswith('.sqlite'):
+        mailbox = FakeMailbox.from_raw_cache(args.mailbox)
+    else:
+        mailbox = FakeMailbox.from_jsonl(args.mailbox)
+
+    server = FakeGmailServer(
+        mailbox,
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        max_requests_per_second=args.max_requests_per_second,
+        seed=args.seed,
+    )
+    print(f'Serving {len(mailbox)} threads at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Incremental syncs: Rather than downloading every thread again on each run, we
+store the mailbox's history id after each download, along with a fingerprint
+of each thread (its own history id and message ids). On the next run, we only
+fetch the threads that changed since then, and replace their messages in the
+existing dataset.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import logging
+import os
+from typing import Any, Iterable
+
+from googleapiclient.errors import HttpError
+
+from dead_letter_queue import DeadLetterQueue
+from data_models import MessageId, SyncState, ThreadFingerprint, ThreadId
+from domain_models.email_thread import EmailThread
+from raw_cache import RawThreadCache
+from thread_api import (
+    get_current_history_id,
+    get_threads_with_details_batched,
+    list_all_threads,
+    list_changed_thread_ids,
+)
+
+
+def load_sync_state(path: str) -> SyncState | None:
+    """Returns `None` if there was no earlier download."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return SyncState.model_validate_json(f.read())
+
+
+def save_sync_state(state: SyncState, path: str) -> None:
+    # Write to temporary file first, so a crash can't leave a corrupt state
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(state.model_dump_json())
+    os.replace(tmp_path, path)
+
+
+def create_sync_state(
+    history_id: str,
+    threads: Iterable[EmailThread],
+) -> SyncState:
+    """
+    Create state after a full download. Note that `history_id` must be
+    retrieved BEFORE listing the threads, so we don't miss any changes made
+    during the download.
+    """
+    state = SyncState(history_id=history_id)
+    for thread in threads:
+        update_fingerprint(state, thread)
+    return state
+
+
+def fetch_changes(
+    state: SyncState,
+    query: str | None = None,
+    gmail: Any | None = None,
+    cache: RawThreadCache | None = None,
+    dead_letter_queue: DeadLetterQueue | None = None,
+) -> tuple[list[EmailThread], list[MessageId], SyncState]:
+    """
+    Fetch all threads that were added or changed since the last sync. If a
+    `dead_letter_queue` is given, earlier dead letters of these threads are
+    replaced by the new ones.
+
+    Returns the changed threads, the ids of messages the dataset contains for
+    these threads (or for deleted threads), which need to be dropped before
+    adding the changed threads, and the updated state.
+    """
+    changes = list_changed_thread_ids(state.history_id, gmail=gmail)
+
+    if changes is not None:
+        changed_thread_ids, new_history_id = changes
+        deleted_thread_ids: set[ThreadId] = set()
+        # We don't know the changed threads' new history ids, so can't tell
+        # whether cached payloads are up to date.
+        current_history_ids: dict[ThreadId, str | None] | None = None
+        # Also retry threads that failed to download during earlier syncs
+        changed_thread_ids |= {
+            thread_id
+            for thread_id, fingerprint in state.threads.items()
+            if fingerprint.history_id is None
+        }
+
+    # If our history id has expired, compare each thread's history id instead.
+    # This still requires listing all threads, but avoids fetching their
+    # details.
+    else:
+        new_history_id = get_current_history_id(gmail=gmail)
+        current_threads = list_all_threads(query=query, gmail=gmail)
+        current_history_ids = current_threads
+        changed_thread_ids = {
+            thread_id
+            for thread_id, history_id in current_threads.items()
+            if thread_id not in state.threads
+            or state.threads[thread_id].history_id != history_id
+        }
+        deleted_thread_ids = state.threads.keys() - current_threads.keys()
+
+    logging.info(
+        f'{len(changed_thread_ids)} threads changed and '
+        f'{len(deleted_thread_ids)} were deleted since last sync.'
+    )
+
+    # Batch requests are a good fit here, because there are usually only a few
+    # hundred threads, and they report deleted threads rather than raising.
+    changed_threads = []
+    failed_thread_ids = set()
+    threads_with_details = get_threads_with_details_batched(
+        sorted(changed_thread_ids),
+        gmail=gmail,
+        cache=cache,
+        history_ids=current_history_ids,
+    )
+    new_dead_letters = []
+    for thread, dlq in threads_with_details:
+        if _is_not_found(dlq):
+            deleted_thread_ids.add(thread.thread_id)
+        elif _is_download_error(dlq):
+            logging.warning(
+                f'Failed to download thread {thread.thread_id}. Keeping its '
+                f'old data until the next sync. Error: {dlq[0]["exception"]}'
+            )
+            failed_thread_ids.add(thread.thread_id)
+        else:
+            # Includes threads whose messages all failed validation: They
+            # were downloaded, so count as synced (their dead letters can be
+            # replayed with reprocess_dlq.py).
+            changed_threads.append(thread)
+            new_dead_letters.append((thread, dlq))
+
+    stale_msg_ids = [
+        msg_id
+        for thread in changed_threads
+        if thread.thread_id in state.threads
+        for msg_id in state.threads[thread.thread_id].msg_ids
+    ] + [
+        msg_id
+        for thread_id in deleted_thread_ids
+        if thread_id in state.threads
+        for msg_id in state.threads[thread_id].msg_ids
+    ]
+
+    if dead_letter_queue is not None:
+        dead_letter_queue.drop_threads(
+            [thread.thread_id for thread in changed_threads]
+            + list(deleted_thread_ids)
+        )
+        for thread, dlq in new_dead_letters:
+            dead_letter_queue.add(thread, dlq)
+
+    new_state = state.model_copy(deep=True)
+    new_state.history_id = new_history_id
+    for thread_id in deleted_thread_ids:
+        new_state.threads.pop(thread_id, None)
+    for thread in changed_threads:
+        update_fingerprint(new_state, thread)
+    # Unset history id of failed threads, so the next sync retries them
+    for thread_id in failed_thread_ids:
+        if thread_id in new_state.threads:
+            new_state.threads[thread_id].history_id = None
+        else:
+            new_state.threads[thread_id] = ThreadFingerprint(
+                history_id=None, msg_ids=[]
+            )
+
+    return changed_threads, stale_msg_ids, new_state
+
+
+def update_fingerprint(state: SyncState, thread: EmailThread) -> None:
+    """Record the current version of a thread we have in the dataset."""
+    state.threads[thread.thread_id] = ThreadFingerprint(
+        history_id=thread.history_id,
+        msg_ids=thread.msg_ids,
+    )
+
+
+def _is_download_error(dlq: list[dict]) -> bool:
+    # Validation errors are stored with the message, rather than as HTTP errors
+    return any(isinstance(entry['exception'], HttpError) for entry in dlq)
+
+
+def _is_not_found(dlq: list[dict]) -> bool:
+    return any(
+        isinstance(entry['exception'], HttpError)
+        and int(entry['exception'].resp.status) == 404
+        for entry in dlq
+    )
@@ -0,0 +1,187 @@
+"""
+Instrumentation of the pipeline's stages, so we can tell where time goes
+(network, body decoding, message validation, assembling rows, ...).
+
+Stages record their durations in a `Metrics` registry, along with counters
+(threads, messages, dead letters, retries, bytes downloaded) and gauges (queue
+depths, whose maximum is kept, too). The module-level `METRICS` is shared by
+all modules, so nothing needs to be passed around. Worker processes record
+into their own registry, and send its `snapshot()` back to be `merge()`d.
+
+At the end of a run, metrics are logged as one JSON line, and/or written in
+Prometheus' text format (e.g., for node_exporter's textfile collector).
+
+For finer-grained hot paths, `profiled()` runs cProfile if the
+`PIPELINE_PROFILE` environment variable is set. Sampling profilers like
+py-spy need no hook (`py-spy record --subprocesses -- python prepare_data.py`),
+but worker threads are named after their stage, so they can be told apart.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
+# Path to write cProfile stats to (view with `python -m pstats` or snakeviz)
+PROFILE_ENV_VAR = 'PIPELINE_PROFILE'
+PROMETHEUS_PREFIX = 'pipeline'
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Thread-safe registry of stage timers, counters, and gauges."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Stage -> [number of calls, total seconds, max seconds]
+        self._timers: dict[str, list[float]] = {}
+        self._counters: Counter[str] = Counter()
+        self._gauges: dict[str, float] = {}
+        self._gauge_maxima: dict[str, float] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+            self._gauge_maxima[name] = max(
+                value, self._gauge_maxima.get(name, value)
+            )
+
+    def record_time(self, stage: str, seconds: float, count: int = 1) -> None:
+        """
+        Add `count` calls of `stage` that took `seconds` in total (so hot
+        loops can time locally, and record once).
+        """
+        with self._lock:
+            timer = self._timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds / count if count else 0.0)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, dict]:
+        """Plain (picklable, JSON serializable) copy of all metrics."""
+        with self._lock:
+            return {
+                'timers': {
+                    stage: {
+                        'count': count, 'seconds': seconds, 'max_seconds': max_
+                    }
+                    for stage, (count, seconds, max_) in self._timers.items()
+                },
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'gauge_maxima': dict(self._gauge_maxima),
+            }
+
+    def merge(self, snapshot: dict[str, dict]) -> None:
+        """Add metrics recorded elsewhere (e.g., in a worker process)."""
+        with self._lock:
+            for stage, values in snapshot['timers'].items():
+                timer = self._timers.setdefault(stage, [0, 0.0, 0.0])
+                timer[0] += values['count']
+                timer[1] += values['seconds']
+                timer[2] = max(timer[2], values['max_seconds'])
+            self._counters.update(snapshot['counters'])
+            self._gauges.update(snapshot['gauges'])
+            for name, value in snapshot['gauge_maxima'].items():
+                self._gauge_maxima[name] = max(
+                    value, self._gauge_maxima.get(name, value)
+                )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._gauge_maxima.clear()
+
+    def log(self, level: int = logging.INFO) -> None:
+        """Log all metrics as one JSON line."""
+        logger.log(
+            level, 'metrics %s', json.dumps(self.snapshot(), sort_keys=True)
+        )
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def add(name: str, kind: str, samples: list[tuple[str, float]]) -> None:
+            if samples:
+                lines.append(f'# TYPE {prefix}_{name} {kind}')
+                lines.extend(
+                    f'{prefix}_{name}{labels} {value!r}'
+                    for labels, value in samples
+                )
+
+        timers = sorted(snapshot['timers'].items())
+        for name, field in (
+            ('stage_seconds_total', 'seconds'),
+            ('stage_calls_total', 'count'),
+        ):
+            add(name, 'counter', [
+                (f'{{stage="{stage}"}}', values[field])
+                for stage, values in timers
+            ])
+        add('stage_max_seconds', 'gauge', [
+            (f'{{stage="{stage}"}}', values['max_seconds'])
+            for stage, values in timers
+        ])
+        for name, value in sorted(snapshot['counters'].items()):
+            add(f'{name}_total', 'counter', [('', value)])
+        for name, value in sorted(snapshot['gauges'].items()):
+            add(name, 'gauge', [('', value)])
+            add(f'{name}_max', 'gauge', [('', snapshot['gauge_maxima'][name])])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(
+        self,
+        path: str,
+        prefix: str = PROMETHEUS_PREFIX,
+    ) -> None:
+        # Replace atomically, so collectors never read a partial file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def profiled(path: str | None = None) -> Iterator[cProfile.Profile | None]:
+    """
+    Run the block under cProfile, and write its stats to `path` (by default,
+    from the `PIPELINE_PROFILE` environment variable). Does nothing if
+    neither is set. (Only the calling thread is profiled.)
+    """
+    path = path or os.environ.get(PROFILE_ENV_VAR)
+    if not path:
+        yield None
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        logger.info(f'Wrote profile to {path}')
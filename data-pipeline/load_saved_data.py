@@ -1,12 +1,29 @@
 import pdb
-import pickle 
+from datetime import datetime
 import pandas as pd
-import pyarrow.parquet as pq
-import pyarrow as pa
-import pdb
 
-with open('df.pickle', 'rb') as f:
-    df: pd.DataFrame = pickle.load(f)
+from dataset_access import open_dataset_cached
+from parquet_sink import read_dataset
+
+# Only read the time range and columns needed (other months and row groups are
+# skipped entirely), e.g. `datetime(2023, 1, 1)`. Set to `None` to read
+# everything.
+START = None
+END = None
+COLUMNS = ['msg_id', 'replied_to', 'sender', 'body', 'timestamp']
+# When reading everything, go through a memory-mapped Arrow copy of the
+# dataset, which opens in milliseconds. (Columns are converted to pandas when
+# first accessed, e.g., `frame.body`.)
+USE_ARROW_CACHE = START is None and END is None
+ARROW_CACHE_PATH = 'dataset.arrow'
+
+if USE_ARROW_CACHE:
+    frame = open_dataset_cached('dataset', ARROW_CACHE_PATH, columns=COLUMNS)
+    df: pd.DataFrame = frame.to_pandas().set_index('msg_id')
+else:
+    df = read_dataset('dataset', columns=COLUMNS, start=START, end=END) \
+        .to_pandas() \
+        .set_index('msg_id')
 
 print(df.head())
 print(df.shape)
@@ -0,0 +1,278 @@
+"""
+Streaming output of the dataset. Rather than merging all threads' rows into
+one dict and building (and transposing) a DataFrame from it, rows are
+appended to typed Arrow record batches, which are staged on disk as soon as
+they are full. So memory stays flat, and build time grows linearly with the
+number of messages.
+
+The dataset is a Hive-partitioned directory (`year=2023/month=04/...`), with
+rows sorted by timestamp within each partition. Together with row group
+statistics, this lets readers load only the time ranges (e.g., the test
+split) and columns they need, see `read_dataset()`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data_models import MessageId
+from domain_models.email_thread import EmailThread
+from instrumentation import METRICS
+
+ROW_SCHEMA = pa.schema([
+    ('msg_id', pa.string()),
+    ('replied_to', pa.bool_()),
+    ('sender', pa.string()),
+    ('body', pa.string()),
+    ('timestamp', pa.int64()),
+])
+# Schema of the files in the dataset. Senders repeat a lot, so they are
+# dictionary encoded (which also makes them categoricals in pandas).
+DATASET_SCHEMA = ROW_SCHEMA.set(
+    ROW_SCHEMA.get_field_index('sender'),
+    pa.field('sender', pa.dictionary(pa.int32(), pa.string())),
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([('year', pa.int16()), ('month', pa.int8())]),
+    flavor='hive',
+)
+DEFAULT_BATCH_SIZE = 10_000  # Rows per staged record batch
+DEFAULT_ROW_GROUP_SIZE = 10_000
+
+
+class ParquetRowSink:
+    """
+    Context manager that writes rows to a partitioned Parquet dataset. Rows
+    are staged next to `path`, and only sorted into the dataset once the sink
+    is closed without error, which then replaces the directory at `path`. So
+    it's safe to read an existing dataset at `path` while writing its
+    replacement.
+    """
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.row_group_size = row_group_size
+        self.n_rows = 0
+        self.n_replied_to = 0
+
+        self._staging_path = f'{path}.staging'
+        self._tmp_path = f'{path}.tmp'
+        self._n_staged_batches = 0
+        self._columns: dict[str, list] = empty_columns()
+
+    def __enter__(self) -> ParquetRowSink:
+        _recover_directory(self.path)
+        for path in (self._staging_path, self._tmp_path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(self._staging_path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self._flush()
+                with METRICS.timer('write_partitions'):
+                    self._write_sorted_partitions()
+                _replace_directory(self._tmp_path, self.path)
+        finally:
+            for path in (self._staging_path, self._tmp_path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def add_thread(self, thread: EmailThread) -> None:
+        with METRICS.timer('assemble_rows'):
+            for name, values in thread.get_columns().items():
+                self._columns[name].extend(values)
+
+        if len(self._columns['msg_id']) >= self.batch_size:
+            self._flush()
+
+    def write_batches(self, batches: Iterable[pa.RecordBatch]) -> None:
+        """Append batches that are already in Arrow format (e.g., from disk)."""
+        self._flush()
+        for batch in batches:
+            self._write(batch)
+
+    def _flush(self) -> None:
+        if not self._columns['msg_id']:
+            return
+        self._write(pa.RecordBatch.from_pydict(self._columns, schema=ROW_SCHEMA))
+        self._columns = empty_columns()
+
+    def _write(self, batch: pa.RecordBatch) -> None:
+        if batch.num_rows == 0:
+            return
+        assert os.path.isdir(self._staging_path), 'Use sink as a context manager.'
+
+        received_at = batch.column('timestamp').cast(
+            pa.timestamp('ms', tz='UTC')
+        )
+        batch = batch \
+            .append_column('year', pc.year(received_at).cast(pa.int16())) \
+            .append_column('month', pc.month(received_at).cast(pa.int8()))
+        with METRICS.timer('stage_rows'):
+            ds.write_dataset(
+                batch,
+                self._staging_path,
+                format='parquet',
+                partitioning=PARTITIONING,
+                basename_template=(
+                    f'batch-{self._n_staged_batches:06d}-{{i}}.parquet'
+                ),
+                existing_data_behavior='overwrite_or_ignore',
+            )
+        METRICS.increment('rows_written', batch.num_rows)
+        self._n_staged_batches += 1
+        self.n_rows += batch.num_rows
+        self.n_replied_to += pc.sum(batch.column('replied_to')).as_py() or 0
+
+    def _write_sorted_partitions(self) -> None:
+        """
+        Sort each partition's staged rows by timestamp, and write them as one
+        file. (Only one month of rows is in memory at a time.)
+        """
+        os.makedirs(self._tmp_path)
+        for year_dir in sorted(os.listdir(self._staging_path)):
+            for month_dir in sorted(
+                os.listdir(os.path.join(self._staging_path, year_dir))
+            ):
+                table = ds.dataset(
+                    os.path.join(self._staging_path, year_dir, month_dir),
+                    schema=ROW_SCHEMA,
+                    format='parquet',
+                ).to_table()
+                table = table \
+                    .sort_by('timestamp') \
+                    .cast(DATASET_SCHEMA)
+
+                # Zero-pad months, so partitions are listed in time order
+                month = int(month_dir.split('=')[1])
+                partition_path = os.path.join(
+                    self._tmp_path, year_dir, f'month={month:02d}'
+                )
+                os.makedirs(partition_path)
+                pq.write_table(
+                    table,
+                    os.path.join(partition_path, 'part-0.parquet'),
+                    row_group_size=self.row_group_size,
+                    use_dictionary=['sender'],
+                    write_statistics=True,
+                )
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    """
+    Open the dataset written by `ParquetRowSink`. Its rows also have the
+    partition columns `year` and `month`.
+    """
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+def time_range_filter(
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> ds.Expression | None:
+    """
+    Filter for messages received in [`start`, `end`). Filters on the
+    partition columns (so other months aren't even opened) as well as on
+    `timestamp` (so row groups outside the range are skipped).
+    """
+    expression = None
+    year, month, timestamp = ds.field('year'), ds.field('month'), \
+        ds.field('timestamp')
+    if start is not None:
+        start = start.astimezone(timezone.utc)
+        expression = _and(
+            expression,
+            (year > start.year)
+            | ((year == start.year) & (month >= start.month)),
+        )
+        expression = _and(expression, timestamp >= _to_millis(start))
+    if end is not None:
+        end = end.astimezone(timezone.utc)
+        expression = _and(
+            expression,
+            (year < end.year) | ((year == end.year) & (month <= end.month)),
+        )
+        expression = _and(expression, timestamp < _to_millis(end))
+    return expression
+
+
+def read_dataset(
+    path: str,
+    columns: list[str] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> pa.Table:
+    """
+    Read (a time range of) the dataset, in chronological order. By default,
+    reads the columns of `DATASET_SCHEMA`. Naive datetimes are interpreted as
+    local time.
+    """
+    return open_dataset(path).to_table(
+        columns=columns or ROW_SCHEMA.names,
+        filter=time_range_filter(start, end),
+    )
+
+
+def read_row_batches(
+    path: str,
+    exclude_msg_ids: Iterable[MessageId] = (),
+) -> Iterator[pa.RecordBatch]:
+    """
+    Stream the rows of an earlier output dataset, optionally dropping some
+    messages (e.g., those of threads that changed since).
+    """
+    exclude = pa.array(list(exclude_msg_ids), type=pa.string())
+    for batch in open_dataset(path).to_batches(columns=ROW_SCHEMA.names):
+        batch = batch.cast(ROW_SCHEMA)
+        if len(exclude):
+            keep = pc.invert(pc.is_in(batch.column('msg_id'), value_set=exclude))
+            batch = batch.filter(keep)
+        yield batch
+
+
+def empty_columns() -> dict[str, list]:
+    return {name: [] for name in ROW_SCHEMA.names}
+
+
+def _replace_directory(new_path: str, path: str) -> None:
+    """
+    Move directory into place. Directories can't be replaced atomically, so
+    the old one is moved aside first (and restored by `_recover_directory()`
+    if we crash in between).
+    """
+    old_path = f'{path}.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(new_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def _recover_directory(path: str) -> None:
+    old_path = f'{path}.old'
+    if not os.path.exists(path) and os.path.exists(old_path):
+        os.replace(old_path, path)
+
+
+def _and(
+    expression: ds.Expression | None,
+    other: ds.Expression,
+) -> ds.Expression:
+    return other if expression is None else expression & other
+
+
+def _to_millis(time: datetime) -> int:
+    return int(time.timestamp() * 1000)
@@ -1,61 +1,210 @@
 # Enable current type hints for older Python version (<3.10) 
 from __future__ import annotations
-from functools import reduce
-import pandas as pd
-import pyarrow.parquet as pq
-import pyarrow as pa
-import pickle
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow.compute as pc
 
-from thread_api import list_all_thread_ids, _get_thread_with_details
+from checkpoint import ExtractionCheckpoint
+from data_models import SyncState
+from dead_letter_queue import DeadLetterQueue
+from instrumentation import METRICS, profiled
+from parquet_sink import (
+    ROW_SCHEMA, ParquetRowSink, open_dataset, read_row_batches
+)
+from raw_cache import RawThreadCache
+from incremental_sync import (
+    fetch_changes, load_sync_state, save_sync_state
+)
+from thread_api import (
+    get_current_history_id,
+    list_all_threads,
+    load_threads_from_cache,
+    get_threads_with_details,
+    get_threads_with_details_batched,
+)
 
-PERSIST_RESULTS = True
+# Parquet dataset, partitioned by year and month (see parquet_sink.py)
+OUTPUT_PATH = 'dataset'
 FILTER_QUERY = 'After:2017/01/01'
+# Concurrency of thread detail requests, and limit across all workers to stay
+# within Gmail's per-user quota.
+MAX_WORKERS = 8
+MAX_REQUESTS_PER_SECOND = 20
+# Alternatively, bundle thread detail requests into Gmail batch requests.
+USE_BATCH_REQUESTS = False
+BATCH_SIZE = 50
+# Only download threads that changed since the last run, and merge them into
+# the existing dataset. (Falls back to a full download on the first run.)
+INCREMENTAL_SYNC = True
+SYNC_STATE_PATH = 'sync_state.json'
+# Keep raw API responses, so transformation steps can be re-run without
+# downloading again. In offline mode, the dataset is rebuilt from this cache
+# alone (without any API calls).
+RAW_CACHE_PATH = 'raw_threads.sqlite'
+RAW_CACHE_MAX_BYTES = 10 * 2**30
+OFFLINE = False
+# Commit progress of the full download every few threads, so it can resume
+# after a crash.
+CHECKPOINT_DIR = 'checkpoint'
+CHECKPOINT_EVERY_N_THREADS = 1000
+# Parse responses (in particular, convert HTML bodies to text) in a process
+# pool, since that's CPU-bound. Set `HTML_TO_TEXT_BACKEND` environment variable
+# to 'lxml' or 'selectolax' for faster (but slightly different) conversion.
+PARSE_PROCESSES = os.cpu_count()
+# Messages that fail validation (see reprocess_dlq.py to replay them)
+DLQ_PATH = 'dlq.jsonl'
+# Per-stage timings, counters, and queue depths of the last run, in
+# Prometheus' text format (they are logged, too). Set the `PIPELINE_PROFILE`
+# environment variable to a path to also profile the run with cProfile.
+METRICS_PATH = 'metrics.prom'
 
 
 def main():
-    thread_ids = list_all_thread_ids(
-        query=FILTER_QUERY
+    cache = RawThreadCache(RAW_CACHE_PATH, max_bytes=RAW_CACHE_MAX_BYTES)
+    checkpoint = ExtractionCheckpoint(
+        CHECKPOINT_DIR, chunk_size=CHECKPOINT_EVERY_N_THREADS
     )
+    state = load_sync_state(SYNC_STATE_PATH) if INCREMENTAL_SYNC else None
+    dead_letter_queue = DeadLetterQueue(DLQ_PATH)
+
+    if OFFLINE:
+        dead_letter_queue.clear()
+        with create_parse_executor() as parse_executor, \
+                METRICS.timer('rebuild_from_cache'), \
+                create_output_sink() as sink:
+            threads_with_details = load_threads_from_cache(
+                cache, parse_executor=parse_executor
+            )
+            for thread, dlq in threads_with_details:
+                sink.add_thread(thread)
+                dead_letter_queue.add(thread, dlq)
+
+    elif state is not None and os.path.exists(OUTPUT_PATH):
+        with METRICS.timer('fetch_changes'):
+            changed_threads, stale_msg_ids, state = fetch_changes(
+                state,
+                query=FILTER_QUERY,
+                cache=cache,
+                dead_letter_queue=dead_letter_queue,
+            )
+        # Copy existing rows (except those of changed threads) to new file,
+        # then add changed threads' rows.
+        with METRICS.timer('write_dataset'), create_output_sink() as sink:
+            sink.write_batches(
+                read_row_batches(OUTPUT_PATH, exclude_msg_ids=stale_msg_ids)
+            )
+            for thread in changed_threads:
+                sink.add_thread(thread)
+
+    else:
+        with create_parse_executor() as parse_executor, \
+                METRICS.timer('download_all_threads'):
+            state = _download_all_threads(
+                cache, checkpoint, parse_executor, dead_letter_queue
+            )
+        with METRICS.timer('write_dataset'), create_output_sink() as sink:
+            sink.write_batches(checkpoint.iter_batches())
+
+    print(f'Raw cache hit rate: {cache.hit_rate}')
+    print(f'Dead-lettered messages: {dead_letter_queue.n_added}')
+    cache.close()
 
-    list_of_dicts = []
-    for thread_id in thread_ids:
-        thread, dlq = _get_thread_with_details(thread_id)
-        thread_data = thread.get_transformed_data()
-        list_of_dicts.append(thread_data)
-        
-    dict_of_dicts = reduce(
-        lambda dict1, dict2: {**dict1, **dict2},
-        list_of_dicts
+    # Only save state once the data it describes is persisted (offline runs
+    # don't change which version of each thread we have).
+    if state is not None and not OFFLINE:
+        save_sync_state(state, SYNC_STATE_PATH)
+    checkpoint.clear()
+
+    dataset = open_dataset(OUTPUT_PATH)
+    msg_ids = dataset.to_table(columns=['msg_id']).column('msg_id')
+    print(
+        dataset.head(10, columns=ROW_SCHEMA.names).to_pandas()
+        if sink.n_rows else 'No rows.',
+        (sink.n_rows, len(ROW_SCHEMA)),
+        sink.n_replied_to
     )
 
-    df = pd.DataFrame(dict_of_dicts) \
-    .T
+    METRICS.log()
+    METRICS.write_prometheus(METRICS_PATH)
+
+    if pc.count_distinct(msg_ids).as_py() != len(msg_ids):
+        raise Warning('Found duplicated msg ids.')
 
 
-    if PERSIST_RESULTS:
-        # Temp: Pickle first, so we don't loose data if writing pq dfails
-        with open('df.pickle', 'wb') as f:
-            pickle.dump(obj=df, file=f)
+def create_parse_executor() -> ProcessPoolExecutor:
+    """
+    Workers are started with `spawn` rather than forked, since they're only
+    started once download threads (and their locks) exist.
+    """
+    return ProcessPoolExecutor(
+        max_workers=PARSE_PROCESSES,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
 
-        # Remove non-ascii characters (e.g., emoticons) which cause trouble with
-        # parquet serialization
-        df['body'] = df.body.map(
-            lambda s: s.encode('ascii', errors='ignore').decode()
+def create_output_sink() -> ParquetRowSink:
+    """Sink for the dataset (also used when reprocessing dead letters)."""
+    return ParquetRowSink(OUTPUT_PATH)
+
+
+def _download_all_threads(
+    cache: RawThreadCache,
+    checkpoint: ExtractionCheckpoint,
+    parse_executor: ProcessPoolExecutor,
+    dead_letter_queue: DeadLetterQueue,
+) -> SyncState:
+    # Get history id first, so the next incremental sync doesn't miss any
+    # changes made while we are downloading. (When resuming, the checkpoint
+    # keeps the history id from the first attempt.)
+    progress = checkpoint.load_or_start(history_id=get_current_history_id())
+    # Listing returns each thread's history id, so unchanged threads can be
+    # read from the raw cache.
+    history_ids = list_all_threads(
+        query=FILTER_QUERY
+    )
+    thread_ids = [
+        thread_id for thread_id in history_ids
+        if not checkpoint.is_processed(thread_id)
+    ]
+    if progress.parts:
+        print(
+            f'Resuming download: {len(history_ids) - len(thread_ids)} threads '
+            f'were already processed.'
         )
 
-        pq.write_table(
-            pa.Table.from_pandas(df), 
-            'df.parquet'
+    if USE_BATCH_REQUESTS:
+        threads_with_details = get_threads_with_details_batched(
+            thread_ids,
+            batch_size=BATCH_SIZE,
+            cache=cache,
+            history_ids=history_ids,
+            parse_executor=parse_executor,
+        )
+    else:
+        threads_with_details = get_threads_with_details(
+            thread_ids,
+            max_workers=MAX_WORKERS,
+            max_requests_per_second=MAX_REQUESTS_PER_SECOND,
+            cache=cache,
+            history_ids=history_ids,
+            parse_executor=parse_executor,
         )
+    for thread, dlq in threads_with_details:
+        checkpoint.add(thread, dlq)
+    checkpoint.commit()
+
+    # Dead letters are committed with their threads' rows, so resuming never
+    # duplicates them. Replace (rather than append to) the queue, so this is
+    # safe to repeat if we crash before the checkpoint is cleared.
+    dead_letter_queue.clear()
+    dead_letter_queue.append(progress.dead_letters)
+
+    return progress.sync_state
 
-    print(
-        df.head(10),
-        df.shape,
-        df.replied_to.sum()
-    )
 
-    if df.index.duplicated().any():
-        raise Warning('Found duplicated index values.')
-    
 if __name__ == '__main__':
-    main()
+    logging.basicConfig(level=logging.INFO)
+    with profiled():
+        main()
@@ -0,0 +1,144 @@
+"""
+Input data for SageMaker's BlazingText algorithm: Features are cleaned and
+tokenized message bodies, and labels whether the message elicited a reply.
+Data is streamed to files in both formats BlazingText reads, plaintext (for
+file mode) and augmented manifest JSON Lines (for pipe mode), see
+`preprocessing/exporters.py`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import json
+from concurrent.futures import Executor
+from typing import Iterable
+
+import numpy.typing as npt
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from preprocessing.cleanup import EXCLUDED_SENDERS, clean_text, filter_messages
+from preprocessing.exporters import Records, export_lines
+from preprocessing.feature_cache import (
+    FeatureCache, config_fingerprint, feature_key
+)
+from preprocessing.tokenization import (
+    DEFAULT_CHUNK_SIZE, Tokenizer, nltk_tokenize, tokenize_texts
+)
+from sender_index import SenderIndex
+
+
+def prepare_features(
+    messages: pa.Table,
+    executor: Executor | None = None,
+    tokenizer: Tokenizer = nltk_tokenize,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    excluded_senders: Iterable[str] = EXCLUDED_SENDERS,
+    cache: FeatureCache | None = None,
+    sender_index: SenderIndex | None = None,
+) -> pa.Table:
+    """
+    Drop messages not used for training, and add the columns `label` (0 or
+    1) and `feature` (cleaned and tokenized body). Messages need (at least)
+    the columns `replied_to`, `sender`, and `body` (plus `msg_id` if a `cache`
+    is given, in which case only messages not in it are preprocessed); all
+    columns are kept.
+    """
+    messages = filter_messages(messages, excluded_senders, sender_index)
+
+    def preprocess(bodies: pa.ChunkedArray | pa.Array) -> list[str]:
+        return list(tokenize_texts(
+            clean_text(bodies).to_pylist(),
+            tokenizer=tokenizer,
+            executor=executor,
+            chunk_size=chunk_size,
+        ))
+
+    if cache is None:
+        features = preprocess(messages.column('body'))
+    else:
+        fingerprint = config_fingerprint(tokenizer)
+        bodies = messages.column('body').to_pylist()
+        keys = [
+            feature_key(msg_id, body, fingerprint)
+            for msg_id, body in zip(messages.column('msg_id').to_pylist(), bodies)
+        ]
+        found = cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        new_features = preprocess(
+            pa.array([bodies[i] for i in missing], type=pa.string())
+        )
+        cache.put_many(
+            (keys[i], feature) for i, feature in zip(missing, new_features)
+        )
+        found.update(
+            (keys[i], feature) for i, feature in zip(missing, new_features)
+        )
+        features = [found[key] for key in keys]
+
+    return messages \
+        .append_column(
+            'label', pc.cast(messages.column('replied_to'), pa.int8())
+        ) \
+        .append_column('feature', pa.array(features, type=pa.string()))
+
+
+def to_text_label(label: int) -> str:
+    """Label as required by BlazingText's plaintext format."""
+    return f'__label__{"reply" if label else "no_reply"}'
+
+
+def write_plaintext(
+    records: Records,
+    path: str,
+    n_shards: int = 1,
+    compress: bool = False,
+    indices: npt.ArrayLike | None = None,
+) -> list[str]:
+    """
+    Write one `__label__<label> <tokens>` line per row of `records` (which
+    need the columns `label` and `feature`), or per index in `indices` (e.g.,
+    a balanced epoch: BlazingText has no sample weights, so rows of smaller
+    classes are repeated in the file, though not in memory). Returns the
+    paths written.
+    """
+    return export_lines(
+        records,
+        path,
+        format_row=lambda row: f'{to_text_label(row["label"])} {row["feature"]}',
+        columns=['label', 'feature'],
+        n_shards=n_shards,
+        compress=compress,
+        indices=indices,
+    )
+
+
+def write_augmented_manifest(
+    records: Records,
+    path: str,
+    num_classes: int | None = None,
+    n_shards: int = 1,
+    compress: bool = False,
+    indices: npt.ArrayLike | None = None,
+) -> list[str]:
+    """
+    Write one `{"source": ..., "label": ...}` object per row of `records`
+    (which need the columns `label` and `feature`), or per index in `indices`
+    (see `write_plaintext()`). For data used in batch
+    prediction, pass `num_classes`, which adds a field `k` that makes
+    prediction output the probabilities of all classes. Returns the paths
+    written.
+    """
+    def format_row(row: dict) -> str:
+        record = {'source': row['feature'], 'label': int(row['label'])}
+        if num_classes is not None:
+            record['k'] = num_classes
+        return json.dumps(record)
+
+    return export_lines(
+        records,
+        path,
+        format_row=format_row,
+        columns=['label', 'feature'],
+        n_shards=n_shards,
+        compress=compress,
+        indices=indices,
+    )
@@ -0,0 +1,53 @@
+"""
+Vectorized cleanup of messages before tokenization. Each step is a single
+Arrow compute kernel over a whole column, rather than a Python function
+called per row via `Series.map()`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+from typing import Iterable
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from sender_index import SenderIndex
+
+# Emails forwarded from my other inbox
+EXCLUDED_SENDERS = ('loeberthomas@yahoo.com',)
+# Bump when `clean_text()` changes, so cached features are recomputed
+CLEANUP_VERSION = 1
+
+
+def filter_messages(
+    messages: pa.Table,
+    excluded_senders: Iterable[str] = EXCLUDED_SENDERS,
+    sender_index: SenderIndex | None = None,
+) -> pa.Table:
+    """
+    Drop messages from excluded senders (matched by parsed address, via
+    `sender_index`), and messages with empty body.
+    """
+    keep = pc.greater(pc.utf8_length(messages.column('body')), 0)
+
+    excluded_senders = list(excluded_senders)
+    if excluded_senders:
+        # Only the distinct senders are parsed, rather than every row
+        sender_index = sender_index or SenderIndex()
+        is_excluded = sender_index.is_from(
+            sender_index.encode(messages.column('sender')),
+            addresses=excluded_senders,
+        )
+        keep = pc.and_(keep, pa.array(~is_excluded))
+
+    return messages.filter(keep)
+
+
+def clean_text(bodies: pa.ChunkedArray | pa.Array) -> pa.ChunkedArray:
+    """
+    Remove non-ascii characters, and replace characters that would break
+    the plaintext (CSV-like) format with spaces.
+    """
+    bodies = pc.replace_substring_regex(
+        bodies, pattern='[^\\x00-\\x7F]', replacement=''
+    )
+    return pc.replace_substring_regex(bodies, pattern='[\n,]', replacement=' ')
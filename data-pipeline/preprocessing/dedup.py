@@ -0,0 +1,164 @@
+"""
+Near-duplicate detection (e.g., newsletters and notifications, whose bodies
+differ only in a few words) with MinHash and locality-sensitive hashing.
+
+Each body is reduced to a MinHash signature of its word shingles, whose
+entries agree between two bodies with probability equal to their Jaccard
+similarity. Signatures are split into bands, and bodies sharing any band are
+clustered together. With `num_bands` bands of `rows_per_band` rows, bodies
+are clustered if their similarity is above roughly
+`(1 / num_bands) ** (1 / rows_per_band)` (about 0.7 by default).
+
+Signatures and band hashes are computed in chunks, in parallel if an executor
+is given. Only the band hashes (`num_bands` integers per message) are kept,
+and clusters are found by vectorized label propagation over them, so a single
+pass handles millions of messages.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from itertools import islice
+from typing import Iterable
+
+import numpy as np
+import numpy.typing as npt
+import pyarrow as pa
+
+DEFAULT_NUM_BANDS = 16
+DEFAULT_ROWS_PER_BAND = 8
+DEFAULT_SHINGLE_SIZE = 3  # Words
+DEFAULT_CHUNK_SIZE = 1000  # Bodies per task
+
+# Universal hashing modulo a prime larger than any 32 bit shingle hash
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def cluster_ids(
+    bodies: Iterable[str],
+    executor: Executor | None = None,
+    num_bands: int = DEFAULT_NUM_BANDS,
+    rows_per_band: int = DEFAULT_ROWS_PER_BAND,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    seed: int = 1,
+    max_in_flight: int = 16,
+) -> np.ndarray:
+    """
+    Returns the cluster of each body: the position of the first body among
+    its near-duplicates (so the earliest, if bodies are sorted by time).
+    """
+    permutations = _permutations(num_bands * rows_per_band, seed)
+    args = (permutations, num_bands, shingle_size)
+
+    bodies = iter(bodies)
+    band_hashes = []
+    in_flight: deque[Future] = deque()
+    for chunk in iter(lambda: list(islice(bodies, chunk_size)), []):
+        if executor is None:
+            band_hashes.append(_band_hashes(chunk, *args))
+            continue
+        in_flight.append(executor.submit(_band_hashes, chunk, *args))
+        if len(in_flight) >= max_in_flight:
+            band_hashes.append(in_flight.popleft().result())
+    band_hashes.extend(future.result() for future in in_flight)
+
+    if not band_hashes:
+        return np.array([], dtype=np.int64)
+    return _connected_components(np.concatenate(band_hashes))
+
+
+def add_cluster_ids(
+    messages: pa.Table,
+    executor: Executor | None = None,
+    **kwargs,
+) -> pa.Table:
+    """Adds column `cluster_id` (see `cluster_ids()`) based on `body`."""
+    clusters = cluster_ids(
+        messages.column('body').to_pylist(), executor=executor, **kwargs
+    )
+    return messages.append_column('cluster_id', pa.array(clusters))
+
+
+def representatives(cluster_ids: npt.ArrayLike) -> np.ndarray:
+    """Mask that keeps the first message of each cluster."""
+    cluster_ids = np.asarray(cluster_ids)
+    return cluster_ids == np.arange(len(cluster_ids))
+
+
+def minhash_signature(
+    body: str,
+    permutations: np.ndarray,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+) -> np.ndarray:
+    """Minimum of each permutation over the hashes of the body's shingles."""
+    words = body.lower().split()
+    shingles = [
+        ' '.join(words[i:i + shingle_size])
+        for i in range(max(1, len(words) - shingle_size + 1))
+    ]
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    a, b = permutations
+    permuted = (np.outer(hashes, a) + b) % _PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def _permutations(num_perm: int, seed: int) -> np.ndarray:
+    # `a * hash + b` stays below 2**64 for 31 bit coefficients
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, 2**31, size=(2, num_perm), dtype=np.uint64)
+
+
+def _band_hashes(
+    bodies: list[str],
+    permutations: np.ndarray,
+    num_bands: int,
+    shingle_size: int,
+) -> np.ndarray:
+    """One 64 bit hash per band of each body's signature."""
+    signatures = np.stack([
+        minhash_signature(body, permutations, shingle_size) for body in bodies
+    ]).astype(np.uint64)
+    bands = signatures.reshape(len(bodies), num_bands, -1)
+
+    hashes = np.zeros((len(bodies), num_bands), dtype=np.uint64)
+    for row in range(bands.shape[2]):
+        # Overflow is intended (FNV-style mixing)
+        hashes = (hashes * np.uint64(1099511628211)) ^ bands[:, :, row]
+    # Distinguish identical values in different bands
+    return hashes ^ np.arange(num_bands, dtype=np.uint64)
+
+
+def _connected_components(band_hashes: np.ndarray) -> np.ndarray:
+    """
+    Label propagation: Every body takes the smallest label of any body it
+    shares a band with, until labels don't change anymore.
+    """
+    n_rows, num_bands = band_hashes.shape
+    labels = np.arange(n_rows)
+    orders = [np.argsort(band_hashes[:, band], kind='stable')
+              for band in range(num_bands)]
+    starts = []
+    for band, order in enumerate(orders):
+        sorted_hashes = band_hashes[order, band]
+        is_start = np.empty(n_rows, dtype=bool)
+        is_start[:1] = True
+        is_start[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+        starts.append(np.flatnonzero(is_start))
+
+    while True:
+        previous = labels.copy()
+        for order, group_starts in zip(orders, starts):
+            group_sizes = np.diff(np.append(group_starts, n_rows))
+            group_labels = np.minimum.reduceat(labels[order], group_starts)
+            labels[order] = np.repeat(group_labels, group_sizes)
+        # Shortcut chains, so labels converge quickly
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
@@ -0,0 +1,158 @@
+"""
+Streaming exporters from Arrow record batches (or DataFrames) to line-based
+formats: JSON Lines for Ludwig and BlazingText's augmented manifests, and
+BlazingText's plaintext format. Rows are converted and written one record
+batch at a time, so memory is bounded by the batch size rather than by the
+size of the output.
+
+Outputs can be split into several shards (written round-robin, so each holds
+a similar share of every batch) and gzip-compressed, so trainers can read
+them in parallel.
+
+Rows can be written in the order (and multiplicity) given by `indices`, e.g.
+a balanced epoch from `preprocessing/sampling.py`, without first copying them
+into a new table.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import gzip
+import json
+import os
+from typing import IO, Any, Callable, Iterable, Iterator, Union
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+import pyarrow as pa
+
+Records = Union[pa.Table, pd.DataFrame, Iterable[pa.RecordBatch]]
+
+DEFAULT_BATCH_SIZE = 10_000  # Rows per record batch
+
+
+class ShardedLineWriter:
+    """
+    Context manager that distributes lines over `n_shards` files. With a
+    single shard, writes to `path` itself. Files are written under temporary
+    names, and only moved in place once the writer is closed without error.
+    """
+    def __init__(self, path: str, n_shards: int = 1, compress: bool = False):
+        assert n_shards >= 1
+        self.paths = shard_paths(path, n_shards, compress)
+        self.compress = compress
+        self.n_lines = 0
+        self._files: list[IO[str]] = []
+
+    def __enter__(self) -> ShardedLineWriter:
+        for path in self.paths:
+            tmp_path = f'{path}.tmp'
+            if self.compress:
+                self._files.append(gzip.open(tmp_path, 'wt', encoding='utf-8'))
+            else:
+                self._files.append(open(tmp_path, 'w', encoding='utf-8'))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        for f in self._files:
+            f.close()
+        for path in self.paths:
+            if exc_type is None:
+                os.replace(f'{path}.tmp', path)
+            else:
+                os.remove(f'{path}.tmp')
+
+    def write_lines(self, lines: list[str]) -> None:
+        """Write lines (without line breaks), continuing the round robin."""
+        n_shards = len(self._files)
+        for shard in range(n_shards):
+            # Shard of the first of these lines is where the last batch ended
+            offset = (shard - self.n_lines) % n_shards
+            shard_lines = lines[offset::n_shards]
+            if shard_lines:
+                self._files[shard].write('\n'.join(shard_lines) + '\n')
+        self.n_lines += len(lines)
+
+
+def shard_paths(path: str, n_shards: int = 1, compress: bool = False) -> list[str]:
+    """
+    E.g., `data/input.jsonl` with 2 shards becomes
+    `data/input-00000-of-00002.jsonl` and `data/input-00001-of-00002.jsonl`.
+    """
+    suffix = '.gz' if compress else ''
+    if n_shards == 1:
+        return [path + suffix]
+    stem, extension = os.path.splitext(path)
+    return [
+        f'{stem}-{shard:05d}-of-{n_shards:05d}{extension}{suffix}'
+        for shard in range(n_shards)
+    ]
+
+
+def iter_record_batches(
+    records: Records,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    indices: npt.ArrayLike | None = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    If `indices` are given, yields the rows at these positions, taking one
+    batch of them at a time.
+    """
+    if isinstance(records, pd.DataFrame):
+        records = pa.Table.from_pandas(records, preserve_index=False)
+    if indices is not None:
+        if not isinstance(records, pa.Table):
+            raise TypeError('Indices require a table or DataFrame.')
+        indices = np.asarray(indices)
+        for start in range(0, len(indices), batch_size):
+            yield from records \
+                .take(indices[start:start + batch_size]) \
+                .to_batches()
+        return
+    if isinstance(records, pa.Table):
+        records = records.to_batches(max_chunksize=batch_size)
+    yield from records
+
+
+def export_lines(
+    records: Records,
+    path: str,
+    format_row: Callable[[dict[str, Any]], str],
+    columns: list[str] | None = None,
+    n_shards: int = 1,
+    compress: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    indices: npt.ArrayLike | None = None,
+) -> list[str]:
+    """
+    Write one line per row (or per index in `indices`), as formatted by
+    `format_row` (which gets the row as dict). Returns the paths written.
+    """
+    with ShardedLineWriter(path, n_shards=n_shards, compress=compress) as writer:
+        for batch in iter_record_batches(records, batch_size, indices):
+            if columns is not None:
+                batch = batch.select(columns)
+            writer.write_lines([format_row(row) for row in batch.to_pylist()])
+    return writer.paths
+
+
+def export_jsonl(
+    records: Records,
+    path: str,
+    columns: list[str] | None = None,
+    n_shards: int = 1,
+    compress: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    indices: npt.ArrayLike | None = None,
+) -> list[str]:
+    """Write rows as JSON Lines. Returns the paths written."""
+    return export_lines(
+        records,
+        path,
+        # Values JSON doesn't know (e.g., datetimes) are written as strings
+        format_row=lambda row: json.dumps(row, default=str),
+        columns=columns,
+        n_shards=n_shards,
+        compress=compress,
+        batch_size=batch_size,
+        indices=indices,
+    )
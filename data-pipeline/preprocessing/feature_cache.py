@@ -0,0 +1,99 @@
+"""
+Cache of preprocessed features, so changing later steps (e.g., the split
+proportions or oversampling) doesn't mean tokenizing every message again.
+
+Features are keyed by a hash of the message id, its body, and the
+preprocessing config (tokenizer and cleanup version). So a message is only
+preprocessed again if it's new, its body changed (e.g., because body
+extraction was improved), or preprocessing itself changed.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import hashlib
+import sqlite3
+import threading
+from typing import Iterable
+
+from preprocessing.cleanup import CLEANUP_VERSION
+from preprocessing.tokenization import Tokenizer
+
+DEFAULT_CACHE_PATH = 'features.sqlite'
+# SQLite limits the number of parameters per statement
+_MAX_PARAMS = 900
+
+
+class FeatureCache:
+    """SQLite-backed store of features by key (see `feature_key()`)."""
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS features (
+                key TEXT PRIMARY KEY,
+                feature TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @property
+    def hit_rate(self) -> float | None:
+        """Share of lookups served from the cache (`None` before any lookup)."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM features'
+            ).fetchone()[0]
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, str]:
+        """Returns the features found, by key."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                found.update(self._conn.execute(
+                    f'SELECT key, feature FROM features '
+                    f'WHERE key IN ({placeholders})',
+                    chunk,
+                ))
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[tuple[str, str]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO features (key, feature) VALUES (?, ?)',
+                items,
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def config_fingerprint(tokenizer: Tokenizer) -> str:
+    """Identifies the preprocessing steps that produce a feature."""
+    name = getattr(tokenizer, '__qualname__', repr(tokenizer))
+    module = getattr(tokenizer, '__module__', None) or 'builtins'
+    return f'cleanup-v{CLEANUP_VERSION}:{module}.{name}'
+
+
+def feature_key(msg_id: str, body: str, fingerprint: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (msg_id, body, fingerprint):
+        digest.update(part.encode('utf-8', errors='surrogatepass'))
+        # Separator, so different splits of the same string differ
+        digest.update(b'\0')
+    return digest.hexdigest()
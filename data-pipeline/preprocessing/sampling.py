@@ -0,0 +1,60 @@
+"""
+Balanced training data without duplicating rows on disk: A `BalancedSampler`
+returns, for each epoch, the row indices of a class-balanced sample (or
+weights per row, for trainers that take them). Exporters read rows through
+these indices (see `indices` in `preprocessing/exporters.py`), so the data
+kept in memory and caches only contains each message once.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+from typing import Any, Iterator
+
+import numpy as np
+import numpy.typing as npt
+
+from preprocessing.splits import oversample_indices
+
+
+class BalancedSampler:
+    """
+    Balances classes like random oversampling does (all rows, plus rows of
+    the smaller classes drawn with replacement), but as indices. Each epoch
+    draws different rows of the smaller classes, reproducibly for a given
+    `random_state`.
+    """
+    def __init__(self, labels: npt.ArrayLike, random_state: int = 1):
+        self.labels = np.asarray(labels)
+        self.random_state = random_state
+        self.classes, self.counts = np.unique(self.labels, return_counts=True)
+
+    def __len__(self) -> int:
+        """Number of rows per epoch."""
+        return len(self.classes) * int(self.counts.max(initial=0))
+
+    def epoch(self, epoch: int = 0, shuffle: bool = True) -> np.ndarray:
+        """
+        Row indices of epoch `epoch`. Unless shuffled, all rows come first, in
+        their original order, followed by the drawn ones.
+        """
+        rng = np.random.default_rng([self.random_state, epoch])
+        indices = oversample_indices(self.labels, random_state=rng)
+        if shuffle:
+            rng.shuffle(indices)
+        return indices
+
+    def iter_epochs(self, n_epochs: int, shuffle: bool = True) -> Iterator[np.ndarray]:
+        for epoch in range(n_epochs):
+            yield self.epoch(epoch, shuffle=shuffle)
+
+    def class_weights(self) -> dict[Any, float]:
+        """Weight of each class, so every class counts as much as the largest."""
+        return {
+            label.item(): float(self.counts.max() / count)
+            for label, count in zip(self.classes, self.counts)
+        }
+
+    def sample_weights(self) -> np.ndarray:
+        """Weight of each row (its class's weight), in the original order."""
+        weights = self.counts.max() / self.counts
+        return weights[np.searchsorted(self.classes, self.labels)] \
+            .astype(np.float32)
@@ -0,0 +1,72 @@
+"""
+Time-based splits and oversampling as index operations: Both only look at
+timestamps or labels, and return arrays to index the (cached) features with,
+so changing them doesn't require preprocessing again.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+
+# Codes of the splits (as expected by Ludwig's fixed split)
+TRAIN, VAL, TEST = 0, 1, 2
+SPLIT_NAMES = {TRAIN: 'train', VAL: 'val', TEST: 'test'}
+
+
+def assign_splits(
+    timestamps: npt.ArrayLike,
+    train_proportion: float = 0.75,
+    val_proportion: float = 0.1,
+    groups: npt.ArrayLike | None = None,
+) -> np.ndarray:
+    """
+    Split by time, so validation data is newer than training data, and test
+    data is newer than validation data. Returns the split code of each row.
+
+    If `groups` are given (e.g., clusters of near-duplicates), each row is
+    split by the earliest timestamp in its group, so groups don't straddle
+    splits.
+    """
+    test_proportion = 1 - train_proportion - val_proportion
+    assert 0 < test_proportion < 1
+
+    timestamps = np.asarray(timestamps)
+    if groups is not None:
+        _, group_codes = np.unique(np.asarray(groups), return_inverse=True)
+        first_timestamps = np.full(
+            group_codes.max(initial=-1) + 1, timestamps.max(initial=0)
+        )
+        np.minimum.at(first_timestamps, group_codes, timestamps)
+        timestamps = first_timestamps[group_codes]
+    train_cutoff, val_cutoff = np.quantile(
+        timestamps, q=[train_proportion, train_proportion + val_proportion]
+    )
+    return np.select(
+        [timestamps < train_cutoff, timestamps > val_cutoff],
+        [TRAIN, TEST],
+        default=VAL,
+    ).astype(np.int8)
+
+
+def oversample_indices(
+    labels: npt.ArrayLike,
+    random_state: int | np.random.Generator = 1,
+) -> np.ndarray:
+    """
+    Indices that balance the classes: All rows, plus randomly drawn (with
+    replacement) rows of the smaller classes, until each class is as large as
+    the largest.
+    """
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(random_state)
+    classes, counts = np.unique(labels, return_counts=True)
+
+    indices = [np.arange(len(labels))]
+    for label, count in zip(classes, counts):
+        n_missing = counts.max() - count
+        if n_missing:
+            indices.append(
+                rng.choice(np.flatnonzero(labels == label), size=n_missing)
+            )
+    return np.concatenate(indices)
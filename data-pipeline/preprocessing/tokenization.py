@@ -0,0 +1,56 @@
+"""
+Tokenization, in chunks of texts that are processed in parallel. NLTK's
+tokenizer is pure Python, so it's by far the slowest preprocessing step, and
+is best run in a `ProcessPoolExecutor`. (Chunking keeps the overhead of
+sending texts to worker processes low.)
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import os
+from collections import deque
+from concurrent.futures import Executor, Future
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+Tokenizer = Callable[[str], list[str]]
+
+DEFAULT_CHUNK_SIZE = 1000  # Texts per task
+
+
+def nltk_tokenize(text: str) -> list[str]:
+    # Optional dependency: `pip install nltk`, then `nltk.download('punkt')`
+    import nltk
+    return nltk.word_tokenize(text)
+
+
+def tokenize_texts(
+    texts: Iterable[str],
+    tokenizer: Tokenizer = nltk_tokenize,
+    executor: Executor | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_in_flight: int = 2 * (os.cpu_count() or 1),
+) -> Iterator[str]:
+    """
+    Yields each text's tokens joined by spaces, in the order of `texts`. If
+    an `executor` is given, chunks are tokenized in it (`tokenizer` then needs
+    to be picklable, e.g. a module-level function).
+    """
+    texts = iter(texts)
+    if executor is None:
+        for chunk in iter(lambda: list(islice(texts, chunk_size)), []):
+            yield from _tokenize_chunk(chunk, tokenizer)
+        return
+
+    # Bound the chunks in flight, so memory stays flat for large mailboxes
+    in_flight: deque[Future] = deque()
+    for chunk in iter(lambda: list(islice(texts, chunk_size)), []):
+        in_flight.append(executor.submit(_tokenize_chunk, chunk, tokenizer))
+        if len(in_flight) >= max_in_flight:
+            yield from in_flight.popleft().result()
+
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+def _tokenize_chunk(chunk: list[str], tokenizer: Tokenizer) -> list[str]:
+    return [' '.join(tokenizer(text)) for text in chunk]
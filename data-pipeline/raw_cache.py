@@ -0,0 +1,223 @@
+"""
+On-disk cache of raw threads.get responses, so we can re-run the
+transformation steps (e.g., after changing how bodies are extracted) without
+downloading everything again.
+
+Payloads are stored as zlib-compressed JSON in an SQLite database (which ships
+with Python, and lets us read and write single threads without rewriting
+segments). Each thread is stored with its history id, so a cached payload
+can be recognized as outdated once the thread changes.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+import zlib
+from typing import Iterable, Iterator
+
+from data_models import ThreadId
+
+DEFAULT_CACHE_PATH = 'raw_threads.sqlite'
+DEFAULT_MAX_BYTES = 10 * 2**30  # 10 GiB
+# SQLite limits the number of parameters per statement
+_MAX_PARAMS = 900
+
+
+class RawThreadCache:
+    """
+    Size-bounded cache of raw thread payloads. Once the compressed payloads
+    exceed `max_bytes`, the least recently used threads are evicted.
+
+    Safe to share between threads.
+    """
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS raw_threads (
+                thread_id TEXT PRIMARY KEY,
+                history_id TEXT,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS by_last_access '
+            'ON raw_threads (last_access)'
+        )
+        self._conn.commit()
+
+        total_size, last_access = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(MAX(last_access), 0) '
+            'FROM raw_threads'
+        ).fetchone()
+        self.total_bytes: int = total_size
+        # Monotonic counter rather than wall-clock time, to order accesses
+        self._clock: int = last_access
+
+    @property
+    def hit_rate(self) -> float | None:
+        """Share of lookups served from the cache (`None` before any lookup)."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM raw_threads'
+            ).fetchone()[0]
+
+    def __contains__(self, thread_id: ThreadId) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT 1 FROM raw_threads WHERE thread_id = ?', (thread_id,)
+            ).fetchone() is not None
+
+    def get(
+        self,
+        thread_id: ThreadId,
+        history_id: str | None = None,
+    ) -> dict | None:
+        """
+        Returns the cached payload, or `None` if it's missing. If `history_id`
+        is given, a payload cached for a different version also counts as
+        missing.
+        """
+        return self.get_many(
+            [thread_id],
+            history_ids={thread_id: history_id} if history_id else None,
+        ).get(thread_id)
+
+    def get_many(
+        self,
+        thread_ids: Iterable[ThreadId],
+        history_ids: dict[ThreadId, str | None] | None = None,
+    ) -> dict[ThreadId, dict]:
+        """
+        Bulk version of `get()`. Returns the payloads found, keyed by thread id.
+        """
+        thread_ids = list(thread_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(thread_ids), _MAX_PARAMS):
+                chunk = thread_ids[start:start + _MAX_PARAMS]
+                rows = self._conn.execute(
+                    'SELECT thread_id, history_id, payload FROM raw_threads '
+                    f'WHERE thread_id IN ({", ".join("?" * len(chunk))})',
+                    chunk,
+                ).fetchall()
+                for thread_id, history_id, payload in rows:
+                    expected = history_ids.get(thread_id) if history_ids else None
+                    if expected is None or expected == history_id:
+                        found[thread_id] = payload
+
+            self._touch(list(found))
+            self.hits += len(found)
+            self.misses += len(thread_ids) - len(found)
+
+        return {
+            thread_id: json.loads(zlib.decompress(payload))
+            for thread_id, payload in found.items()
+        }
+
+    def put(self, thread_id: ThreadId, response: dict) -> None:
+        self.put_many({thread_id: response})
+
+    def put_many(self, responses: dict[ThreadId, dict]) -> None:
+        # Compress outside of the lock, since that's the expensive part
+        rows = []
+        for thread_id, response in responses.items():
+            payload = zlib.compress(json.dumps(response).encode())
+            rows.append(
+                (thread_id, response.get('historyId'), payload, len(payload))
+            )
+
+        with self._lock:
+            for thread_id, history_id, payload, size in rows:
+                previous = self._conn.execute(
+                    'SELECT size FROM raw_threads WHERE thread_id = ?',
+                    (thread_id,),
+                ).fetchone()
+                if previous is not None:
+                    self.total_bytes -= previous[0]
+
+                self._clock += 1
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO raw_threads '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (thread_id, history_id, payload, size, self._clock),
+                )
+                self.total_bytes += size
+
+            self._evict()
+            self._conn.commit()
+
+    def iter_payloads(self, batch_size: int = 1000) -> Iterator[dict]:
+        """
+        Iterate over all cached payloads (in thread id order), e.g. to run the
+        transformation steps fully offline. Doesn't count towards hit rate or
+        recency.
+        """
+        last_thread_id = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT thread_id, payload FROM raw_threads '
+                    'WHERE thread_id > ? ORDER BY thread_id LIMIT ?',
+                    (last_thread_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for _, payload in rows:
+                yield json.loads(zlib.decompress(payload))
+            last_thread_id = rows[-1][0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _touch(self, thread_ids: list[ThreadId]) -> None:
+        if not thread_ids:
+            return
+        updates = []
+        for thread_id in thread_ids:
+            self._clock += 1
+            updates.append((self._clock, thread_id))
+        self._conn.executemany(
+            'UPDATE raw_threads SET last_access = ? WHERE thread_id = ?',
+            updates,
+        )
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used threads until we're within budget."""
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT thread_id, size FROM raw_threads '
+                'ORDER BY last_access LIMIT 100'
+            ).fetchall()
+            if not rows:
+                return
+
+            evicted = []
+            for thread_id, size in rows:
+                evicted.append((thread_id,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+            self._conn.executemany(
+                'DELETE FROM raw_threads WHERE thread_id = ?', evicted
+            )
@@ -0,0 +1,125 @@
+"""
+Replay dead-lettered threads through the current extractor (e.g., after fixing
+a parsing bug), without downloading anything: Their raw responses are read
+from the raw cache, and only their rows in the dataset are replaced. Messages
+that still fail stay in the dead letter queue, and so do threads whose cached
+payload is a different version than the one that failed (the next sync
+downloads the current version anyway).
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import logging
+import os
+from typing import Callable
+
+from data_models import DeadLetter, SyncState
+from dead_letter_queue import DeadLetterQueue, to_dead_letters
+from domain_models.email_thread import EmailThread
+from incremental_sync import (
+    load_sync_state, save_sync_state, update_fingerprint
+)
+from parquet_sink import ParquetRowSink, read_row_batches
+from prepare_data import (
+    DLQ_PATH,
+    OUTPUT_PATH,
+    RAW_CACHE_MAX_BYTES,
+    RAW_CACHE_PATH,
+    SYNC_STATE_PATH,
+    create_output_sink,
+)
+from raw_cache import RawThreadCache
+from thread_api import _parse_thread_response
+
+
+def reprocess_dead_letters(
+    dead_letter_queue: DeadLetterQueue,
+    cache: RawThreadCache,
+    output_path: str,
+    create_sink: Callable[[], ParquetRowSink] = create_output_sink,
+    state: SyncState | None = None,
+) -> list[EmailThread]:
+    """
+    Re-parse the dead-lettered threads that are in `cache` (in the version
+    that failed), replace their rows in the dataset at `output_path`, and
+    update their fingerprints in `state` (if given). Returns the reprocessed
+    threads.
+    """
+    dead_letters = dead_letter_queue.read()
+    # If a thread failed in several versions, replay the latest
+    history_ids = {
+        letter.thread_id: letter.history_id
+        for letter in sorted(dead_letters, key=lambda letter: letter.failed_at)
+    }
+    payloads = cache.get_many(sorted(history_ids), history_ids=history_ids)
+
+    threads = []
+    remaining: list[DeadLetter] = [
+        # E.g., threads that failed to download (which the next sync
+        # retries), or whose cached payload is stale
+        letter for letter in dead_letters if letter.thread_id not in payloads
+    ]
+    for thread_id, response in payloads.items():
+        thread, dlq = _parse_thread_response(thread_id, response)
+        threads.append(thread)
+        remaining.extend(to_dead_letters(thread, dlq))
+
+    # Drop all rows of these threads, since messages that now parse can change
+    # which message was replied to.
+    stale_msg_ids = {
+        msg['id']
+        for response in payloads.values()
+        for msg in response.get('messages', [])
+    }
+    if state is not None:
+        stale_msg_ids.update(
+            msg_id
+            for thread_id in payloads
+            if thread_id in state.threads
+            for msg_id in state.threads[thread_id].msg_ids
+        )
+
+    if threads:
+        with create_sink() as sink:
+            sink.write_batches(
+                read_row_batches(output_path, exclude_msg_ids=stale_msg_ids)
+            )
+            for thread in threads:
+                sink.add_thread(thread)
+
+    if state is not None:
+        for thread in threads:
+            update_fingerprint(state, thread)
+    dead_letter_queue.rewrite(remaining)
+
+    logging.info(
+        f'Reprocessed {len(threads)} threads. {len(remaining)} dead letters '
+        f'remain.'
+    )
+    return threads
+
+
+def main():
+    if not os.path.exists(OUTPUT_PATH):
+        print('No dataset found. Run prepare_data.py first.')
+        return
+
+    dead_letter_queue = DeadLetterQueue(DLQ_PATH)
+    cache = RawThreadCache(RAW_CACHE_PATH, max_bytes=RAW_CACHE_MAX_BYTES)
+    state = load_sync_state(SYNC_STATE_PATH)
+
+    threads = reprocess_dead_letters(
+        dead_letter_queue, cache, OUTPUT_PATH, state=state
+    )
+    cache.close()
+    # Only save state once the dataset is updated
+    if state is not None and threads:
+        save_sync_state(state, SYNC_STATE_PATH)
+
+    print(
+        f'Reprocessed {len(threads)} threads. '
+        f'{len(dead_letter_queue.read())} dead letters remain.'
+    )
+
+
+if __name__ == '__main__':
+    main()
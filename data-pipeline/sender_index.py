@@ -0,0 +1,223 @@
+"""
+Normalized senders. The `From` header comes in many spellings for the same
+person (`John Doe <john.doe@email.com>`, `"Doe, John" <John.Doe@email.com>`,
+or just the address), so rather than searching substrings of the raw header
+on every message, each distinct header is parsed once into name, address
+and domain.
+
+`SenderIndex` interns these into integer codes: one code per distinct header
+(the sender code), and one per distinct address and domain. Columns of
+headers are encoded by only looking up their distinct values (the `sender`
+column is dictionary encoded in the dataset anyway), and membership tests
+like "sent by me" become `np.isin()` over integer arrays.
+
+Codes are only ever appended, and the index can be persisted in SQLite, so
+codes stay the same across runs (e.g., for the `sender` category feature).
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import sqlite3
+from email.utils import parseaddr
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DEFAULT_INDEX_PATH = 'senders.sqlite'
+# Code of missing senders (no `From` header)
+MISSING = -1
+
+
+class Sender(NamedTuple):
+    name: str
+    address: str
+    domain: str
+
+
+@lru_cache(maxsize=2**16)
+def parse_sender(header: str) -> Sender:
+    """
+    Split `From` header into display name, and (lower case) address and
+    domain. Headers that aren't addresses are kept as the address, so they
+    still only match themselves.
+    """
+    name, address = parseaddr(header)
+    address = (address or header).strip().lower()
+    return Sender(name=name, address=address, domain=address.rpartition('@')[2])
+
+
+class SenderIndex:
+    """
+    Append-only dictionary of senders. With a `path`, it's loaded from (and
+    `save()`d to) an SQLite database; otherwise it only lives in memory.
+    """
+    def __init__(self, path: str | None = None):
+        self.path = path
+
+        self._sender_codes: dict[str, int] = {}
+        self._senders: list[Sender] = []
+        self._address_codes: dict[str, int] = {}
+        self._domain_codes: dict[str, int] = {}
+        # Per sender code, as arrays for vectorized lookups
+        self._address_of_sender = np.empty(0, dtype=np.int32)
+        self._domain_of_sender = np.empty(0, dtype=np.int32)
+        self._n_saved = 0
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS senders (
+                    code INTEGER PRIMARY KEY,
+                    header TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    address TEXT NOT NULL,
+                    domain TEXT NOT NULL
+                )
+                """
+            )
+            rows = self._conn.execute(
+                'SELECT header, name, address, domain FROM senders '
+                'ORDER BY code'
+            )
+            for header, name, address, domain in rows:
+                self._add(header, Sender(name, address, domain))
+            self._n_saved = len(self._senders)
+
+    def __len__(self) -> int:
+        return len(self._senders)
+
+    def __contains__(self, header: str) -> bool:
+        return header in self._sender_codes
+
+    def __enter__(self) -> SenderIndex:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.save()
+        self.close()
+
+    @property
+    def n_addresses(self) -> int:
+        return len(self._address_codes)
+
+    def intern(self, header: str) -> int:
+        """Sender code of `header`, which is added if it's new."""
+        code = self._sender_codes.get(header)
+        if code is None:
+            code = self._add(header, parse_sender(header))
+        return code
+
+    def encode(
+        self,
+        headers: pa.Array | pa.ChunkedArray | Iterable[str | None],
+    ) -> np.ndarray:
+        """
+        Sender codes (`MISSING` for nulls) of a column of headers. Only the
+        column's distinct headers are interned.
+        """
+        if not isinstance(headers, (pa.Array, pa.ChunkedArray)):
+            headers = pa.array(headers, type=pa.string())
+        if isinstance(headers, pa.ChunkedArray):
+            headers = headers.combine_chunks()
+        if not pa.types.is_dictionary(headers.type):
+            headers = pc.dictionary_encode(headers)
+
+        codes_of_values = np.fromiter(
+            (self.intern(header) for header in headers.dictionary.to_pylist()),
+            dtype=np.int32,
+            count=len(headers.dictionary),
+        )
+        indices = headers.indices.fill_null(0).to_numpy(zero_copy_only=False)
+        codes = codes_of_values[indices] if len(codes_of_values) else \
+            np.full(len(headers), MISSING, dtype=np.int32)
+        if headers.null_count:
+            codes[headers.is_null().to_numpy(zero_copy_only=False)] = MISSING
+        return codes
+
+    def lookup(self, code: int) -> Sender:
+        return self._senders[code]
+
+    def address_code(self, address: str) -> int | None:
+        """Code of `address` (or of the address in a header), if known."""
+        return self._address_codes.get(parse_sender(address).address)
+
+    def address_codes(self, sender_codes: np.ndarray) -> np.ndarray:
+        """Map sender codes to address codes (`MISSING` stays `MISSING`)."""
+        return _take(self._address_of_sender, sender_codes)
+
+    def domain_codes(self, sender_codes: np.ndarray) -> np.ndarray:
+        return _take(self._domain_of_sender, sender_codes)
+
+    def is_from(
+        self,
+        sender_codes: np.ndarray,
+        addresses: Iterable[str] = (),
+        domains: Iterable[str] = (),
+    ) -> np.ndarray:
+        """
+        Whether each sender has one of the `addresses` (which may also be
+        given as headers), or is from one of the `domains`.
+        """
+        address_codes = [
+            code for code in map(self.address_code, addresses)
+            if code is not None
+        ]
+        domain_codes = [
+            self._domain_codes[domain.lower()] for domain in domains
+            if domain.lower() in self._domain_codes
+        ]
+        return np.isin(self.address_codes(sender_codes), address_codes) \
+            | np.isin(self.domain_codes(sender_codes), domain_codes)
+
+    def save(self) -> None:
+        """Persist senders added since the index was loaded (or last saved)."""
+        if self._conn is None or self._n_saved == len(self._senders):
+            return
+        headers = list(self._sender_codes)
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO senders (code, header, name, address, domain) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (
+                    (code, headers[code], *self._senders[code])
+                    for code in range(self._n_saved, len(self._senders))
+                ),
+            )
+        self._n_saved = len(self._senders)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _add(self, header: str, sender: Sender) -> int:
+        code = len(self._senders)
+        self._sender_codes[header] = code
+        self._senders.append(sender)
+        address_code = self._address_codes.setdefault(
+            sender.address, len(self._address_codes)
+        )
+        domain_code = self._domain_codes.setdefault(
+            sender.domain, len(self._domain_codes)
+        )
+        # Grow arrays geometrically, rather than copying them on every add
+        if code == len(self._address_of_sender):
+            capacity = max(16, 2 * code)
+            self._address_of_sender = np.resize(self._address_of_sender, capacity)
+            self._domain_of_sender = np.resize(self._domain_of_sender, capacity)
+        self._address_of_sender[code] = address_code
+        self._domain_of_sender[code] = domain_code
+        return code
+
+
+def _take(codes: np.ndarray, sender_codes: np.ndarray) -> np.ndarray:
+    sender_codes = np.asarray(sender_codes)
+    is_missing = sender_codes == MISSING
+    result = codes[np.where(is_missing, 0, sender_codes)] if len(codes) else \
+        np.zeros(len(sender_codes), dtype=np.int32)
+    return np.where(is_missing, MISSING, result).astype(np.int32)
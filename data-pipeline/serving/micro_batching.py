@@ -0,0 +1,139 @@
+"""
+Micro-batching of single predictions: Models predict a batch of texts much
+faster than the same texts one by one, so requests arriving around the same
+time are grouped, with a bound on how long each of them waits for others.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Generic, TypeVar
+
+import numpy as np
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_STOP = object()
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Runs `predict_batch` in a background thread, for batches of up to
+    `max_batch_size` submitted items. A batch is started as soon as it's full,
+    or once its first item has waited `max_latency` seconds.
+    """
+    def __init__(
+        self,
+        predict_batch: Callable[[list[T]], list[R]],
+        max_batch_size: int = 64,
+        max_latency: float = 0.01,
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.n_batches = 0
+        self.n_items = 0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def mean_batch_size(self) -> float | None:
+        return self.n_items / self.n_batches if self.n_batches else None
+
+    def submit(self, item: T) -> Future:
+        future: Future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def close(self) -> None:
+        """Predict items submitted so far, then stop the worker."""
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _run(self) -> None:
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = entry[2] + self.max_latency
+
+            while len(batch) < self.max_batch_size:
+                try:
+                    entry = self._queue.get(
+                        timeout=max(0.0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    self._predict(batch)
+                    return
+                batch.append(entry)
+
+            self._predict(batch)
+
+    def _predict(self, batch: list[tuple[T, Future, float]]) -> None:
+        self.n_batches += 1
+        self.n_items += len(batch)
+        try:
+            results = self.predict_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+
+class LatencyStats:
+    """
+    Latency percentiles of the last `window` requests, and throughput since
+    the first one. Safe to share between threads.
+    """
+    def __init__(
+        self,
+        window: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.n_requests = 0
+        self.n_items = 0
+        self._clock = clock
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._started: float | None = None
+        self._lock = threading.Lock()
+
+    def record(self, started: float, n_items: int = 1) -> None:
+        """Record request that started at `started` (per `clock`) and just ended."""
+        with self._lock:
+            if self._started is None:
+                self._started = started
+            self._latencies.append(self._clock() - started)
+            self.n_requests += 1
+            self.n_items += n_items
+
+    def summary(self) -> dict[str, float | int | None]:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            elapsed = self._clock() - self._started if self._started else 0.0
+            n_requests, n_items = self.n_requests, self.n_items
+
+        if not len(latencies):
+            p50 = p99 = None
+        else:
+            p50, p99 = (
+                float(p) for p in np.percentile(latencies, [50, 99]) * 1000
+            )
+        return {
+            'requests': n_requests,
+            'items': n_items,
+            'p50_ms': p50,
+            'p99_ms': p99,
+            'items_per_second': n_items / elapsed if elapsed else None,
+        }
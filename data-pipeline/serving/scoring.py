@@ -0,0 +1,141 @@
+"""
+Scoring of emails by the BlazingText model trained in
+`2-blazing-text-model-training.ipynb`, locally on CPU. BlazingText's
+supervised models are compatible with fastText, so they are loaded with the
+`fasttext` package (optional dependency: `pip install fasttext`).
+
+Bodies are preprocessed like the training data, and the probabilities of both
+labels are returned in the shape `_prediction_to_df_row()` in
+`4_deploy.ipynb` produces, e.g. `{'__label__reply': 0.2,
+'__label__no_reply': 0.8}`.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import hashlib
+import os
+import tarfile
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any
+
+import pyarrow as pa
+
+from preprocessing.blazing_text import to_text_label
+from preprocessing.cleanup import clean_text
+from preprocessing.tokenization import Tokenizer, nltk_tokenize, tokenize_texts
+from serving.micro_batching import MicroBatcher
+
+LABELS = (to_text_label(1), to_text_label(0))
+
+Prediction = dict[str, float]
+
+
+def load_model(path: str) -> Any:
+    """
+    Load model from the `model.tar.gz` written by the training job, or the
+    `model.bin` inside of it.
+    """
+    import fasttext
+
+    if not path.endswith('.tar.gz'):
+        return fasttext.load_model(path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with tarfile.open(path) as archive:
+            archive.extract('model.bin', tmp_dir)
+        return fasttext.load_model(os.path.join(tmp_dir, 'model.bin'))
+
+
+def body_key(body: str) -> str:
+    return hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+
+
+class ReplyScorer:
+    """
+    Predicts the probability of each label for email bodies. Predictions
+    that aren't cached (by hash of the body) are grouped into micro-batches
+    across concurrent callers, see `MicroBatcher`.
+
+    `model` needs fastText's `predict(texts, k)` method.
+    """
+    def __init__(
+        self,
+        model: Any,
+        tokenizer: Tokenizer = nltk_tokenize,
+        max_batch_size: int = 64,
+        max_latency: float = 0.01,
+        cache_size: int = 100_000,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+        self._cache: OrderedDict[str, Prediction] = OrderedDict()
+        self._lock = threading.Lock()
+        self._batcher: MicroBatcher[str, Prediction] = MicroBatcher(
+            self.predict_batch, max_batch_size, max_latency
+        )
+
+    @property
+    def hit_rate(self) -> float | None:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    @property
+    def mean_batch_size(self) -> float | None:
+        return self._batcher.mean_batch_size
+
+    def score(self, bodies: list[str]) -> list[Prediction]:
+        """Blocks until all predictions are available."""
+        keys = [body_key(body) for body in bodies]
+        predictions: dict[int, Prediction] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    predictions[i] = self._cache[key]
+            self.hits += len(predictions)
+            self.misses += len(keys) - len(predictions)
+
+        futures: dict[int, Future] = {
+            i: self._batcher.submit(body)
+            for i, body in enumerate(bodies) if i not in predictions
+        }
+        for i, future in futures.items():
+            predictions[i] = future.result()
+
+        with self._lock:
+            for i in futures:
+                self._cache[keys[i]] = predictions[i]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return [predictions[i] for i in range(len(bodies))]
+
+    def predict_batch(self, bodies: list[str]) -> list[Prediction]:
+        """Predict without cache or batching."""
+        features = list(tokenize_texts(
+            clean_text(pa.array(bodies, type=pa.string())).to_pylist(),
+            tokenizer=self.tokenizer,
+        ))
+        labels, probs = self.model.predict(features, k=len(LABELS))
+        return [
+            _to_prediction(text_labels, text_probs)
+            for text_labels, text_probs in zip(labels, probs)
+        ]
+
+    def close(self) -> None:
+        self._batcher.close()
+
+
+def _to_prediction(labels: list[str], probs: list[float]) -> Prediction:
+    # fastText omits labels with probability (close to) 0
+    prediction = {label: 0.0 for label in LABELS}
+    prediction.update(
+        (label, float(prob)) for label, prob in zip(labels, probs)
+    )
+    return prediction
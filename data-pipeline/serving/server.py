@@ -0,0 +1,158 @@
+"""
+Local scoring service, so new mail can be scored continuously rather than via
+a SageMaker endpoint that's torn down after each batch of predictions.
+Start it from the data pipeline's directory:
+
+    python -m serving.server --model model.tar.gz --port 8081
+
+Endpoints (in the style of SageMaker's inference containers):
+- `POST /invocations` with `{"instances": [<email body>, ...]}` returns one
+  `{"__label__reply": ..., "__label__no_reply": ...}` per instance. Send
+  single emails or small requests; concurrent requests are micro-batched.
+- `GET /ping` returns 200 once the model is loaded.
+- `GET /stats` returns p50/p99 latency, throughput, mean batch size, and
+  cache hit rate.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from serving.micro_batching import LatencyStats
+from serving.scoring import ReplyScorer, load_model
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        scorer: ReplyScorer,
+        address: tuple[str, int] = ('localhost', 0),
+    ):
+        super().__init__(address, _RequestHandler)
+        self.scorer = scorer
+        self.latency_stats = LatencyStats()
+        self.n_errors = 0
+        self._errors_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread (e.g., in tests)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        self.scorer.close()
+
+    def record_error(self) -> None:
+        with self._errors_lock:
+            self.n_errors += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.latency_stats.summary(),
+            'mean_batch_size': self.scorer.mean_batch_size,
+            'cache_hit_rate': self.scorer.hit_rate,
+            'errors': self.n_errors,
+        }
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: ScoringServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        if self.path == '/ping':
+            self._send(200, {})
+        elif self.path == '/stats':
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self) -> None:
+        started = time.monotonic()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/invocations':
+            self._send(404, {'error': f'Not found: {self.path}'})
+            return
+
+        try:
+            instances = json.loads(body)['instances']
+            if not all(isinstance(instance, str) for instance in instances):
+                raise ValueError('Instances must be strings.')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': f'Invalid request: {e}'})
+            return
+
+        try:
+            status, response = 200, self.server.scorer.score(instances)
+        except Exception as e:
+            # E.g., model errors, or bodies that can't be encoded
+            logging.exception('Scoring failed.')
+            self.server.record_error()
+            status, response = 500, {'error': f'Scoring failed: {e}'}
+        # Record before responding, so stats requested afterwards include it
+        self.server.latency_stats.record(started, n_items=len(instances))
+        self._send(status, response)
+
+    def _send(self, status: int, response: Any) -> None:
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Logging every request would dominate the latency of small requests
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Local scoring service for the reply model.'
+    )
+    parser.add_argument('--model', required=True,
+                        help='model.tar.gz of the training job, or model.bin.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-latency-ms', type=float, default=10,
+                        help='Longest time a request waits for a batch to fill.')
+    parser.add_argument('--cache-size', type=int, default=100_000,
+                        help='Number of predictions cached by body hash.')
+    args = parser.parse_args()
+
+    scorer = ReplyScorer(
+        load_model(args.model),
+        max_batch_size=args.max_batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        cache_size=args.cache_size,
+    )
+    server = ScoringServer(scorer, (args.host, args.port))
+    print(f'Scoring at {server.url}/invocations')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scorer.close()
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from base64 import urlsafe_b64encode
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from body_extraction import find_body_part, get_backend, get_body_as_text
+from fake_gmail import FakeGmail, make_message
+from thread_api import get_threads_with_details
+
+
+def _part(mime_type: str, content: str, charset: str = 'utf-8', **kwargs) -> dict:
+    return {
+        'mimeType': mime_type,
+        'headers': [
+            {'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}
+        ],
+        'body': {
+            'data': urlsafe_b64encode(content.encode(charset)).decode()
+        },
+        **kwargs,
+    }
+
+
+def _multipart(mime_type: str, *parts: dict) -> dict:
+    return {'mimeType': mime_type, 'body': {'size': 0}, 'parts': list(parts)}
+
+
+def _msg(payload: dict) -> dict:
+    return {'id': 'm0', 'payload': payload}
+
+
+def test_nested_plain_text_part_is_preferred():
+    payload = _multipart(
+        'multipart/mixed',
+        _multipart(
+            'multipart/alternative',
+            _part('text/html', '<p>Hi &amp; bye</p>'),
+            _part('text/plain', 'Hi & bye'),
+        ),
+        _part('text/plain', 'Attachment', filename='notes.txt'),
+    )
+
+    assert get_body_as_text(_msg(payload)) == 'Hi & bye'
+
+
+def test_html_only_message_is_converted_to_text():
+    payload = _multipart(
+        'multipart/related',
+        _part('image/png', 'not really a png'),
+        _part('text/html', '<div>Hello <b>there</b></div>'),
+    )
+
+    assert get_body_as_text(_msg(payload)) == 'Hello there'
+
+
+def test_plain_text_is_decoded_with_its_charset():
+    payload = _part('text/plain', 'Grüße', charset='iso-8859-1')
+
+    assert get_body_as_text(_msg(payload)) == 'Grüße'
+
+
+def test_message_without_body():
+    payload = _multipart('multipart/mixed', {'mimeType': 'text/plain', 'body': {}})
+
+    assert find_body_part(payload) is None
+    assert get_body_as_text(_msg(payload)) == ''
+
+
+def test_backend_is_pluggable(monkeypatch):
+    payload = _part('text/html', '<p>Hi</p>')
+
+    assert get_body_as_text(_msg(payload), html_to_text=lambda html: 'custom') \
+        == 'custom'
+
+    monkeypatch.setenv('HTML_TO_TEXT_BACKEND', 'unknown')
+    with pytest.raises(ValueError):
+        get_backend()
+
+
+def test_threads_can_be_parsed_in_process_pool():
+    gmail = FakeGmail({
+        f't{i}': [make_message(
+            f'm{i}', 'a@b.com', body=f'<p>Body {i}</p>', mime_type='text/html'
+        )]
+        for i in range(10)
+    })
+
+    with ProcessPoolExecutor(max_workers=2) as parse_executor:
+        results = list(get_threads_with_details(
+            list(gmail.mailbox),
+            max_requests_per_second=None,
+            client_factory=lambda: gmail,
+            parse_executor=parse_executor,
+        ))
+
+    assert [thread.msg_body for thread, _ in results] == [
+        [f'Body {i}'] for i in range(10)
+    ]
@@ -0,0 +1,83 @@
+import pyarrow as pa
+
+from checkpoint import CommittedPart, ExtractionCheckpoint
+from data_models import Message
+from domain_models.email_thread import EmailThread
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+
+
+def _thread(i: int) -> EmailThread:
+    return EmailThread(
+        thread_id=f't{i}',
+        messages=[
+            Message(msg_id=f'm{i}', sender='a@b.com', body='Hi ✓', timestamp=i),
+            Message(msg_id=f'r{i}', sender=ME, body='Thanks', timestamp=i + 1),
+        ],
+        history_id=str(i),
+    )
+
+
+def test_progress_is_committed_in_chunks_and_resumed(tmp_path):
+    directory = str(tmp_path / 'checkpoint')
+    checkpoint = ExtractionCheckpoint(directory, chunk_size=2)
+    checkpoint.load_or_start(history_id='100')
+    for i in range(3):
+        checkpoint.add(_thread(i))
+    # Simulate crash: third thread was never committed
+
+    resumed = ExtractionCheckpoint(directory, chunk_size=2)
+    progress = resumed.load_or_start(history_id='200')
+
+    assert progress.sync_state.history_id == '100'
+    assert progress.parts == ['part-00000.parquet']
+    assert [resumed.is_processed(f't{i}') for i in range(3)] == [
+        True, True, False
+    ]
+
+    resumed.add(_thread(2))
+    resumed.commit()
+    df = pa.Table.from_batches(resumed.iter_batches()).to_pandas()
+
+    assert list(df.msg_id) == ['m0', 'm1', 'm2']
+    assert df.replied_to.all()
+    assert df.body[1] == 'Hi ✓'
+    assert sorted(progress.sync_state.threads) == ['t0', 't1', 't2']
+
+
+def test_clear_removes_checkpoint(tmp_path):
+    directory = tmp_path / 'checkpoint'
+    checkpoint = ExtractionCheckpoint(str(directory))
+    checkpoint.load_or_start(history_id='1')
+    checkpoint.add(_thread(0))
+    checkpoint.commit()
+
+    checkpoint.clear()
+
+    assert not directory.exists()
+    assert ExtractionCheckpoint(str(directory)) \
+        .load_or_start(history_id='2').parts == []
+
+
+def test_commits_only_write_their_own_threads_and_dead_letters(tmp_path):
+    directory = tmp_path / 'checkpoint'
+    checkpoint = ExtractionCheckpoint(str(directory), chunk_size=2)
+    checkpoint.load_or_start(history_id='100')
+    progress_file = (directory / 'progress.json').read_text()
+    for i in range(5):
+        dlq = [{'exception': ValueError('Broken'), 'message': {'id': f'm{i}'}}]
+        checkpoint.add(_thread(i), dlq if i % 2 else None)
+    # Simulate crash: fifth thread was never committed
+
+    assert (directory / 'progress.json').read_text() == progress_file
+    second_part = CommittedPart.model_validate_json(
+        (directory / 'part-00001.json').read_text()
+    )
+    assert sorted(second_part.threads) == ['t2', 't3']
+    assert [letter.msg_id for letter in second_part.dead_letters] == ['m3']
+
+    progress = ExtractionCheckpoint(str(directory)).load_or_start('200')
+
+    assert progress.parts == ['part-00000.parquet', 'part-00001.parquet']
+    assert sorted(progress.sync_state.threads) == ['t0', 't1', 't2', 't3']
+    assert [letter.msg_id for letter in progress.dead_letters] == ['m1', 'm3']
@@ -0,0 +1,24 @@
+## Local imports wouldn't work at the top of the file because they rely on
+## modified system path. So they are in pytest_sessionstart().
+# pylint: disable=import-outside-toplevel
+# pylint: disable=unused-import
+
+import sys
+from pathlib import Path
+import pytest
+
+
+def pytest_sessionstart(session) -> None:
+    """"This is run at the start of each test session."""
+
+    # Add data pipeline's root directory to path, since its modules import each
+    # other as top-level modules (e.g., `from data_models import Message`).
+    DATA_PIPELINE_ROOT_DIR: Path = (
+        Path(__file__).parent  # tests/
+        .parent  # data-pipeline/
+        .resolve()
+    )
+
+    sys.path.append(
+        str(DATA_PIPELINE_ROOT_DIR)
+    )
@@ -0,0 +1,65 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from data_models import Message
+from dataset_access import open_dataset_cached, open_frame, read_frame, write_frame
+from domain_models.email_thread import EmailThread
+from parquet_sink import ParquetRowSink
+
+
+def test_frames_round_trip_with_index(tmp_path):
+    path = str(tmp_path / 'df_test.arrow')
+    df = pd.DataFrame(
+        {'label': [0, 1, 0], 'feature': ['a b', 'c', 'd e f']},
+        index=pd.Index([7, 3, 5]),
+    )
+
+    write_frame(df, path)
+
+    pd.testing.assert_frame_equal(read_frame(path), df)
+    assert read_frame(path, columns=['feature']).index.tolist() == [7, 3, 5]
+
+
+def test_columns_are_converted_lazily(tmp_path):
+    path = str(tmp_path / 'df.arrow')
+    write_frame(pd.DataFrame({'label': [0, 1], 'feature': ['a', 'b']}), path)
+
+    allocated = pa.total_allocated_bytes()
+    frame = open_frame(path, arrow_backed=True)
+    # Memory-mapped, so nothing was read into memory
+    assert pa.total_allocated_bytes() == allocated
+    assert frame.shape == (2, 2)
+    assert frame._series == {}
+
+    assert frame.feature.tolist() == ['a', 'b']
+    assert list(frame._series) == ['feature']
+    assert isinstance(frame.feature.dtype, pd.ArrowDtype)
+
+
+def test_dataset_cache_is_rebuilt_when_dataset_changes(tmp_path):
+    dataset_path = str(tmp_path / 'dataset')
+    cache_path = str(tmp_path / 'dataset.arrow')
+
+    def write_dataset(n_threads: int):
+        with ParquetRowSink(dataset_path) as sink:
+            for i in range(n_threads):
+                sink.add_thread(EmailThread(f't{i}', [
+                    Message(msg_id=f'm{i}', sender='a', body='b', timestamp=i)
+                ]))
+
+    write_dataset(1)
+    assert len(open_dataset_cached(dataset_path, cache_path)) == 1
+
+    # Staleness doesn't depend on the copy's (or directory's) mtime
+    os.utime(cache_path, (2**31, 2**31))
+    write_dataset(2)
+    frame = open_dataset_cached(dataset_path, cache_path, columns=['msg_id'])
+    assert frame.columns == ['msg_id']
+    assert frame.msg_id.tolist() == ['m0', 'm1']
+
+    # Unchanged dataset: the copy is reused
+    built_at = os.stat(cache_path).st_mtime_ns
+    assert len(open_dataset_cached(dataset_path, cache_path, ['msg_id'])) == 2
+    assert os.stat(cache_path).st_mtime_ns == built_at
@@ -0,0 +1,133 @@
+import pyarrow.parquet as pq
+import pytest
+
+import thread_api
+from dead_letter_queue import DeadLetterQueue
+from fake_gmail import make_message
+from incremental_sync import create_sync_state
+from parquet_sink import ParquetRowSink
+from raw_cache import RawThreadCache
+from reprocess_dlq import reprocess_dead_letters
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = RawThreadCache(str(tmp_path / 'raw.sqlite'))
+    cache.put('t0', {
+        'id': 't0',
+        'historyId': '1',
+        'messages': [
+            make_message('m0', 'a@b.com', body='Broken'),
+            make_message('m1', ME),
+        ],
+    })
+    cache.put('t1', {
+        'id': 't1',
+        'historyId': '1',
+        'messages': [make_message('m2', 'a@b.com')],
+    })
+    yield cache
+    cache.close()
+
+
+def _failing_extractor(monkeypatch):
+    """Extractor with a bug: fails on bodies containing 'Broken'."""
+    get_body_as_text = thread_api.get_body_as_text
+
+    def buggy_get_body_as_text(msg, html_to_text=None):
+        body = get_body_as_text(msg, html_to_text)
+        if 'Broken' in body:
+            raise ValueError('Could not parse body.')
+        return body
+
+    monkeypatch.setattr(thread_api, 'get_body_as_text', buggy_get_body_as_text)
+
+
+def test_dead_letters_are_persisted_and_queryable(tmp_path, cache, monkeypatch):
+    _failing_extractor(monkeypatch)
+    dead_letter_queue = DeadLetterQueue(str(tmp_path / 'dlq.jsonl'))
+    for thread, dlq in thread_api.load_threads_from_cache(cache):
+        dead_letter_queue.add(thread, dlq)
+    # Resumed downloads can add the same dead letter again
+    thread, dlq = thread_api._parse_thread_response('t0', cache.get('t0'))
+    dead_letter_queue.add(thread, dlq)
+
+    (letter,) = DeadLetterQueue(dead_letter_queue.path).read()
+    assert (letter.thread_id, letter.msg_id) == ('t0', 'm0')
+    assert letter.error_class == 'ValueError'
+    assert letter.history_id == '1'
+
+    dead_letter_queue.export_parquet(str(tmp_path / 'dlq.parquet'))
+    table = pq.read_table(tmp_path / 'dlq.parquet')
+    assert table.column('msg_id').to_pylist() == ['m0']
+
+    dead_letter_queue.drop_threads(['t0'])
+    assert dead_letter_queue.read() == []
+
+
+def test_reprocessing_replaces_only_dead_lettered_threads(
+    tmp_path, cache, monkeypatch
+):
+    output_path = str(tmp_path / 'df.parquet')
+    dead_letter_queue = DeadLetterQueue(str(tmp_path / 'dlq.jsonl'))
+    with monkeypatch.context() as patch:
+        _failing_extractor(patch)
+        threads = []
+        with ParquetRowSink(output_path) as sink:
+            for thread, dlq in thread_api.load_threads_from_cache(cache):
+                sink.add_thread(thread)
+                dead_letter_queue.add(thread, dlq)
+                threads.append(thread)
+    state = create_sync_state('1', threads)
+    # Without m0, my message seems to start t0
+    table = pq.read_table(output_path).to_pydict()
+    assert table['msg_id'] == ['m1', 'm2']
+    assert not any(table['replied_to'])
+
+    # Extractor is fixed now
+    reprocessed = reprocess_dead_letters(
+        dead_letter_queue,
+        cache,
+        output_path,
+        create_sink=lambda: ParquetRowSink(output_path),
+        state=state,
+    )
+
+    assert [thread.thread_id for thread in reprocessed] == ['t0']
+    table = pq.read_table(output_path).to_pydict()
+    assert table['msg_id'] == ['m2', 'm0']
+    assert table['replied_to'] == [False, True]
+    assert state.threads['t0'].msg_ids == ['m0', 'm1']
+    assert dead_letter_queue.read() == []
+
+
+def test_stale_cached_payloads_are_not_reprocessed(tmp_path, cache, monkeypatch):
+    output_path = str(tmp_path / 'df.parquet')
+    dead_letter_queue = DeadLetterQueue(str(tmp_path / 'dlq.jsonl'))
+    with monkeypatch.context() as patch:
+        _failing_extractor(patch)
+        with ParquetRowSink(output_path) as sink:
+            for thread, dlq in thread_api.load_threads_from_cache(cache):
+                sink.add_thread(thread)
+                dead_letter_queue.add(thread, dlq)
+    # The cached payload was replaced by a newer version of the thread
+    cache.put('t0', {
+        'id': 't0',
+        'historyId': '2',
+        'messages': [make_message('m0', 'a@b.com', body='Fixed')],
+    })
+
+    reprocessed = reprocess_dead_letters(
+        dead_letter_queue,
+        cache,
+        output_path,
+        create_sink=lambda: ParquetRowSink(output_path),
+    )
+
+    assert reprocessed == []
+    assert pq.read_table(output_path).column('msg_id').to_pylist() == \
+        ['m1', 'm2']
+    (letter,) = dead_letter_queue.read()
+    assert (letter.thread_id, letter.history_id) == ('t0', '1')
@@ -0,0 +1,64 @@
+import pytest
+
+from data_models import Message
+from domain_models.email_thread import EmailThread
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+
+
+def _thread(senders: list[str]) -> EmailThread:
+    return EmailThread(
+        thread_id='t0',
+        messages=[
+            Message(msg_id=f'm{i}', sender=sender, body=f'Body {i}', timestamp=i)
+            for i, sender in enumerate(senders)
+        ],
+    )
+
+
+def test_messages_after_first_reply_are_discarded():
+    thread = _thread(['a@b.com', 'c@d.com', ME, 'a@b.com', ME])
+
+    assert thread.find_msg_replied_to() == 'm1'
+    assert thread.find_messages_to_discard() == ['m2', 'm3', 'm4']
+    assert thread.get_transformed_data() == {
+        'm0': {'replied_to': False, 'sender': 'a@b.com', 'body': 'Body 0',
+               'timestamp': 0},
+        'm1': {'replied_to': True, 'sender': 'c@d.com', 'body': 'Body 1',
+               'timestamp': 1},
+    }
+
+
+@pytest.mark.parametrize('senders', [
+    [ME, 'a@b.com'],  # Thread started by me
+    ['a@b.com', 'c@d.com'],  # Never replied to
+])
+def test_threads_without_reply_keep_all_messages(senders):
+    thread = _thread(senders)
+
+    assert thread.find_msg_replied_to() is None
+    columns = thread.get_columns()
+    assert columns['msg_id'] == ['m0', 'm1']
+    assert columns['replied_to'] == [False, False]
+
+
+def test_columns_match_transformed_data():
+    thread = _thread(['a@b.com', 'c@d.com', ME])
+    columns = thread.get_columns()
+
+    assert columns['msg_id'] == list(thread.get_transformed_data())
+    assert columns['timestamp'] == [0, 1]
+
+
+def test_thread_can_be_created_from_columns():
+    thread = _thread(['a@b.com', ME])
+    same_thread = EmailThread.from_columns(
+        thread_id='t0',
+        msg_ids=['m0', 'm1'],
+        senders=['a@b.com', ME],
+        msg_body=['Body 0', 'Body 1'],
+        timestamps=[0, 1],
+    )
+
+    assert same_thread.get_columns() == thread.get_columns()
+    assert not hasattr(same_thread, '__dict__')
@@ -0,0 +1,54 @@
+import gzip
+import json
+
+import pandas as pd
+import pyarrow as pa
+
+from preprocessing.exporters import export_jsonl, shard_paths
+
+
+def test_jsonl_is_sharded_round_robin_across_batches(tmp_path):
+    table = pa.table({'id': list(range(7)), 'text': [f't{i}' for i in range(7)]})
+
+    paths = export_jsonl(
+        table, str(tmp_path / 'input.jsonl'), n_shards=3, batch_size=2
+    )
+
+    assert paths == shard_paths(str(tmp_path / 'input.jsonl'), n_shards=3)
+    assert paths[0].endswith('input-00000-of-00003.jsonl')
+    ids = [
+        [json.loads(line)['id'] for line in open(path)] for path in paths
+    ]
+    assert ids == [[0, 3, 6], [1, 4], [2, 5]]
+
+
+def test_dataframes_are_written_compressed(tmp_path):
+    df = pd.DataFrame({
+        'replied_to': [True, False],
+        'sender': ['a@b.com', 'c@d.com'],
+        'time_received': pd.to_datetime(['2020-01-01', '2020-01-02']),
+    }, index=[5, 3])
+
+    (path,) = export_jsonl(
+        df, str(tmp_path / 'input.jsonl'), columns=['replied_to', 'sender'],
+        compress=True,
+    )
+
+    assert path.endswith('input.jsonl.gz')
+    with gzip.open(path, 'rt') as f:
+        assert [json.loads(line) for line in f] == [
+            {'replied_to': True, 'sender': 'a@b.com'},
+            {'replied_to': False, 'sender': 'c@d.com'},
+        ]
+    assert list(tmp_path.iterdir()) == [tmp_path / 'input.jsonl.gz']
+
+
+def test_rows_are_written_by_index(tmp_path):
+    table = pa.table({'id': list(range(4))})
+
+    (path,) = export_jsonl(
+        table, str(tmp_path / 'input.jsonl'), indices=[3, 0, 3, 1, 3],
+        batch_size=2,
+    )
+
+    assert [json.loads(line)['id'] for line in open(path)] == [3, 0, 3, 1, 3]
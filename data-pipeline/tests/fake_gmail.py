@@ -0,0 +1,183 @@
+"""
+Local stand-in for the Gmail discovery client returned by
+`email_utils.gmail_client.create_client()`. It only implements the resources
+and methods used by the data pipeline, and serves them from an in-memory
+mailbox, so tests don't need OAuth or network access.
+"""
+# Enable current type hints for older Python version (<3.10)
+from __future__ import annotations
+import threading
+from typing import Any, Callable
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# The same mailbox model and messages as the HTTP stand-in
+from fake_gmail_server import ApiError, FakeMailbox, make_message
+
+
+def make_http_error(status: int) -> HttpError:
+    return HttpError(
+        resp=httplib2.Response({'status': status}),
+        content=b'{}',
+    )
+
+
+class _Request:
+    def __init__(self, fn: Callable[[], Any]):
+        self._fn = fn
+
+    def execute(self) -> Any:
+        return self._fn()
+
+
+class _BatchRequest:
+    """
+    Replays the calls added to it one by one, and reports each outcome to its
+    callback, like `googleapiclient.http.BatchHttpRequest` does.
+    """
+    def __init__(self, gmail: FakeGmail):
+        self._gmail = gmail
+        self._calls: list[tuple[_Request, Callable, str]] = []
+
+    def add(
+        self,
+        request: _Request,
+        callback: Callable,
+        request_id: str,
+    ) -> None:
+        self._calls.append((request, callback, request_id))
+
+    def execute(self) -> None:
+        self._gmail.batch_sizes.append(len(self._calls))
+        for request, callback, request_id in self._calls:
+            try:
+                response = request.execute()
+            except HttpError as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
+
+
+class FakeGmail:
+    """
+    `threads` maps thread ids to lists of messages, which are served from a
+    `FakeMailbox`. `errors` maps thread ids to a list of HTTP status codes,
+    which are raised (in order) by the first threads.get calls for that
+    thread.
+
+    Every change made through `add_message()` or `delete_thread()` increments
+    the mailbox's history id and is recorded for history.list, until
+    `expire_history()` is called.
+    """
+    def __init__(
+        self,
+        threads: dict[str, list[dict]],
+        errors: dict[str, list[int]] | None = None,
+        page_size: int = 500,
+    ):
+        self.mailbox = FakeMailbox(
+            {
+                'id': thread_id,
+                'historyId': '1',
+                'messages': [{**msg, 'threadId': thread_id} for msg in messages],
+            }
+            for thread_id, messages in threads.items()
+        )
+        self.errors = {k: list(v) for k, v in (errors or {}).items()}
+        self.page_size = page_size
+        self.calls: list[str] = []
+        self.batch_sizes: list[int] = []
+        self._lock = threading.Lock()
+
+    @property
+    def history_id(self) -> int:
+        return self.mailbox.history_id
+
+    def add_message(self, thread_id: str, msg: dict) -> None:
+        self.mailbox.add_message(thread_id, msg)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.mailbox.delete_thread(thread_id)
+
+    def expire_history(self) -> None:
+        self.mailbox.expire_history()
+
+    def new_batch_http_request(self) -> _BatchRequest:
+        return _BatchRequest(self)
+
+    # Resource chain: gmail.users().threads().get(...).execute()
+    def users(self) -> _Users:
+        return _Users(self)
+
+    def _get_thread(self, thread_id: str) -> dict:
+        with self._lock:
+            self.calls.append(thread_id)
+            pending_errors = self.errors.get(thread_id)
+            if pending_errors:
+                raise make_http_error(pending_errors.pop(0))
+        return _call(self.mailbox.get_thread, thread_id)
+
+    def _list_threads(self, page_token: str | None) -> dict:
+        return _call(
+            self.mailbox.list_threads,
+            page_token=page_token,
+            max_results=self.page_size,
+        )
+
+    def _list_history(self, start_history_id: str) -> dict:
+        return _call(self.mailbox.list_history, start_history_id)
+
+
+def _call(fn: Callable, *args, **kwargs) -> Any:
+    """Raise the mailbox's errors like the discovery client does."""
+    try:
+        return fn(*args, **kwargs)
+    except ApiError as e:
+        raise make_http_error(e.status)
+
+
+class _Users:
+    def __init__(self, gmail: FakeGmail):
+        self._gmail = gmail
+
+    def threads(self) -> _Threads:
+        return _Threads(self._gmail)
+
+    def history(self) -> _History:
+        return _History(self._gmail)
+
+    def getProfile(self, userId: str) -> _Request:
+        return _Request(self._gmail.mailbox.get_profile)
+
+
+class _Threads:
+    def __init__(self, gmail: FakeGmail):
+        self._gmail = gmail
+
+    def get(self, userId: str, id: str) -> _Request:
+        return _Request(lambda: self._gmail._get_thread(id))
+
+    def list(
+        self,
+        userId: str,
+        maxResults: int = 100,
+        pageToken: str | None = None,
+        q: str | None = None,
+    ) -> _Request:
+        return _Request(lambda: self._gmail._list_threads(pageToken))
+
+
+class _History:
+    def __init__(self, gmail: FakeGmail):
+        self._gmail = gmail
+
+    def list(
+        self,
+        userId: str,
+        startHistoryId: str,
+        historyTypes: list[str] | None = None,
+        maxResults: int = 100,
+        pageToken: str | None = None,
+    ) -> _Request:
+        return _Request(lambda: self._gmail._list_history(startHistoryId))
@@ -0,0 +1,113 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+from email_utils.gmail_client import GmailSession
+from fake_gmail_server import FakeGmailServer, FakeMailbox, make_message
+from parquet_sink import ParquetRowSink
+from thread_api import (
+    get_current_history_id,
+    get_threads_with_details,
+    get_threads_with_details_batched,
+    list_all_threads,
+    list_changed_thread_ids,
+)
+
+DAY_MS = 86_400_000
+# 2020-01-01
+JAN_2020_MS = 1_577_836_800_000
+
+
+@pytest.fixture
+def server():
+    mailbox = FakeMailbox([
+        {
+            'id': f't{i}',
+            'historyId': '1',
+            'messages': [make_message(
+                f'm{i}', f'sender{i}@example.org', f'Hello {i}',
+                JAN_2020_MS + i * DAY_MS, thread_id=f't{i}',
+            )],
+        }
+        for i in range(12)
+    ])
+    server = FakeGmailServer(mailbox, max_page_size=5)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _client(server: FakeGmailServer):
+    return GmailSession(api_endpoint=server.url).get_client()
+
+
+def test_threads_are_listed_page_by_page(server):
+    gmail = _client(server)
+
+    assert len(list_all_threads(gmail=gmail)) == 12
+    assert server.stats['threads.list'] == 3
+    assert list(list_all_threads(query='after:2020/01/11', gmail=gmail)) == [
+        't11', 't10'
+    ]
+    assert list(list_all_threads(query='from:sender3@', gmail=gmail)) == ['t3']
+
+
+def test_batch_requests_return_threads_and_errors(server):
+    gmail = _client(server)
+
+    results = list(get_threads_with_details_batched(
+        ['t1', 'missing', 't2'], max_retries=0, gmail=gmail
+    ))
+
+    assert server.stats['batch'] == 1
+    assert [thread.thread_id for thread, _ in results] == ['t1', 'missing', 't2']
+    assert results[0][0].msg_body == ['Hello 1']
+    assert results[1][0].n_msgs == 0
+    assert results[1][1][0]['exception'].resp.status == 404
+
+
+def test_history_lists_changes_until_expired(server):
+    gmail = _client(server)
+    history_id = get_current_history_id(gmail=gmail)
+
+    server.mailbox.add_message(
+        't3', make_message('m3b', 'a@example.org', 'Re', JAN_2020_MS)
+    )
+    assert list_changed_thread_ids(history_id, gmail=gmail) == ({'t3'}, '2')
+
+    server.mailbox.expire_history()
+    assert list_changed_thread_ids(history_id, gmail=gmail) is None
+
+
+def test_throttling_is_injected():
+    server = FakeGmailServer(FakeMailbox.synthetic(3), error_rate=1.0)
+    server.start()
+    try:
+        with pytest.raises(HttpError) as exc_info:
+            _client(server).users().labels().list(userId='me').execute()
+    finally:
+        server.stop()
+
+    assert exc_info.value.resp.status == 429
+    assert server.stats['throttled'] == 1
+
+
+def test_synthetic_mailbox_produces_labeled_dataset(tmp_path):
+    server = FakeGmailServer(FakeMailbox.synthetic(50, seed=0))
+    server.start()
+    try:
+        session = GmailSession(api_endpoint=server.url)
+        thread_ids = list(list_all_threads(gmail=session.get_client()))
+        with ParquetRowSink(str(tmp_path / 'dataset')) as sink:
+            for thread, _ in get_threads_with_details(
+                thread_ids,
+                max_workers=2,
+                max_requests_per_second=None,
+                client_factory=session.get_client,
+            ):
+                sink.add_thread(thread)
+    finally:
+        server.stop()
+
+    assert len(thread_ids) == 50
+    # Synthetic threads are partly sent from the pipeline's own address
+    assert sink.n_replied_to > 0
@@ -0,0 +1,59 @@
+import datetime
+import threading
+
+from google.oauth2.credentials import Credentials
+
+import email_utils.gmail_client as gmail_client
+
+
+def _fake_authenticate(calls: list, expiry: datetime.datetime | None = None):
+    def authenticate(token_path, credentials_path):
+        calls.append(token_path)
+        return Credentials(token='fake-token', expiry=expiry)
+    return authenticate
+
+
+def test_session_authenticates_once_and_reuses_client(monkeypatch):
+    calls: list[str] = []
+    monkeypatch.setattr(gmail_client, '_authenticate', _fake_authenticate(calls))
+    session = gmail_client.GmailSession()
+
+    first = session.get_client()
+    second = session.get_client()
+
+    assert first is second
+    assert calls == ['token.json']
+
+
+def test_session_creates_one_client_per_thread(monkeypatch):
+    calls: list[str] = []
+    monkeypatch.setattr(gmail_client, '_authenticate', _fake_authenticate(calls))
+    session = gmail_client.GmailSession()
+    main_client = session.get_client()
+
+    clients = []
+    worker = threading.Thread(target=lambda: clients.append(session.get_client()))
+    worker.start()
+    worker.join()
+
+    assert clients[0] is not main_client
+    assert len(calls) == 1
+
+
+def test_session_only_refreshes_expired_token(monkeypatch):
+    calls: list[str] = []
+    refreshed: list[Credentials] = []
+    expired = datetime.datetime(2000, 1, 1)
+    monkeypatch.setattr(
+        gmail_client, '_authenticate', _fake_authenticate(calls, expiry=expired)
+    )
+    monkeypatch.setattr(
+        gmail_client, '_refresh', lambda creds, path: refreshed.append(creds)
+    )
+    session = gmail_client.GmailSession()
+
+    session.get_client()
+    assert refreshed == []
+
+    session.get_client()
+    assert len(refreshed) == 1
@@ -0,0 +1,89 @@
+from fake_gmail import FakeGmail, make_message
+from incremental_sync import create_sync_state, fetch_changes
+from thread_api import get_current_history_id, get_threads_with_details
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+
+
+def _initial_sync(gmail: FakeGmail):
+    history_id = get_current_history_id(gmail=gmail)
+    threads = [
+        thread for thread, _ in get_threads_with_details(
+            list(gmail.mailbox),
+            max_requests_per_second=None,
+            client_factory=lambda: gmail,
+        )
+    ]
+    return create_sync_state(history_id, threads)
+
+
+def _gmail() -> FakeGmail:
+    return FakeGmail({
+        't0': [make_message('m0', 'a@b.com')],
+        't1': [make_message('m1', 'a@b.com')],
+        't2': [make_message('m2', 'a@b.com')],
+    })
+
+
+def test_only_changed_threads_are_fetched():
+    gmail = _gmail()
+    state = _initial_sync(gmail)
+    gmail.calls.clear()
+
+    gmail.add_message('t1', make_message('m3', ME))
+    gmail.delete_thread('t2')
+    changed_threads, stale_msg_ids, new_state = fetch_changes(state, gmail=gmail)
+
+    assert sorted(gmail.calls) == ['t1', 't2']
+    assert [thread.thread_id for thread in changed_threads] == ['t1']
+    assert changed_threads[0].find_msg_replied_to() == 'm1'
+    assert sorted(stale_msg_ids) == ['m1', 'm2']
+    assert new_state.history_id == str(gmail.history_id)
+    assert sorted(new_state.threads) == ['t0', 't1']
+    assert new_state.threads['t1'].msg_ids == ['m1', 'm3']
+
+
+def test_nothing_is_fetched_without_changes():
+    gmail = _gmail()
+    state = _initial_sync(gmail)
+    gmail.calls.clear()
+
+    changed_threads, stale_msg_ids, new_state = fetch_changes(state, gmail=gmail)
+
+    assert gmail.calls == []
+    assert changed_threads == [] and stale_msg_ids == []
+    assert new_state == state
+
+
+def test_expired_history_falls_back_to_comparing_fingerprints():
+    gmail = _gmail()
+    state = _initial_sync(gmail)
+    gmail.calls.clear()
+
+    gmail.add_message('t0', make_message('m3', ME))
+    gmail.add_message('t9', make_message('m4', 'c@d.com'))
+    gmail.delete_thread('t2')
+    gmail.expire_history()
+    changed_threads, stale_msg_ids, new_state = fetch_changes(state, gmail=gmail)
+
+    assert sorted(gmail.calls) == ['t0', 't9']
+    assert sorted(stale_msg_ids) == ['m0', 'm2']
+    assert sorted(new_state.threads) == ['t0', 't1', 't9']
+
+
+def test_threads_failing_validation_count_as_synced():
+    gmail = _gmail()
+    state = _initial_sync(gmail)
+
+    invalid_message = make_message('m3', 'c@d.com')
+    invalid_message['internalDate'] = 'not a timestamp'
+    gmail.add_message('t9', invalid_message)
+    changed_threads, _, new_state = fetch_changes(state, gmail=gmail)
+
+    assert [thread.thread_id for thread in changed_threads] == ['t9']
+    assert changed_threads[0].n_msgs == 0
+    # So it isn't fetched again on every sync
+    assert new_state.threads['t9'].history_id is not None
+    gmail.calls.clear()
+    fetch_changes(new_state, gmail=gmail)
+    assert gmail.calls == []
@@ -0,0 +1,71 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_gmail import make_message
+from instrumentation import METRICS, Metrics, profiled
+from raw_cache import RawThreadCache
+from thread_api import load_threads_from_cache
+
+
+def test_metrics_are_merged_and_exported():
+    metrics = Metrics()
+    with metrics.timer('fetch'):
+        pass
+    metrics.record_time('decode', 3.0, count=2)
+    metrics.increment('retries')
+    metrics.set_gauge('queue_depth', 5)
+    metrics.set_gauge('queue_depth', 2)
+
+    worker = Metrics()
+    worker.record_time('decode', 1.0)
+    worker.increment('retries', 2)
+    metrics.merge(worker.snapshot())
+
+    snapshot = metrics.snapshot()
+    assert snapshot['timers']['decode'] == \
+        {'count': 3, 'seconds': 4.0, 'max_seconds': 1.5}
+    assert snapshot['timers']['fetch']['count'] == 1
+    assert snapshot['counters'] == {'retries': 3}
+    assert snapshot['gauges'] == {'queue_depth': 2}
+    assert snapshot['gauge_maxima'] == {'queue_depth': 5}
+
+    text = metrics.to_prometheus()
+    assert '# TYPE pipeline_stage_seconds_total counter' in text
+    assert 'pipeline_stage_calls_total{stage="decode"} 3' in text
+    assert 'pipeline_retries_total 3' in text
+    assert 'pipeline_queue_depth_max 5' in text
+
+
+def test_parse_metrics_are_sent_back_from_workers(tmp_path):
+    cache = RawThreadCache(str(tmp_path / 'raw.sqlite'))
+    for t in range(3):
+        cache.put(f't{t}', {
+            'id': f't{t}',
+            'messages': [
+                make_message(f't{t}-m{i}', 'a@b.com', timestamp=i)
+                for i in range(2)
+            ],
+        })
+
+    METRICS.reset()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threads = list(load_threads_from_cache(cache, parse_executor=executor))
+
+    snapshot = METRICS.snapshot()
+    assert len(threads) == 3
+    assert snapshot['counters']['threads_parsed'] == 3
+    assert snapshot['counters']['messages_parsed'] == 6
+    assert snapshot['timers']['validate_message']['count'] == 6
+    assert snapshot['gauge_maxima']['parse_queue_depth'] == 3
+
+
+def test_profiling_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.delenv('PIPELINE_PROFILE', raising=False)
+    with profiled() as profile:
+        assert profile is None
+
+    path = str(tmp_path / 'run.prof')
+    monkeypatch.setenv('PIPELINE_PROFILE', path)
+    with profiled():
+        sum(range(1000))
+    assert pstats.Stats(path).total_calls > 0
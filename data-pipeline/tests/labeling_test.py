@@ -0,0 +1,115 @@
+import random
+
+import pyarrow as pa
+
+from data_models import Message
+from domain_models.email_thread import EmailThread
+from fake_gmail import make_message
+from labeling import MESSAGE_SCHEMA, label_messages, message_table_from_cache
+from raw_cache import RawThreadCache
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+OTHER_ME = 'me@work.com'
+
+
+def _random_threads(n_threads: int, seed: int = 0) -> list[EmailThread]:
+    rng = random.Random(seed)
+    threads = []
+    for t in range(n_threads):
+        senders = rng.choices(
+            [ME, 'a@b.com', 'Jane <c@d.com>'],
+            weights=[1, 2, 2],
+            k=rng.randint(1, 6),
+        )
+        threads.append(EmailThread(
+            thread_id=f't{t}',
+            messages=[
+                Message(msg_id=f't{t}-m{i}', sender=s, body='', timestamp=i)
+                for i, s in enumerate(senders)
+            ],
+        ))
+    return threads
+
+
+def _to_table(threads: list[EmailThread]) -> pa.Table:
+    rows = [
+        {
+            'thread_id': thread.thread_id,
+            'msg_id': thread.msg_ids[i],
+            'sender': thread.senders[i],
+            'timestamp': thread.timestamps[i],
+        }
+        for thread in threads
+        for i in range(thread.n_msgs)
+    ]
+    return pa.Table.from_pylist(rows, schema=MESSAGE_SCHEMA)
+
+
+def test_labels_match_email_thread():
+    threads = _random_threads(500)
+    # Threads don't need to be contiguous
+    table = _to_table(threads)
+    table = table.take(list(reversed(range(table.num_rows))))
+    table = table.take(_interleave_threads(table))
+
+    labeled = label_messages(table).to_pandas().set_index('msg_id')
+
+    kept = labeled.loc[~labeled.discard]
+    expected = {}
+    for thread in threads:
+        columns = thread.get_columns()
+        expected.update(zip(columns['msg_id'], columns['replied_to']))
+    assert kept.replied_to.to_dict() == expected
+
+
+def _interleave_threads(table: pa.Table) -> list[int]:
+    """Reverse order back within each thread, but interleave threads."""
+    by_thread: dict[str, list[int]] = {}
+    for i, thread_id in enumerate(table.column('thread_id').to_pylist()):
+        by_thread.setdefault(thread_id, []).insert(0, i)
+    queues = list(by_thread.values())
+    order = []
+    while queues:
+        for queue in list(queues):
+            order.append(queue.pop(0))
+            if not queue:
+                queues.remove(queue)
+    return order
+
+
+def test_multiple_own_addresses():
+    table = pa.Table.from_pylist(
+        [
+            {'thread_id': 't0', 'msg_id': 'm0', 'sender': 'a@b.com', 'timestamp': 0},
+            {'thread_id': 't0', 'msg_id': 'm1', 'sender': OTHER_ME, 'timestamp': 1},
+            {'thread_id': 't0', 'msg_id': 'm2', 'sender': None, 'timestamp': 2},
+        ],
+        schema=MESSAGE_SCHEMA,
+    )
+
+    labeled = label_messages(table, own_addresses=[ME, OTHER_ME])
+
+    assert labeled.column('replied_to').to_pylist() == [True, False, False]
+    assert labeled.column('discard').to_pylist() == [False, True, True]
+
+
+def test_empty_table():
+    labeled = label_messages(MESSAGE_SCHEMA.empty_table())
+    assert labeled.num_rows == 0
+    assert 'discard' in labeled.column_names
+
+
+def test_messages_are_read_from_cache(tmp_path):
+    cache = RawThreadCache(str(tmp_path / 'raw.sqlite'))
+    cache.put('t0', {
+        'id': 't0',
+        'messages': [
+            make_message('m0', 'a@b.com', timestamp=5),
+            make_message('m1', ME, timestamp=6),
+        ],
+    })
+
+    labeled = label_messages(message_table_from_cache(cache))
+
+    assert labeled.column('replied_to').to_pylist() == [True, False]
+    assert labeled.column('timestamp').to_pylist() == [5, 6]
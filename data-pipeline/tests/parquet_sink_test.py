@@ -0,0 +1,107 @@
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_models import Message
+from domain_models.email_thread import EmailThread
+from parquet_sink import (
+    DATASET_SCHEMA,
+    ROW_SCHEMA,
+    ParquetRowSink,
+    read_dataset,
+    read_row_batches,
+)
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+# Timestamps in ms, as returned by Gmail
+JAN = int(datetime(2021, 1, 15, tzinfo=timezone.utc).timestamp() * 1000)
+FEB = int(datetime(2021, 2, 15, tzinfo=timezone.utc).timestamp() * 1000)
+NOV = int(datetime(2021, 11, 15, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _thread(i: int, timestamp: int = 0) -> EmailThread:
+    return EmailThread(
+        thread_id=f't{i}',
+        messages=[
+            Message(
+                msg_id=f'm{i}', sender='a@b.com', body='Hi 👋',
+                timestamp=timestamp + i,
+            ),
+            Message(
+                msg_id=f'r{i}', sender=ME, body='Thanks',
+                timestamp=timestamp + i + 1,
+            ),
+        ],
+    )
+
+
+def test_rows_are_partitioned_by_month_and_sorted(tmp_path):
+    path = str(tmp_path / 'dataset')
+
+    with ParquetRowSink(path, batch_size=2) as sink:
+        for i, timestamp in enumerate([NOV, JAN, FEB, JAN]):
+            sink.add_thread(_thread(i, timestamp))
+
+    assert sorted(os.listdir(os.path.join(path, 'year=2021'))) == \
+        ['month=01', 'month=02', 'month=11']
+    table = read_dataset(path)
+    assert table.schema == DATASET_SCHEMA
+    assert table.column('msg_id').to_pylist() == ['m1', 'm3', 'm2', 'm0']
+    # Bodies are kept as UTF-8
+    assert table.column('body').to_pylist()[0] == 'Hi 👋'
+    assert (sink.n_rows, sink.n_replied_to) == (4, 4)
+
+    part = pq.ParquetFile(os.path.join(path, 'year=2021/month=01/part-0.parquet'))
+    assert part.schema_arrow == DATASET_SCHEMA
+    assert part.metadata.row_group(0).column(4).statistics.has_min_max
+
+
+def test_time_range_and_columns_can_be_read_alone(tmp_path):
+    path = str(tmp_path / 'dataset')
+    with ParquetRowSink(path, row_group_size=1) as sink:
+        for i, timestamp in enumerate([JAN, FEB, NOV]):
+            sink.add_thread(_thread(i, timestamp))
+
+    table = read_dataset(
+        path,
+        columns=['msg_id'],
+        start=datetime(2021, 2, 1, tzinfo=timezone.utc),
+        end=datetime(2021, 11, 15, tzinfo=timezone.utc),
+    )
+
+    assert table.to_pydict() == {'msg_id': ['m1']}
+
+
+def test_existing_rows_can_be_replaced(tmp_path):
+    path = str(tmp_path / 'dataset')
+    with ParquetRowSink(path) as sink:
+        for i in range(3):
+            sink.add_thread(_thread(i, JAN))
+
+    with ParquetRowSink(path) as sink:
+        sink.write_batches(read_row_batches(path, exclude_msg_ids=['m1']))
+        sink.add_thread(_thread(9, FEB))
+
+    table = read_dataset(path)
+    assert table.column('msg_id').to_pylist() == ['m0', 'm2', 'm9']
+    assert sorted(os.listdir(tmp_path)) == ['dataset']
+
+
+def test_failed_write_keeps_existing_dataset(tmp_path):
+    path = str(tmp_path / 'dataset')
+    with ParquetRowSink(path) as sink:
+        sink.add_thread(_thread(0))
+
+    try:
+        with ParquetRowSink(path) as sink:
+            sink.write_batches([
+                pa.RecordBatch.from_pylist([], schema=ROW_SCHEMA)
+            ])
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert read_dataset(path).num_rows == 1
+    assert sorted(os.listdir(tmp_path)) == ['dataset']
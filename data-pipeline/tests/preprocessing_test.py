@@ -0,0 +1,144 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+
+from preprocessing.blazing_text import (
+    prepare_features, write_augmented_manifest, write_plaintext
+)
+from preprocessing.cleanup import clean_text, filter_messages
+from preprocessing.dedup import cluster_ids, representatives
+from preprocessing.feature_cache import FeatureCache
+from preprocessing.sampling import BalancedSampler
+from preprocessing.splits import (
+    TEST, TRAIN, VAL, assign_splits, oversample_indices
+)
+from preprocessing.tokenization import tokenize_texts
+
+
+def _messages() -> pa.Table:
+    return pa.table({
+        'replied_to': [True, False, False, False],
+        'sender': pa.array([
+            'a@b.com', 'Me <loeberthomas@yahoo.com>', 'c@d.com', 'e@f.com',
+        ]).dictionary_encode(),
+        'body': ['Hi, how are\nyou? 👋', 'Fwd', '', 'Bye'],
+        'timestamp': [1, 2, 3, 4],
+    })
+
+
+def test_cleanup_drops_excluded_and_empty_messages():
+    messages = filter_messages(_messages())
+
+    assert messages.column('timestamp').to_pylist() == [1, 4]
+    assert clean_text(messages.column('body')).to_pylist() == \
+        ['Hi  how are you? ', 'Bye']
+
+
+def test_tokenization_keeps_order_across_chunks():
+    texts = [f'text {i}' for i in range(10)]
+
+    serial = list(tokenize_texts(texts, tokenizer=str.split, chunk_size=3))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        parallel = list(tokenize_texts(
+            texts, tokenizer=str.split, executor=executor, chunk_size=3
+        ))
+
+    assert serial == parallel == texts
+
+
+def test_features_are_written_in_blazing_text_formats(tmp_path):
+    features = prepare_features(_messages(), tokenizer=str.split)
+    assert features.select(['label', 'feature', 'timestamp']).to_pydict() == {
+        'label': [1, 0],
+        'feature': ['Hi how are you?', 'Bye'],
+        'timestamp': [1, 4],
+    }
+
+    write_plaintext(features, str(tmp_path / 'input.txt'))
+    (path,) = write_augmented_manifest(
+        features, str(tmp_path / 'input.jsonl'), num_classes=2
+    )
+
+    assert (tmp_path / 'input.txt').read_text() == \
+        '__label__reply Hi how are you?\n__label__no_reply Bye\n'
+    with open(path) as f:
+        assert json.loads(next(f)) == \
+            {'source': 'Hi how are you?', 'label': 1, 'k': 2}
+
+
+def test_only_new_or_changed_messages_are_tokenized(tmp_path):
+    calls = []
+
+    def tokenizer(text: str) -> list[str]:
+        calls.append(text)
+        return text.split()
+
+    messages = _messages().append_column('msg_id', pa.array(['a', 'b', 'c', 'd']))
+    cache = FeatureCache(str(tmp_path / 'features.sqlite'))
+    first = prepare_features(messages, tokenizer=tokenizer, cache=cache)
+    assert len(calls) == 2
+
+    calls.clear()
+    bodies = messages.column('body').to_pylist()
+    bodies[3] = 'Bye now'
+    messages = messages.set_column(
+        messages.schema.get_field_index('body'), 'body', pa.array(bodies)
+    )
+    second = prepare_features(messages, tokenizer=tokenizer, cache=cache)
+
+    assert calls == ['Bye now']
+    assert second.column('feature').to_pylist() == ['Hi how are you?', 'Bye now']
+    assert first.column('feature')[0] == second.column('feature')[0]
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.close()
+
+
+def test_splits_and_oversampling_are_indices():
+    splits = assign_splits(np.arange(20), train_proportion=0.5, val_proportion=0.25)
+    assert splits.tolist() == [TRAIN] * 10 + [VAL] * 5 + [TEST] * 5
+
+    labels = np.array([0, 0, 0, 0, 1, 0])
+    indices = oversample_indices(labels)
+    assert indices[:6].tolist() == list(range(6))
+    assert np.bincount(labels[indices]).tolist() == [5, 5]
+
+
+def test_sampler_balances_epochs_without_copying_rows():
+    labels = np.array([0, 0, 0, 0, 1, 0])
+    sampler = BalancedSampler(labels, random_state=1)
+
+    first, second = sampler.iter_epochs(2)
+    assert len(first) == len(sampler) == 10
+    assert np.bincount(labels[first]).tolist() == [5, 5]
+    assert set(first) == set(range(6))
+    assert first.tolist() == sampler.epoch(0).tolist()
+    assert first.tolist() != second.tolist()
+
+    assert sampler.class_weights() == {0: 1.0, 1: 5.0}
+    assert sampler.sample_weights().tolist() == [1, 1, 1, 1, 5, 1]
+
+
+def test_near_duplicates_are_clustered_and_kept_in_one_split():
+    newsletter = 'Your weekly digest of the top stories on data engineering ' \
+        'and machine learning from around the web, curated for you'
+    bodies = [
+        newsletter + ' issue 1',
+        'Are we still on for lunch tomorrow at noon?',
+        'Hi, please find the signed contract attached to this email',
+        newsletter + ' issue 2',
+    ]
+
+    clusters = cluster_ids(bodies)
+
+    assert clusters.tolist() == [0, 1, 2, 0]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        parallel = cluster_ids(bodies, executor=executor, chunk_size=1)
+    assert parallel.tolist() == clusters.tolist()
+    assert representatives(clusters).tolist() == [True, True, True, False]
+    splits = assign_splits(
+        [1, 2, 3, 4], train_proportion=0.5, val_proportion=0.25,
+        groups=clusters,
+    )
+    assert splits[3] == splits[0] == TRAIN
@@ -0,0 +1,105 @@
+import pytest
+
+from fake_gmail import FakeGmail, make_message
+from raw_cache import RawThreadCache
+from thread_api import (
+    get_threads_with_details,
+    get_threads_with_details_batched,
+    list_all_threads,
+    load_threads_from_cache,
+)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = RawThreadCache(str(tmp_path / 'raw.sqlite'))
+    yield cache
+    cache.close()
+
+
+def _response(thread_id: str, history_id: str = '1', body: str = 'Hi') -> dict:
+    return {
+        'id': thread_id,
+        'historyId': history_id,
+        'messages': [make_message(f'{thread_id}-m0', 'a@b.com', body=body)],
+    }
+
+
+def test_get_returns_only_matching_version(cache):
+    cache.put('t0', _response('t0', history_id='5'))
+
+    assert cache.get('t0') == _response('t0', history_id='5')
+    assert cache.get('t0', history_id='5') is not None
+    assert cache.get('t0', history_id='6') is None
+    assert cache.get('t1') is None
+    assert cache.hit_rate == 0.5
+
+
+def test_least_recently_used_threads_are_evicted(tmp_path):
+    cache = RawThreadCache(str(tmp_path / 'raw.sqlite'), max_bytes=10**9)
+    for i in range(3):
+        cache.put(f't{i}', _response(f't{i}', body='x' * 100))
+    entry_size = cache.total_bytes // 3
+    cache.get('t0')
+
+    # Compressed sizes differ by a few bytes, so leave some slack
+    cache.max_bytes = cache.total_bytes + entry_size // 2
+    cache.put('t3', _response('t3', body='x' * 100))
+
+    assert 't1' not in cache
+    assert {'t0', 't2', 't3'} == {
+        payload['id'] for payload in cache.iter_payloads()
+    }
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_size_is_restored_when_reopened(tmp_path):
+    path = str(tmp_path / 'raw.sqlite')
+    cache = RawThreadCache(path)
+    cache.put_many({'t0': _response('t0'), 't1': _response('t1')})
+    cache.close()
+
+    reopened = RawThreadCache(path)
+    assert len(reopened) == 2
+    assert reopened.total_bytes == cache.total_bytes
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_unchanged_threads_are_read_from_cache(cache, batched):
+    gmail = FakeGmail({
+        f't{i}': [make_message(f'm{i}', 'a@b.com')] for i in range(4)
+    })
+
+    def fetch_all():
+        history_ids = list_all_threads(gmail=gmail)
+        if batched:
+            results = get_threads_with_details_batched(
+                list(history_ids), gmail=gmail,
+                cache=cache, history_ids=history_ids,
+            )
+        else:
+            results = get_threads_with_details(
+                list(history_ids), max_requests_per_second=None,
+                client_factory=lambda: gmail,
+                cache=cache, history_ids=history_ids,
+            )
+        return [thread for thread, _ in results]
+
+    fetch_all()
+    gmail.calls.clear()
+    gmail.add_message('t2', make_message('m9', 'c@d.com'))
+    threads = fetch_all()
+
+    assert gmail.calls == ['t2']
+    assert [thread.thread_id for thread in threads] == ['t0', 't1', 't2', 't3']
+    assert threads[2].msg_ids == ['m2', 'm9']
+    assert cache.hit_rate == 3 / 8
+
+
+def test_threads_can_be_loaded_offline(cache):
+    cache.put_many({'t1': _response('t1'), 't0': _response('t0')})
+
+    threads = [thread for thread, _ in load_threads_from_cache(cache)]
+
+    assert [thread.thread_id for thread in threads] == ['t0', 't1']
+    assert threads[0].msg_body == ['Hi']
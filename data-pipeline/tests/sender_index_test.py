@@ -0,0 +1,52 @@
+import numpy as np
+import pyarrow as pa
+
+from sender_index import MISSING, SenderIndex, parse_sender
+
+
+def test_headers_are_parsed_into_components():
+    assert parse_sender('"Doe, John" <John.Doe@Email.com>') == \
+        ('Doe, John', 'john.doe@email.com', 'email.com')
+    assert parse_sender('a@b.com').address == 'a@b.com'
+
+
+def test_columns_are_encoded_by_distinct_header():
+    index = SenderIndex()
+    headers = pa.chunked_array([
+        ['John <j@x.com>', None],
+        ['j@x.com', 'John <j@x.com>', 'k@y.org'],
+    ])
+
+    codes = index.encode(headers)
+
+    assert codes.tolist() == [0, MISSING, 1, 0, 2]
+    assert len(index) == 3 and index.n_addresses == 2
+    # Both spellings of John's header have the same address
+    assert index.address_codes(codes).tolist() == [0, MISSING, 0, 0, 1]
+    assert index.encode(headers.combine_chunks().dictionary_encode()) \
+        .tolist() == codes.tolist()
+
+
+def test_membership_by_address_and_domain():
+    index = SenderIndex()
+    codes = index.encode(['Me <ME@x.com>', 'me@x.com.evil', 'k@y.org', None])
+
+    assert index.is_from(codes, ['me@x.com']).tolist() == \
+        [True, False, False, False]
+    assert index.is_from(codes, ['Me <me@x.com>'], domains=['Y.org']) \
+        .tolist() == [True, False, True, False]
+    assert not index.is_from(codes, ['unknown@x.com']).any()
+
+
+def test_codes_persist_across_runs(tmp_path):
+    path = str(tmp_path / 'senders.sqlite')
+    with SenderIndex(path) as index:
+        first = index.encode(['a@b.com', 'c@d.com'])
+
+    with SenderIndex(path) as index:
+        assert 'c@d.com' in index
+        assert index.encode(['e@f.com', 'c@d.com', 'a@b.com']).tolist() == \
+            [2, *first[::-1]]
+        assert index.lookup(2).domain == 'f.com'
+
+    assert len(SenderIndex(path)) == 3
@@ -0,0 +1,136 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from serving.micro_batching import LatencyStats, MicroBatcher
+from serving.scoring import ReplyScorer
+from serving.server import ScoringServer
+
+
+class _FakeModel:
+    """Predicts reply iff text contains `?`, like fastText's `predict()`."""
+    def __init__(self):
+        self.batches: list[list[str]] = []
+
+    def predict(self, texts: list[str], k: int):
+        self.batches.append(texts)
+        labels, probs = [], []
+        for text in texts:
+            if '?' in text:
+                labels.append(('__label__reply', '__label__no_reply'))
+                probs.append((0.9, 0.1))
+            else:
+                # fastText omits labels with probability 0
+                labels.append(('__label__no_reply',))
+                probs.append((1.0,))
+        return labels, probs
+
+
+def test_concurrent_items_are_predicted_in_batches():
+    batches: list[list[int]] = []
+    barrier = threading.Barrier(8)
+
+    def predict_batch(items: list[int]) -> list[int]:
+        batches.append(items)
+        return [2 * item for item in items]
+
+    batcher = MicroBatcher(predict_batch, max_batch_size=4, max_latency=1.0)
+    results = [None] * 8
+
+    def submit(i: int):
+        barrier.wait()
+        results[i] = batcher.submit(i).result()
+
+    workers = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    batcher.close()
+
+    assert results == [2 * i for i in range(8)]
+    assert sorted(len(batch) for batch in batches) == [4, 4]
+
+
+def test_predictions_are_cached_by_body():
+    model = _FakeModel()
+    scorer = ReplyScorer(model, tokenizer=str.split, max_latency=0.001)
+
+    first = scorer.score(['Lunch,\ntomorrow?', 'FYI'])
+    second = scorer.score(['FYI', 'Thanks'])
+    scorer.close()
+
+    assert first == [
+        {'__label__reply': 0.9, '__label__no_reply': 0.1},
+        {'__label__reply': 0.0, '__label__no_reply': 1.0},
+    ]
+    assert second[0] == first[1]
+    # Bodies are preprocessed like the training data
+    assert model.batches == [['Lunch tomorrow?', 'FYI'], ['Thanks']]
+    assert scorer.hit_rate == 0.25
+
+
+def test_server_scores_instances_and_reports_latency():
+    scorer = ReplyScorer(_FakeModel(), tokenizer=str.split, max_latency=0.001)
+    server = ScoringServer(scorer)
+    server.start()
+    try:
+        request = urllib.request.Request(
+            f'{server.url}/invocations',
+            data=json.dumps({'instances': ['Call me?']}).encode(),
+            method='POST',
+        )
+        with urllib.request.urlopen(request) as response:
+            predictions = json.load(response)
+        with urllib.request.urlopen(f'{server.url}/stats') as response:
+            stats = json.load(response)
+    finally:
+        server.stop()
+
+    assert predictions == [{'__label__reply': 0.9, '__label__no_reply': 0.1}]
+    assert stats['requests'] == 1
+    assert stats['p50_ms'] > 0
+
+
+def test_scoring_errors_are_answered_with_500():
+    class BrokenModel:
+        def predict(self, texts: list[str], k: int):
+            raise RuntimeError('Model failed')
+
+    scorer = ReplyScorer(BrokenModel(), tokenizer=str.split, max_latency=0.001)
+    server = ScoringServer(scorer)
+    server.start()
+    try:
+        request = urllib.request.Request(
+            f'{server.url}/invocations',
+            data=json.dumps({'instances': ['Hi']}).encode(),
+            method='POST',
+        )
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            urllib.request.urlopen(request)
+        error = json.load(exc_info.value)
+        stats = server.stats()
+    finally:
+        server.stop()
+
+    assert exc_info.value.code == 500
+    assert 'Model failed' in error['error']
+    assert stats['errors'] == 1
+    assert stats['requests'] == 1
+
+
+def test_latency_percentiles():
+    now = [0.0]
+    stats = LatencyStats(clock=lambda: now[0])
+    for latency in range(1, 101):
+        now[0] = 2 * latency
+        stats.record(started=now[0] - latency / 1000, n_items=2)
+
+    summary = stats.summary()
+    assert summary['p50_ms'] == pytest.approx(50.5)
+    assert summary['p99_ms'] == pytest.approx(99.01)
+    assert summary['items'] == 200
+    assert summary['items_per_second'] == pytest.approx(200 / 198.001)
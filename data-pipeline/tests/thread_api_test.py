@@ -0,0 +1,178 @@
+import json
+
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+import email_utils.retry as retry
+from fake_gmail import FakeGmail, make_message
+from thread_api import get_threads_with_details, get_threads_with_details_batched
+
+ME = 'Me <thomas.loeber73@gmail.com>'
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Patches `time.sleep` for every module, since they share `time`.
+    monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+
+
+def _mailbox(n_threads: int) -> dict[str, list[dict]]:
+    return {
+        f't{i}': [
+            make_message(f't{i}-m0', 'a@b.com', timestamp=1),
+            make_message(f't{i}-m1', ME, timestamp=2),
+        ]
+        for i in range(n_threads)
+    }
+
+
+def test_concurrent_fetch_preserves_input_order():
+    gmail = FakeGmail(_mailbox(50))
+    thread_ids = [f't{i}' for i in reversed(range(50))]
+
+    results = list(get_threads_with_details(
+        thread_ids,
+        max_workers=4,
+        max_requests_per_second=None,
+        client_factory=lambda: gmail,
+    ))
+
+    assert [thread.thread_id for thread, _ in results] == thread_ids
+    thread, dlq = results[0]
+    assert thread.find_msg_replied_to() == 't49-m0'
+    assert dlq == []
+
+
+def test_throttled_requests_are_retried():
+    gmail = FakeGmail(_mailbox(3), errors={'t1': [429, 503]})
+
+    results = list(get_threads_with_details(
+        ['t0', 't1', 't2'],
+        max_workers=2,
+        max_requests_per_second=None,
+        client_factory=lambda: gmail,
+    ))
+
+    assert len(results) == 3
+    assert gmail.calls.count('t1') == 3
+
+
+def test_failed_threads_are_dead_lettered():
+    gmail = FakeGmail(_mailbox(2), errors={'t1': [429, 429]})
+
+    results = list(get_threads_with_details(
+        ['t0', 'missing', 't1'],
+        max_retries=1,
+        max_requests_per_second=None,
+        client_factory=lambda: gmail,
+    ))
+
+    assert [thread.thread_id for thread, _ in results] == \
+        ['t0', 'missing', 't1']
+    assert results[0][0].n_msgs == 2 and results[0][1] == []
+    for thread, dlq in results[1:]:
+        assert thread.n_msgs == 0
+        assert isinstance(dlq[0]['exception'], HttpError)
+    assert results[1][1][0]['exception'].resp.status == 404
+    assert results[2][1][0]['exception'].resp.status == 429
+
+
+def test_batched_fetch_groups_calls_and_keeps_order():
+    gmail = FakeGmail(_mailbox(7))
+    thread_ids = [f't{i}' for i in range(7)]
+
+    results = list(get_threads_with_details_batched(
+        thread_ids, batch_size=3, gmail=gmail
+    ))
+
+    assert [thread.thread_id for thread, _ in results] == thread_ids
+    assert gmail.batch_sizes == [3, 3, 1]
+
+
+def test_batched_fetch_only_resends_throttled_calls():
+    gmail = FakeGmail(_mailbox(3), errors={'t1': [429]})
+
+    results = list(get_threads_with_details_batched(
+        ['t0', 't1', 't2'], gmail=gmail
+    ))
+
+    assert gmail.batch_sizes == [3, 1]
+    assert all(dlq == [] for _, dlq in results)
+    assert results[1][0].n_msgs == 2
+
+
+def test_batched_fetch_sends_failed_threads_to_dlq():
+    gmail = FakeGmail(_mailbox(2))
+
+    results = list(get_threads_with_details_batched(
+        ['t0', 'missing', 't1'], gmail=gmail
+    ))
+
+    thread, dlq = results[1]
+    assert thread.n_msgs == 0
+    assert dlq[0]['thread_id'] == 'missing'
+    assert isinstance(dlq[0]['exception'], HttpError)
+
+
+class _RecordingHttp(HttpMockSequence):
+    """Replays canned responses, and keeps the bodies of the requests."""
+    def __init__(self, responses: list[tuple[dict, str]]):
+        super().__init__(responses)
+        self.bodies: list[str] = []
+
+    def request(self, uri, method='GET', body=None, headers=None, *args,
+                **kwargs):
+        self.bodies.append(body)
+        return super().request(uri, method, body, headers, *args, **kwargs)
+
+
+def _batch_response(parts: list[tuple[str, int, dict]]) -> tuple[dict, str]:
+    """Multipart response to a batch request, as recorded from Gmail."""
+    body = ''.join(
+        f'--batch_abc\r\n'
+        f'Content-Type: application/http\r\n'
+        f'Content-ID: <response-0 + {thread_id}>\r\n\r\n'
+        f'HTTP/1.1 {status} {"OK" if status == 200 else "Too Many Requests"}'
+        f'\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'
+        f'{json.dumps(content)}\r\n'
+        for thread_id, status, content in parts
+    ) + '--batch_abc--\r\n'
+    headers = {
+        'status': '200',
+        'content-type': 'multipart/mixed; boundary=batch_abc',
+    }
+    return headers, body
+
+
+def test_real_batch_request_only_resends_throttled_parts():
+    mailbox = _mailbox(3)
+    thread = {
+        thread_id: {'id': thread_id, 'historyId': '1', 'messages': messages}
+        for thread_id, messages in mailbox.items()
+    }
+    throttled = {'error': {
+        'code': 429, 'message': 'Too many concurrent requests for user.',
+    }}
+    http = _RecordingHttp([
+        _batch_response([
+            ('t0', 200, thread['t0']),
+            ('t1', 429, throttled),
+            ('t2', 200, thread['t2']),
+        ]),
+        _batch_response([('t1', 200, thread['t1'])]),
+    ])
+    gmail = build('gmail', 'v1', http=http, static_discovery=True)
+
+    results = list(get_threads_with_details_batched(
+        ['t0', 't1', 't2'], gmail=gmail
+    ))
+
+    assert len(http.bodies) == 2
+    assert all(f'/threads/t{i}' in http.bodies[0] for i in range(3))
+    assert '/threads/t1' in http.bodies[1]
+    assert '/threads/t0' not in http.bodies[1]
+    assert '/threads/t2' not in http.bodies[1]
+    assert [thread.thread_id for thread, _ in results] == ['t0', 't1', 't2']
+    assert all(dlq == [] and thread.n_msgs == 2 for thread, dlq in results)
@@ -1,58 +1,451 @@
 # Enable current type hints for older Python version (<3.10) 
 from __future__ import annotations
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from datetime import datetime
-from base64 import urlsafe_b64decode
-from bs4 import BeautifulSoup
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+from googleapiclient.errors import HttpError
 
 import email_utils.gmail_client as client
+from email_utils.retry import (
+    RateLimiter, backoff_delay, execute_with_retry, is_retryable
+)
+from body_extraction import get_backend, get_body_as_text
 from data_models import Message, NextPageToken, ThreadId, MessageId
 from domain_models.email_thread import EmailThread
+from instrumentation import METRICS, Metrics
+from raw_cache import RawThreadCache
+
+# Gmail rejects batches of more than 100 calls, and recommends at most 50,
+# because larger batches are likely to get rate limited.
+MAX_BATCH_SIZE = 100
+DEFAULT_BATCH_SIZE = 50
+# Number of threads to look up in the raw cache at once
+CACHE_LOOKUP_SIZE = 500
     
     
-def _list_thread_ids_paginated(
+def _list_threads_paginated(
     next_page_token: NextPageToken | None = None,
     query: str | None = None,
-) -> tuple[list[ThreadId], NextPageToken]:
+    gmail: Any | None = None,
+) -> tuple[list[dict], NextPageToken]:
     
-    print('Listing threadIDs for a single page.')
-    gmail = client.create_client()
+    logging.debug('Listing threadIDs for a single page.')
+    if gmail is None:
+        gmail = client.create_client()
 
-    response = gmail.users().threads() \
-        .list(userId='me', maxResults=500, pageToken=next_page_token, q=query) \
-        .execute()
+    with METRICS.timer('list_threads'):
+        response = gmail.users().threads() \
+            .list(
+                userId='me', maxResults=500, pageToken=next_page_token, q=query
+            ) \
+            .execute()
         
-    # Only keep id of each thread (for retrieving thread details later)
+    # Each thread only contains its id, history id, and a snippet
     threads = response.get('threads', [])
-    thread_ids = [thread['id'] for thread in threads]
     next_page_token = response.get('nextPageToken')
-    return thread_ids, next_page_token
+    METRICS.increment('threads_listed', len(threads))
+    return threads, next_page_token
 
 
-def list_all_thread_ids(query: str | None = None) -> list[ThreadId]:
-    all_thread_ids = []
+def list_all_threads(
+    query: str | None = None,
+    gmail: Any | None = None,
+) -> dict[ThreadId, str]:
+    """
+    Returns the history id of every thread matching `query`, keyed by thread
+    id. The history id changes whenever a thread changes, so it can be compared
+    to the one stored from an earlier download.
+    """
+    all_threads = {}
     next_page_token = None
     while True:
-        thread_ids, next_page_token = _list_thread_ids_paginated(
-            next_page_token=next_page_token, 
-            query=query
+        threads, next_page_token = _list_threads_paginated(
+            next_page_token=next_page_token,
+            query=query,
+            gmail=gmail,
         )
-        all_thread_ids.extend(thread_ids)
+        for thread in threads:
+            all_threads[thread['id']] = thread.get('historyId')
 
         # Exit loop once no more pages are left
         if not next_page_token:
-            return all_thread_ids
+            return all_threads
+
+
+def list_all_thread_ids(
+    query: str | None = None,
+    gmail: Any | None = None,
+) -> list[ThreadId]:
+    # Only keep id of each thread (for retrieving thread details later)
+    return list(list_all_threads(query=query, gmail=gmail))
+
+
+def get_current_history_id(gmail: Any | None = None) -> str:
+    """Returns the mailbox's latest history id."""
+    if gmail is None:
+        gmail = client.create_client()
+
+    profile = gmail.users().getProfile(userId='me').execute()
+    return profile['historyId']
+
+
+def list_changed_thread_ids(
+    start_history_id: str,
+    gmail: Any | None = None,
+) -> tuple[set[ThreadId], str] | None:
+    """
+    Returns the ids of all threads to which messages were added, or from which
+    messages were deleted, since `start_history_id`, as well as the mailbox's
+    current history id. Label changes are ignored, since they don't affect our
+    data.
+
+    Gmail only keeps history for a limited time (typically about a week).
+    If `start_history_id` is too old, this returns `None`, and the caller needs
+    to fall back to comparing all threads.
+    """
+    if gmail is None:
+        gmail = client.create_client()
+
+    changed_thread_ids: set[ThreadId] = set()
+    next_page_token = None
+    while True:
+        try:
+            response = gmail.users().history() \
+                .list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded', 'messageDeleted'],
+                    maxResults=500,
+                    pageToken=next_page_token,
+                ) \
+                .execute()
+        except HttpError as e:
+            if int(e.resp.status) == 404:
+                logging.warning(
+                    f'History id {start_history_id} has expired.'
+                )
+                return None
+            raise
+
+        for record in response.get('history', []):
+            for msg in record.get('messages', []):
+                changed_thread_ids.add(msg['threadId'])
+
+        next_page_token = response.get('nextPageToken')
+        if not next_page_token:
+            return changed_thread_ids, response['historyId']
 
 
 def _get_thread_with_details(
-    thread_id: ThreadId
+    thread_id: ThreadId,
+    gmail: Any | None = None,
 ) -> tuple[EmailThread, list[dict]]:
     """
     Given a thread id, this returns:
     - id of message replied to;
     - list of ids of messages to discard
     """
+    if gmail is None:
+        gmail = client.create_client()
+
+    response = gmail.users().threads() \
+        .get(userId='me', id=thread_id) \
+        .execute()
+    return _parse_thread_response(thread_id, response)
+
+
+def get_threads_with_details(
+    thread_ids: Iterable[ThreadId],
+    max_workers: int = 8,
+    max_requests_per_second: float | None = 20,
+    max_retries: int = 5,
+    client_factory: Callable[[], Any] = client.create_client,
+    cache: RawThreadCache | None = None,
+    history_ids: dict[ThreadId, str | None] | None = None,
+    parse_executor: Executor | None = None,
+) -> Iterator[tuple[EmailThread, list[dict]]]:
+    """
+    Fetch thread details concurrently, yielding results in the same order as
+    `thread_ids`.
+
+    If a `cache` is given, every downloaded payload is stored in it. Threads
+    whose current history id is given in `history_ids` are read from the
+    cache instead of downloaded, as long as they haven't changed since.
+
+    Responses are parsed in `parse_executor` if one is given. Since parsing
+    (in particular, converting HTML to text) is CPU-bound, this should be a
+    `ProcessPoolExecutor`.
+
+    Each worker thread gets its own client (from `client_factory`), because the
+    http object underlying the Gmail client is not thread-safe. Requests across
+    all workers are throttled to `max_requests_per_second` (threads.get costs 10
+    of the 250 quota units Gmail allows per user and second), and retried with
+    exponential backoff if Gmail throttles us or has a transient error.
+    Threads that fail for good are yielded as empty threads, with the error in
+    their dead letter queue (like for `get_threads_with_details_batched()`).
+    """
+    rate_limiter = RateLimiter(max_requests_per_second)
+    local = threading.local()
+
+    def fetch(thread_id: ThreadId) -> tuple[EmailThread, list[dict]]:
+        if not hasattr(local, 'gmail'):
+            local.gmail = client_factory()
+        request = local.gmail.users().threads() \
+            .get(userId='me', id=thread_id)
+        try:
+            with METRICS.timer('fetch_thread'):
+                response = execute_with_retry(
+                    request.execute,
+                    max_retries=max_retries,
+                    rate_limiter=rate_limiter,
+                )
+        except HttpError as e:
+            # E.g., thread was deleted since it was listed, or retries ran out
+            logging.warning(f'Failed to download thread {thread_id}: {e}')
+            return _failed_thread(thread_id, e)
+        METRICS.increment('threads_downloaded')
+        if cache is not None:
+            cache.put(thread_id, response)
+        return _submit_parse(parse_executor, thread_id, response).result()
+
+    # Only keep a bounded number of requests in flight, so memory stays flat
+    # even if the consumer is slower than the network.
+    max_in_flight = 2 * max_workers
+    in_flight: deque[Future] = deque()
+    # Named threads, so they can be told apart by sampling profilers
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix='fetch_thread'
+    ) as executor:
+        for chunk in _chunks(thread_ids, CACHE_LOOKUP_SIZE):
+            cached = _get_cached(cache, chunk, history_ids)
+
+            for thread_id in chunk:
+                if thread_id in cached:
+                    future = _submit_parse(
+                        parse_executor, thread_id, cached[thread_id]
+                    )
+                else:
+                    future = executor.submit(fetch, thread_id)
+                in_flight.append(future)
+                METRICS.set_gauge('fetch_queue_depth', len(in_flight))
+
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def get_threads_with_details_batched(
+    thread_ids: Iterable[ThreadId],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_retries: int = 5,
+    gmail: Any | None = None,
+    cache: RawThreadCache | None = None,
+    history_ids: dict[ThreadId, str | None] | None = None,
+    parse_executor: Executor | None = None,
+) -> Iterator[tuple[EmailThread, list[dict]]]:
+    """
+    Fetch thread details using Gmail's batch endpoint, which bundles up to
+    `batch_size` threads.get calls into a single HTTP request. Results are
+    yielded in the same order as `thread_ids`. `cache`, `history_ids`, and
+    `parse_executor` work like for `get_threads_with_details()`.
+
+    Within a batch, only the calls that were throttled (or hit a transient
+    server error) are re-sent, after backing off. Threads that fail for good
+    are yielded as empty threads, with the error in their dead letter queue.
+    """
+    if not 0 < batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_BATCH_SIZE}.')
+    if gmail is None:
+        gmail = client.create_client()
+
+    for chunk in _chunks(thread_ids, batch_size):
+        yield from _get_batch_with_retry(
+            gmail, chunk, max_retries, cache, history_ids, parse_executor
+        )
+
+
+def _get_batch_with_retry(
+    gmail: Any,
+    thread_ids: list[ThreadId],
+    max_retries: int,
+    cache: RawThreadCache | None = None,
+    history_ids: dict[ThreadId, str | None] | None = None,
+    parse_executor: Executor | None = None,
+) -> list[tuple[EmailThread, list[dict]]]:
+    responses: dict[ThreadId, dict] = _get_cached(cache, thread_ids, history_ids)
+    errors: dict[ThreadId, Exception] = {}
+
+    to_fetch = [
+        thread_id for thread_id in thread_ids if thread_id not in responses
+    ]
+    fetched: dict[ThreadId, dict] = {}
+    attempt = 0
+    while to_fetch:
+        throttled: list[ThreadId] = []
+
+        def callback(request_id: str, response: dict, exception: Exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif is_retryable(exception) and attempt < max_retries:
+                throttled.append(request_id)
+            else:
+                errors[request_id] = exception
+
+        batch = gmail.new_batch_http_request()
+        for thread_id in to_fetch:
+            request = gmail.users().threads().get(userId='me', id=thread_id)
+            batch.add(request, callback=callback, request_id=thread_id)
+        # The batch request itself may be throttled as a whole, too.
+        with METRICS.timer('fetch_batch'):
+            execute_with_retry(batch.execute, max_retries=max_retries)
+
+        if throttled:
+            METRICS.increment('retries', len(throttled))
+            backoff = backoff_delay(attempt)
+            logging.warning(
+                f'{len(throttled)} of {len(to_fetch)} calls in batch were '
+                f'throttled. Retrying them in {backoff:.1f}s.'
+            )
+            time.sleep(backoff)
+            attempt += 1
+        to_fetch = throttled
+
+    METRICS.increment('threads_downloaded', len(fetched))
+    if cache is not None and fetched:
+        cache.put_many(fetched)
+    responses.update(fetched)
+
+    parsed = {
+        thread_id: _submit_parse(parse_executor, thread_id, response)
+        for thread_id, response in responses.items()
+    }
+    results = []
+    for thread_id in thread_ids:
+        if thread_id in parsed:
+            results.append(parsed[thread_id].result())
+        else:
+            results.append(_failed_thread(thread_id, errors[thread_id]))
+    return results
+
+
+def _failed_thread(
+    thread_id: ThreadId,
+    exception: Exception,
+) -> tuple[EmailThread, list[dict]]:
+    """Empty thread, with the download error in its dead letter queue."""
+    problem_details = {'exception': exception, 'thread_id': thread_id}
+    return EmailThread(thread_id=thread_id, messages=[]), [problem_details]
+
+
+def load_threads_from_cache(
+    cache: RawThreadCache,
+    parse_executor: Executor | None = None,
+    max_in_flight: int = 256,
+) -> Iterator[tuple[EmailThread, list[dict]]]:
+    """
+    Parse all threads in the cache, without any API calls. This allows
+    re-running the transformation steps offline.
+    """
+    in_flight: deque[Future] = deque()
+    for response in cache.iter_payloads():
+        in_flight.append(
+            _submit_parse(parse_executor, response['id'], response)
+        )
+        METRICS.set_gauge('parse_queue_depth', len(in_flight))
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def _submit_parse(
+    parse_executor: Executor | None,
+    thread_id: ThreadId,
+    response: dict,
+) -> Future:
+    if parse_executor is None:
+        future: Future = Future()
+        future.set_result(_parse_thread_response(thread_id, response))
+        return future
+
+    # Workers may be other processes, so they return their metrics, which are
+    # added to ours once the result is in.
+    worker_future = parse_executor.submit(
+        _parse_thread_response_with_metrics, thread_id, response
+    )
+    future = Future()
+
+    def merge_metrics(worker_future: Future) -> None:
+        try:
+            result, snapshot = worker_future.result()
+        except BaseException as e:
+            future.set_exception(e)
+            return
+        METRICS.merge(snapshot)
+        future.set_result(result)
+
+    worker_future.add_done_callback(merge_metrics)
+    return future
+
+
+def _parse_thread_response_with_metrics(
+    thread_id: ThreadId,
+    response: dict,
+) -> tuple[tuple[EmailThread, list[dict]], dict]:
+    metrics = Metrics()
+    result = _parse_thread_response(thread_id, response, metrics)
+    return result, metrics.snapshot()
+
+
+def _get_cached(
+    cache: RawThreadCache | None,
+    thread_ids: list[ThreadId],
+    history_ids: dict[ThreadId, str | None] | None,
+) -> dict[ThreadId, dict]:
+    """
+    Look up the threads whose current history id we know. (Without it, we
+    can't tell whether the cached version is outdated.)
+    """
+    if cache is None or not history_ids:
+        return {}
+    known = {
+        thread_id: history_ids[thread_id]
+        for thread_id in thread_ids
+        if history_ids.get(thread_id) is not None
+    }
+    with METRICS.timer('cache_lookup'):
+        cached = cache.get_many(known, history_ids=known)
+    METRICS.increment('threads_from_cache', len(cached))
+    return cached
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _parse_thread_response(
+    thread_id: ThreadId,
+    response: dict,
+    metrics: Metrics = METRICS,
+) -> tuple[EmailThread, list[dict]]:
+    """
+    Convert the raw threads.get response into an `EmailThread`, plus a dead
+    letter queue of messages that failed validation. Time spent on decoding
+    bodies, validating messages, and building the thread is recorded in
+    `metrics`.
+    """
     # ToDo: Add this to thread constructor or client class?
+    html_to_text = get_backend()
 
     def _get_sender(msg: dict) -> str | None:
         headers = msg['payload']['headers']
@@ -65,47 +458,27 @@ def _get_thread_with_details(
         return None
 
 
-    def _get_body_as_text(msg: dict) -> str:
-        """Get body, decode it, and convert from html to text."""
-        if 'data' in msg['payload']['body'].keys():
-            body_encoded = msg['payload']['body']['data']
-        
-        # Depending on protocol, body may be located elsewhere
-        elif 'parts' in msg['payload'].keys():
-            for part in msg['payload']['parts']:
-                if 'data' in part['body'].keys():
-                    body_encoded = part['body']['data']
-                    break
-            # If we didn't find body, return empty string.
-            else:
-                return ''
-        else:
-            return ''
-
-        body_html = urlsafe_b64decode(body_encoded)
-        #  ToDo: Explicitly specify bs parser
-        return BeautifulSoup(body_html, features='html.parser').get_text()
-        
-    
-    gmail = client.create_client()
-
-    response = gmail.users().threads() \
-        .get(userId='me', id=thread_id) \
-        .execute()
-    
     # Validate message schema and drop fields not needed by converting each
     # message to a pydantic data object.
     msgs = []
     dlq = []
+    # Time locally, and record once per thread (rather than per message)
+    decode_seconds = validate_seconds = 0.0
+    clock = time.perf_counter
 
     for msg in response['messages']:        
         try:
+            started = clock()
+            body = get_body_as_text(msg, html_to_text)
+            decoded = clock()
+            decode_seconds += decoded - started
             valid_msg = Message(
                 msg_id=msg['id'],
                 sender=_get_sender(msg),
-                body=_get_body_as_text(msg),
+                body=body,
                 timestamp=int(msg['internalDate'],)
             )
+            validate_seconds += clock() - decoded
             msgs.append(valid_msg)
 
         # If validation fails, save to dead letter queue
@@ -116,8 +489,17 @@ def _get_thread_with_details(
             }
             dlq.append(problem_details)
 
+    started = clock()
     thread = EmailThread(
         thread_id=thread_id, 
         messages=msgs,
+        history_id=response.get('historyId'),
     )
+    n_msgs = len(response['messages'])
+    metrics.record_time('decode_body', decode_seconds, count=n_msgs)
+    metrics.record_time('validate_message', validate_seconds, count=n_msgs)
+    metrics.record_time('build_thread', clock() - started)
+    metrics.increment('threads_parsed')
+    metrics.increment('messages_parsed', n_msgs)
+    metrics.increment('messages_invalid', len(dlq))
     return thread, dlq
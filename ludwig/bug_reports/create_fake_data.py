@@ -17,34 +17,168 @@ model in order to create the fake email texts.
 Because of the latter addition, it would be possible to stop using
 essential_generators: It is only used for generating emails, which could
 likewise be generated by faker. However, this is low priority, because the
-current approach works.
+current approach works. (Since dates are now drawn with NumPy, faker isn't
+used anymore.)
+
+To scale to large datasets (e.g., for load-testing the data pipeline with
+millions of messages), all randomness goes through one seeded
+`FakeMailGenerator`: Labels and dates are drawn with NumPy in one call per
+batch, and texts are generated in batches by a model that's only loaded once.
+Since text generation is still by far the slowest part on a CPU, texts can be
+drawn from a pool of generated texts instead (`text_pool_size`), which makes
+the cost of texts independent of the number of rows.
 """
 
 
+import base64
 import datetime
-from typing import NoReturn, Literal
+import gzip
+import json
+import random
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Literal, NoReturn
 
 import numpy as np
 import pandas as pd
 # import  numpy.typing as npt
 from essential_generators import DocumentGenerator
-from faker import Faker
-from transformers import pipeline
-import torch
 
 N_ROWS: int = 30
-SEED: int = 0  # For numpy, faker, and PyTorch
+SEED: int = 0  # For numpy and PyTorch
 START_DATE: datetime.date = datetime.date(year=2020, month=1, day=1)
-RELATIVE_END_DATE: str = '+2y'
+END_DATE: datetime.date = datetime.date(year=2024, month=1, day=1)
 RELATIVE_OUTPUT_PATH: str = 'bug_reports/data/fake-data.jsonl'
+# Fake mailbox in the shape of Gmail's threads.get responses (one thread per
+# line), for load tests of the data pipeline. Set to 0 to skip. Threads are
+# partly sent from the pipeline's own address, so it finds replies in them.
+N_THREADS: int = 0
+RELATIVE_THREADS_OUTPUT_PATH: str = 'bug_reports/data/fake-threads.jsonl.gz'
+# Must be the address in data-pipeline/domain_models/email_thread.py
+MY_EMAIL_ADDRESS: str = 'thomas.loeber73@gmail.com'
+JSONL_CHUNK_SIZE: int = 10_000  # Rows converted to JSON at once
+
+
+class FakeMailGenerator:
+    """
+    Generates fake emails. Create one instance and reuse it, since it loads
+    the text generation model (once, on first use).
+
+    If `text_pool_size` is given, that many texts are generated up front,
+    and messages draw their text from this pool. Otherwise, every message
+    gets a freshly generated text (which is realistic, but slow).
+    """
+    def __init__(
+        self,
+        seed: int = SEED,
+        text_source: Literal['transformers', 'essential_generators'] =
+            'transformers',
+        text_batch_size: int = 32,
+        text_pool_size: int | None = None,
+        n_senders: int = 1000,
+    ):
+        self.rng: np.random.Generator = np.random.default_rng(seed=seed)
+        self.seed = seed
+        self.text_source = text_source
+        self.text_batch_size = text_batch_size
+        self.text_pool_size = text_pool_size
+        self.n_senders = n_senders
+
+        self._document_generator = DocumentGenerator()
+        # essential_generators draws from the global `random` module, so it
+        # gets its own seeded state (see `_seeded_random()`)
+        self._random_state = random.Random(seed).getstate()
+        self._text_generator = None
+        self._text_pool: np.ndarray | None = None
+        self._senders: np.ndarray | None = None
+
+    def labels(self, n_rows: int, p_reply: float = 0.8) -> np.ndarray:
+        return self.rng.random(n_rows) < p_reply
+
+    def senders(self, n_rows: int) -> np.ndarray:
+        """Drawn from a fixed set of addresses, like a real mailbox."""
+        if self._senders is None:
+            with self._seeded_random():
+                self._senders = np.array([
+                    self._document_generator.email()
+                    for _ in range(self.n_senders)
+                ])
+        return self._senders[self.rng.integers(len(self._senders), size=n_rows)]
+
+    def timestamps(
+        self,
+        n_rows: int,
+        start_date: datetime.date,
+        end_date: datetime.date,
+    ) -> np.ndarray:
+        """Uniformly random times, as `datetime64[s]`."""
+        start, end = np.array([start_date, end_date], dtype='datetime64[s]') \
+            .astype(np.int64)
+        return self.rng.integers(start, end, size=n_rows) \
+            .astype('datetime64[s]')
+
+    def texts(self, n_rows: int) -> np.ndarray:
+        if self.text_pool_size is None:
+            return np.array(self._generate_texts(n_rows), dtype=object)
+
+        if self._text_pool is None:
+            self._text_pool = np.array(
+                self._generate_texts(self.text_pool_size), dtype=object
+            )
+        return self._text_pool[
+            self.rng.integers(len(self._text_pool), size=n_rows)
+        ]
+
+    def _generate_texts(self, n_texts: int) -> list[str]:
+        if self.text_source == 'essential_generators':
+            with self._seeded_random():
+                return [
+                    self._document_generator.paragraph()
+                    for _ in range(n_texts)
+                ]
+
+        texts: list[str] = []
+        while len(texts) < n_texts:
+            batch_size = min(self.text_batch_size, n_texts - len(texts))
+            generated_outputs: list[dict[str, str]] = self._get_text_generator()(
+                '',  # No prompt
+                num_return_sequences=batch_size,
+            )
+            texts.extend(output['generated_text'] for output in generated_outputs)
+        return texts
+
+    @contextmanager
+    def _seeded_random(self) -> Iterator[None]:
+        """
+        Swap this generator's state into the global `random` module, so
+        essential_generators' output only depends on `seed` (and the global
+        state is left as it was).
+        """
+        outer_state = random.getstate()
+        random.setstate(self._random_state)
+        try:
+            yield
+        finally:
+            self._random_state = random.getstate()
+            random.setstate(outer_state)
+
+    def _get_text_generator(self):
+        if self._text_generator is None:
+            # Imported here, since it's slow and only needed for this
+            import torch
+            from transformers import pipeline
+
+            torch.manual_seed(self.seed)
+            self._text_generator = pipeline('text-generation')
+        return self._text_generator
 
 
 def create_full_dataset(
     n_rows: list[int],
     start_date: datetime.date,
-    relative_end_date: str,
+    end_date: datetime.date,
     data_output_path: Path | str,
+    generator: FakeMailGenerator | None = None,
 ) -> None | NoReturn:
     """
     Create fake test data. The training, validation, and test sets will be
@@ -59,61 +193,55 @@ def create_full_dataset(
     """
     # Input validation
     assert len(n_rows) == 3
-
-    df_train: pd.DataFrame = _create_partial_dataset(
-        n_rows=n_rows[0],
-        start_date=start_date,
-        relative_end_date=relative_end_date,
-        split=0
-    )
-
-    df_test: pd.DataFrame = _create_partial_dataset(
-        n_rows=n_rows[1],
-        start_date=start_date,
-        relative_end_date=relative_end_date,
-        split=1
-    )
-
-    df_val: pd.DataFrame = _create_partial_dataset(
-        n_rows=n_rows[2],
-        start_date=start_date,
-        relative_end_date=relative_end_date,
-        split=2
-    )
+    generator = generator or FakeMailGenerator()
 
     df_all: pd.DataFrame = pd.concat(
-        [df_train, df_test, df_val],
+        [
+            _create_partial_dataset(
+                generator,
+                n_rows=n_rows_in_split,
+                start_date=start_date,
+                end_date=end_date,
+                split=split,
+            )
+            for split, n_rows_in_split in enumerate(n_rows)
+        ],
         axis='rows',
     )
 
     print(df_all.head())
 
-    # Write JSONLines
-    with open(data_output_path, 'w') as f:
-        f.write(
-            df_all.to_json(orient='records', lines=True)
-        )
+    # Write JSONLines (in chunks, rather than built as one string)
+    write_jsonl(df_all, data_output_path)
     print(f'Wrote data to {data_output_path}')
 
 
+def write_jsonl(
+    df: pd.DataFrame,
+    output_path: Path | str,
+    chunk_size: int = JSONL_CHUNK_SIZE,
+) -> None:
+    with open(output_path, 'w') as f:
+        for start in range(0, len(df), chunk_size):
+            lines = df.iloc[start:start + chunk_size] \
+                .to_json(orient='records', lines=True)
+            # Older pandas versions omit the final newline
+            f.write(lines if lines.endswith('\n') else lines + '\n')
+
+
 def _create_partial_dataset(
+    generator: FakeMailGenerator,
     n_rows: int,
     start_date: datetime.date,
-    relative_end_date: str,
+    end_date: datetime.date,
     split: Literal[0, 1, 2],
 ) -> pd.DataFrame:
     """
     This helper function create data for EITHER train, test, OR validation set.
     The `split` argument determines which of these will be created.
     """
-
-    # Generate labels
-    replied_to = random_nr_generator.choice(
-        [False, True],
-        size = n_rows,
-        # Todo: create test, val, and train data separately
-        p=[0.2, 0.8],  # Relatively balanced.
-    )
+    # Todo: create test, val, and train data separately
+    replied_to = generator.labels(n_rows, p_reply=0.8)  # Relatively balanced.
     unique_labels = set(replied_to)
     if len(unique_labels) != 2:
         raise Exception(
@@ -121,69 +249,119 @@ def _create_partial_dataset(
             'increase sample size or make class probabilities more balanced.'
         )
 
-    # Generate emails
-    document_generator = DocumentGenerator()
-    sender: list[str] = [
-        document_generator.email() for _ in range(n_rows)
-    ]
-
-    # Generate email text (using Hugging Face transformers)
-    generator = pipeline("text-generation")
-    generated_outputs: list[dict[str, str]] = generator(
-        '',  # No prompt
-        num_return_sequences=n_rows,
+    # Format timestamps as strings. This is necessary when data frame is
+    # converted to JSON lines, because otherwise the time will be converted to
+    # integer (UNIX timestamp).
+    time_received = np.datetime_as_string(
+        generator.timestamps(n_rows, start_date, end_date)
     )
+    time_received = np.char.replace(time_received.astype(str), 'T', ' ')
 
-    email_body: list[str] = [
-        output['generated_text'] for output in generated_outputs
-    ]
-
-
-    # Generate timestamp
-    time_received: list[str] = [
-        _generate_random_datetime_string(
-            start_date=start_date,
-            relative_end_date=relative_end_date,
-        )
-        for _ in range(n_rows)
-    ]
-
-
-    # Combine into data frame
-    df = pd.DataFrame({
+    return pd.DataFrame({
         'replied_to': replied_to,
-        'sender':sender,
-        'body': email_body,
+        'sender': generator.senders(n_rows),
+        'body': generator.texts(n_rows),
         'split': split,
         'time_received': time_received,
     })
-    return df
 
 
-def _generate_random_datetime_string(
-    start_date: datetime.date | datetime.datetime,
-    relative_end_date: str,
-) -> str:
+def generate_threads(
+    generator: FakeMailGenerator,
+    n_threads: int,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    my_email_address: str = MY_EMAIL_ADDRESS,
+    max_messages_per_thread: int = 6,
+    p_my_message: float = 0.2,
+    batch_size: int = 10_000,
+) -> Iterator[dict]:
     """
-    Generate random daytime and convert to string.
-
-    This is necessary when data frame is converted to JSON lines, because
-    otherwise the time will be converted to integer (UNIX timestamp).
+    Yields fake threads in the shape of Gmail's threads.get responses, with
+    a random number of messages, some of which are sent by me. Threads are
+    generated in batches of `batch_size`, so memory stays flat.
     """
-    random_datetime = fake_data_generator.date_time_between(
-            start_date=start_date,
-            end_date=relative_end_date,
+    for first_thread in range(0, n_threads, batch_size):
+        n_batch_threads = min(batch_size, n_threads - first_thread)
+        n_messages = generator.rng.integers(
+            1, max_messages_per_thread + 1, size=n_batch_threads
         )
-    return f'{random_datetime:%Y-%m-%d %H:%M:%S}'
-
+        n_batch_messages = int(n_messages.sum())
+
+        # Messages of a thread follow each other within a few hours
+        thread_starts = generator.timestamps(
+            n_batch_threads, start_date, end_date
+        ).astype(np.int64)
+        gaps = generator.rng.exponential(3600, size=n_batch_messages) \
+            .astype(np.int64)
+        thread_of_message = np.repeat(np.arange(n_batch_threads), n_messages)
+        first_message = np.concatenate([[0], np.cumsum(n_messages)[:-1]])
+        offsets = np.cumsum(gaps) - np.repeat(
+            np.cumsum(gaps)[first_message] - gaps[first_message], n_messages
+        )
+        timestamps_ms = (thread_starts[thread_of_message] + offsets) * 1000
 
-if __name__ == '__main__':
-    random_nr_generator: np.random.Generator = np.random.default_rng(seed=SEED)
-    fake_data_generator = Faker()
-    Faker.seed(SEED)
-    torch.manual_seed(SEED)
+        is_mine = generator.rng.random(n_batch_messages) < p_my_message
+        senders = np.where(
+            is_mine, my_email_address, generator.senders(n_batch_messages)
+        )
+        texts = generator.texts(n_batch_messages)
+
+        for i in range(n_batch_threads):
+            thread_id = f'{first_thread + i:016x}'
+            start = first_message[i]
+            yield {
+                'id': thread_id,
+                'historyId': str(first_thread + i + 1),
+                'messages': [
+                    _gmail_message(
+                        msg_id=f'{thread_id}-{j:02d}',
+                        thread_id=thread_id,
+                        sender=str(senders[start + j]),
+                        text=texts[start + j],
+                        timestamp_ms=int(timestamps_ms[start + j]),
+                    )
+                    for j in range(n_messages[i])
+                ],
+            }
+
+
+def write_threads(threads: Iterator[dict], output_path: Path | str) -> int:
+    """Write one thread per line (gzipped if path ends with `.gz`)."""
+    open_ = gzip.open if str(output_path).endswith('.gz') else open
+    n_threads = 0
+    with open_(output_path, 'wt') as f:
+        for thread in threads:
+            f.write(json.dumps(thread) + '\n')
+            n_threads += 1
+    return n_threads
+
+
+def _gmail_message(
+    msg_id: str,
+    thread_id: str,
+    sender: str,
+    text: str,
+    timestamp_ms: int,
+) -> dict:
+    return {
+        'id': msg_id,
+        'threadId': thread_id,
+        'internalDate': str(timestamp_ms),
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [
+                {'name': 'From', 'value': sender},
+                {'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'},
+            ],
+            'body': {
+                'data': base64.urlsafe_b64encode(text.encode()).decode(),
+            },
+        },
+    }
 
 
+if __name__ == '__main__':
     # Even though utils/absolute_paths.py doors this variable, we cannot access
     # this module easily from here (because relative imports only work from
     # library files, not files run directly). The simplest solution is to simply
@@ -196,9 +374,22 @@ if __name__ == '__main__':
     )
     absolute_data_output_path: Path = LUDWIG_ROOT_DIR / RELATIVE_OUTPUT_PATH
 
+    fake_mail_generator = FakeMailGenerator(seed=SEED)
     create_full_dataset(
         n_rows=[10, 10, 10],
         start_date=START_DATE,
-        relative_end_date=RELATIVE_END_DATE,
+        end_date=END_DATE,
         data_output_path=absolute_data_output_path,
+        generator=fake_mail_generator,
     )
+
+    if N_THREADS:
+        # Draw texts from a pool, so millions of messages are feasible on CPU
+        thread_generator = FakeMailGenerator(seed=SEED, text_pool_size=1000)
+        n_written = write_threads(
+            generate_threads(
+                thread_generator, N_THREADS, START_DATE, END_DATE
+            ),
+            LUDWIG_ROOT_DIR / RELATIVE_THREADS_OUTPUT_PATH,
+        )
+        print(f'Wrote {n_written} threads')
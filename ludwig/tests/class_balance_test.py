@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+
+def test_balanced_weight_is_computed_from_training_split(tmp_path):
+    from utils.class_balance import resolve_balanced_weights
+
+    dataset = tmp_path / 'input.jsonl'
+    rows = [
+        {'replied_to': True, 'split': 0},
+        {'replied_to': False, 'split': 0},
+        {'replied_to': False, 'split': 0},
+        {'replied_to': False, 'split': 0},
+        # Other splits don't count
+        {'replied_to': True, 'split': 1},
+    ]
+    dataset.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    config = {
+        'preprocessing': {'split': {'type': 'fixed', 'column': 'split'}},
+        'output_features': [{
+            'name': 'replied_to',
+            'type': 'binary',
+            'loss': {
+                'type': 'binary_weighted_cross_entropy',
+                'positive_class_weight': 'balanced',
+            },
+        }],
+    }
+
+    resolved = resolve_balanced_weights(config, dataset)
+
+    assert resolved['output_features'][0]['loss']['positive_class_weight'] == 3
+    # Original config is left as is
+    assert config['output_features'][0]['loss']['positive_class_weight'] == \
+        'balanced'
+
+    dataset.write_text(json.dumps({'replied_to': False, 'split': 0}) + '\n')
+    with pytest.raises(ValueError):
+        resolve_balanced_weights(config, dataset)
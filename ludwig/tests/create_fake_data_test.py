@@ -0,0 +1,72 @@
+import base64
+import json
+import datetime
+
+import pytest
+
+# Only installed in the Pipenv environment
+pytest.importorskip('essential_generators')
+
+START_DATE = datetime.date(2020, 1, 1)
+END_DATE = datetime.date(2021, 1, 1)
+
+
+def _generator(seed: int = 0):
+    from bug_reports.create_fake_data import FakeMailGenerator
+
+    return FakeMailGenerator(
+        seed=seed, text_source='essential_generators', text_pool_size=10
+    )
+
+
+def test_threads_are_deterministic():
+    from bug_reports.create_fake_data import generate_threads
+
+    threads = list(generate_threads(_generator(), 50, START_DATE, END_DATE))
+    rerun = list(generate_threads(_generator(), 50, START_DATE, END_DATE))
+
+    assert [t['id'] for t in threads] == [t['id'] for t in rerun]
+    assert _messages(threads) == _messages(rerun)
+
+
+def _messages(threads: list[dict]) -> list[tuple[str, str, bytes]]:
+    """Date, sender header, and decoded body of every message."""
+    return [
+        (
+            message['internalDate'],
+            message['payload']['headers'][0]['value'],
+            base64.urlsafe_b64decode(message['payload']['body']['data']),
+        )
+        for thread in threads
+        for message in thread['messages']
+    ]
+
+
+def test_threads_look_like_gmail_responses():
+    from bug_reports.create_fake_data import generate_threads
+
+    threads = list(generate_threads(
+        _generator(), 25, START_DATE, END_DATE, batch_size=10
+    ))
+
+    assert len(threads) == len({t['id'] for t in threads}) == 25
+    for thread in threads:
+        dates = [int(m['internalDate']) for m in thread['messages']]
+        assert dates == sorted(dates)
+        for message in thread['messages']:
+            assert message['threadId'] == thread['id']
+            text = base64.urlsafe_b64decode(message['payload']['body']['data'])
+            assert text.decode()
+
+
+def test_dataset_is_written_as_json_lines(tmp_path):
+    from bug_reports.create_fake_data import create_full_dataset
+
+    path = tmp_path / 'fake-data.jsonl'
+    create_full_dataset([10, 10, 10], START_DATE, END_DATE, path, _generator())
+
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(rows) == 30
+    assert {row['split'] for row in rows} == {0, 1, 2}
+    assert set(rows[0]) == \
+        {'replied_to', 'sender', 'body', 'split', 'time_received'}
@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+
+
+def _write(path: Path, text: str) -> Path:
+    path.write_text(text)
+    return path
+
+
+def test_cache_entry_depends_on_data_and_preprocessing_config(tmp_path):
+    from utils.preprocessing_cache import PreprocessingCache
+
+    cache = PreprocessingCache(tmp_path / 'cache')
+    dataset = _write(tmp_path / 'input.jsonl', '{"body": "Hi"}\n')
+    config = _write(
+        tmp_path / 'config.yaml',
+        'input_features:\n  - name: body\n    type: text\n'
+        'trainer:\n  epochs: 1\n',
+    )
+
+    cached = cache.get_dataset_path(dataset, config)
+    assert cached.name == 'input.jsonl'
+    assert cached.read_text() == dataset.read_text()
+    # Ludwig's preprocessed files end up next to the cached dataset
+    _write(cached.parent / 'input.training.hdf5', 'preprocessed')
+
+    # Training parameters don't change the preprocessed data
+    _write(
+        config,
+        'trainer:\n  epochs: 5\n'
+        'input_features:\n  - {name: body, type: text}\n',
+    )
+    assert cache.get_dataset_path(dataset, config) == cached
+
+    # Neither do losses
+    _write(
+        config,
+        'input_features:\n  - {name: body, type: text}\n'
+        'output_features:\n  - {name: replied_to, type: binary}\n',
+    )
+    with_output = cache.get_dataset_path(dataset, config)
+    _write(
+        config,
+        'input_features:\n  - {name: body, type: text}\n'
+        'output_features:\n  - name: replied_to\n    type: binary\n'
+        '    loss: {positive_class_weight: 3.0}\n',
+    )
+    assert cache.get_dataset_path(dataset, config) == with_output
+
+    _write(config, 'input_features:\n  - name: body\n    type: sequence\n')
+    other_config = cache.get_dataset_path(dataset, config)
+    _write(dataset, '{"body": "Bye"}\n')
+    other_data = cache.get_dataset_path(dataset, config)
+    assert len({cached, with_output, other_config, other_data}) == 4
+    assert len(cache.entries()) == 4
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    from utils.preprocessing_cache import PreprocessingCache
+
+    cache = PreprocessingCache(tmp_path / 'cache')
+    config = _write(tmp_path / 'config.yaml', 'preprocessing: {}\n')
+    entries = []
+    for i in range(3):
+        dataset = _write(tmp_path / f'input{i}.jsonl', f'{i}' * 10)
+        entries.append(cache.get_dataset_path(dataset, config).parent)
+        # Make last use times distinct, even on coarse file systems
+        os.utime(entries[-1], (i, i))
+    # Use first entry again
+    cache.get_dataset_path(tmp_path / 'input0.jsonl', config)
+
+    cache.max_bytes = 25
+    assert cache.evict() == [entries[1]]
+    assert cache.entries() == [entries[2], entries[0]]
+    assert cache.size() == 20
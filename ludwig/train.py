@@ -0,0 +1,55 @@
+"""
+Entry point for training: Runs `ludwig train` on a dataset, via the managed
+preprocessing cache (see utils/preprocessing_cache.py), so Ludwig reuses
+datasets it already preprocessed with the same config. Class weights set to
+`balanced` in the config are computed from the dataset first (see
+utils/class_balance.py).
+
+Usage (any other arguments are passed on to `ludwig train`):
+    python train.py --config config.yaml --dataset <path>
+"""
+
+import argparse
+import subprocess
+
+import yaml
+
+from utils.class_balance import resolve_balanced_weights, uses_balanced_weights
+from utils.preprocessing_cache import DEFAULT_MAX_BYTES, PreprocessingCache
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--config', required=True)
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument(
+        '--max_cache_bytes',
+        type=int,
+        default=DEFAULT_MAX_BYTES,
+        help='Size budget of the preprocessing cache.',
+    )
+    args, ludwig_args = parser.parse_known_args(argv)
+
+    cache = PreprocessingCache(max_bytes=args.max_cache_bytes)
+    dataset_path = cache.get_dataset_path(args.dataset, args.config)
+    print(f'Using cached dataset {dataset_path}')
+
+    config_path = args.config
+    with open(config_path, 'r') as f:
+        config: dict = yaml.safe_load(f)
+    if uses_balanced_weights(config):
+        # Next to the cached dataset, since weights depend on it
+        config_path = str(dataset_path.parent / 'config-resolved.yaml')
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(resolve_balanced_weights(config, dataset_path), f)
+
+    return subprocess.call([
+        'ludwig', 'train',
+        '--config', config_path,
+        '--dataset', str(dataset_path),
+        *ludwig_args,
+    ])
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+"""
+Class balancing through the loss, rather than Ludwig's `oversample_minority`,
+which duplicates rows of the minority class in the preprocessed data (and so
+inflates the HDF5 files in the preprocessing cache by the oversampling
+factor). Weighing the positive class of a binary output feature by the ratio
+of negative to positive examples has the same effect on the loss as
+oversampling it to a 50% share.
+
+In the config, set an output feature's loss to
+
+    loss:
+      type: binary_weighted_cross_entropy
+      positive_class_weight: balanced
+
+and train.py replaces `balanced` with the ratio in the training split.
+"""
+
+import copy
+import json
+from pathlib import Path
+
+BALANCED: str = 'balanced'
+TRAINING_SPLIT: int = 0
+
+
+def count_labels(
+    dataset_path: Path | str,
+    label_column: str,
+    split_column: str | None = None,
+) -> tuple[int, int]:
+    """
+    Returns the numbers of negative and positive examples in the training
+    split of a JSON Lines dataset (or in all rows, if there's no split).
+    """
+    n_negative = n_positive = 0
+    with open(dataset_path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if split_column is not None and row[split_column] != TRAINING_SPLIT:
+                continue
+            if row[label_column]:
+                n_positive += 1
+            else:
+                n_negative += 1
+    return n_negative, n_positive
+
+
+def resolve_balanced_weights(config: dict, dataset_path: Path | str) -> dict:
+    """Returns copy of `config` in which `balanced` weights are numbers."""
+    config = copy.deepcopy(config)
+    split = (config.get('preprocessing') or {}).get('split') or {}
+    split_column = split.get('column') if split.get('type') == 'fixed' else None
+
+    for feature in config.get('output_features', []):
+        loss = feature.get('loss') or {}
+        if loss.get('positive_class_weight') != BALANCED:
+            continue
+
+        n_negative, n_positive = count_labels(
+            dataset_path, feature['name'], split_column
+        )
+        if not n_positive:
+            raise ValueError(
+                f"No positive examples of '{feature['name']}' to balance."
+            )
+        loss['positive_class_weight'] = n_negative / n_positive
+    return config
+
+
+def uses_balanced_weights(config: dict) -> bool:
+    return any(
+        (feature.get('loss') or {}).get('positive_class_weight') == BALANCED
+        for feature in config.get('output_features', [])
+    )
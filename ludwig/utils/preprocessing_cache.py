@@ -0,0 +1,145 @@
+"""
+Managed cache of the datasets Ludwig preprocesses (HDF5 and metadata files).
+
+Ludwig writes its preprocessed files next to the dataset, and only reuses
+them for the exact same dataset path. So rather than deleting them after each
+experiment (and redoing BERT tokenization every time), each combination of
+dataset and preprocessing-relevant config gets its own cache entry: a
+directory named after their fingerprint, holding a copy of the dataset.
+Training on the dataset in that directory lets Ludwig find its earlier
+preprocessed files. Least recently used entries are evicted once the cache
+exceeds its size budget.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import yaml
+
+from utils.absolute_paths import LUDWIG_ROOT_DIR
+
+DEFAULT_CACHE_DIR: Path = LUDWIG_ROOT_DIR / 'cache'
+DEFAULT_MAX_BYTES: int = 20 * 2**30  # 20 GiB
+
+# Config sections that change the preprocessed data (rather than training)
+FEATURE_SECTIONS: tuple[str, ...] = ('input_features', 'output_features')
+PREPROCESSING_SECTIONS: tuple[str, ...] = (*FEATURE_SECTIONS, 'preprocessing')
+# Keys of a feature that change its preprocessed data (rather than, e.g., its
+# loss). Pretrained encoders, like BERT, come with their own tokenizer.
+FEATURE_PREPROCESSING_KEYS: tuple[str, ...] = (
+    'name', 'type', 'preprocessing', 'encoder',
+)
+
+
+def fingerprint(dataset_path: Path | str, config_path: Path | str) -> str:
+    """Hash of dataset contents and the preprocessing parts of the config."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(dataset_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+
+    with open(config_path, 'r') as f:
+        config: dict = yaml.safe_load(f) or {}
+    relevant_config = {
+        section: config.get(section) for section in PREPROCESSING_SECTIONS
+    }
+    for section in FEATURE_SECTIONS:
+        if relevant_config[section] is not None:
+            relevant_config[section] = [
+                {
+                    key: feature[key] for key in FEATURE_PREPROCESSING_KEYS
+                    if key in feature
+                }
+                for feature in relevant_config[section]
+            ]
+    # Sorted keys, so formatting and key order in the YAML file don't matter
+    digest.update(json.dumps(relevant_config, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class PreprocessingCache:
+    def __init__(
+        self,
+        cache_dir: Path | str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def get_dataset_path(
+        self,
+        dataset_path: Path | str,
+        config_path: Path | str,
+    ) -> Path:
+        """
+        Returns path Ludwig should train on. If the dataset was preprocessed
+        with the same config before, Ludwig's preprocessed files are next to
+        it.
+        """
+        dataset_path = Path(dataset_path)
+        entry = self.cache_dir / fingerprint(dataset_path, config_path)
+        cached_dataset_path = entry / dataset_path.name
+
+        if not cached_dataset_path.exists():
+            entry.mkdir(parents=True, exist_ok=True)
+            _copy(dataset_path, cached_dataset_path)
+
+        # Directory's modification time records when it was last used
+        os.utime(entry)
+        self.evict(keep=entry)
+        return cached_dataset_path
+
+    def entries(self) -> list[Path]:
+        """Cache entries, least recently used first."""
+        if not self.cache_dir.exists():
+            return []
+        return sorted(
+            (path for path in self.cache_dir.iterdir() if path.is_dir()),
+            key=lambda path: path.stat().st_mtime,
+        )
+
+    def size(self) -> int:
+        return sum(_directory_size(entry) for entry in self.entries())
+
+    def evict(self, keep: Path | None = None) -> list[Path]:
+        """
+        Delete least recently used entries (except `keep`) until the cache
+        fits its size budget. Returns the deleted entries.
+        """
+        entries = self.entries()
+        sizes = {entry: _directory_size(entry) for entry in entries}
+        total_size = sum(sizes.values())
+
+        evicted = []
+        for entry in entries:
+            if total_size <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= sizes[entry]
+            evicted.append(entry)
+        return evicted
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def _copy(source: Path, destination: Path) -> None:
+    # Copy rather than hard link, so the entry can't change if the original
+    # dataset is overwritten in place
+    tmp_destination = destination.with_name(destination.name + '.tmp')
+    shutil.copyfile(source, tmp_destination)
+    os.replace(tmp_destination, destination)
+
+
+def _directory_size(path: Path) -> int:
+    size = 0
+    for file in path.rglob('*'):
+        if file.is_file():
+            size += file.stat().st_size
+    return size
+